@@ -5,11 +5,47 @@
 
 import json
 import logging
+from typing import List
 from sqlalchemy.orm import Session
 from db_models import LogEntry, CustomerRegistration
 
 logger = logging.getLogger("AuditLog")
 
+def build_log_entry(search_data: dict, user_decision: str = None) -> LogEntry:
+    """
+    Builds the LogEntry row of a search, with every text field made UTF-8 safe.
+    
+    Args:
+        search_data (dict): Search data including query and results
+        user_decision (str, optional): User's decision ("match", "no_match", or None)
+    """
+    # Encode all fields to UTF-8 safely
+    query_name = search_data["query"]["name"].encode("utf-8", "ignore").decode("utf-8")
+    query_surname = search_data["query"]["surname"].encode("utf-8", "ignore").decode("utf-8")
+    threshold = str(search_data["query"]["threshold"])
+    phonetic = str(search_data["query"]["phonetic"])
+
+    # Convert matches into a JSON string
+    matches_json = json.dumps(search_data["result"]["matches"], ensure_ascii=False).encode("utf-8", "ignore").decode("utf-8")
+
+    # Ensure the status field is UTF-8 encoded
+    status = search_data["result"]["status"].encode("utf-8", "ignore").decode("utf-8")
+
+    # Dataset generation the search ran against, when known
+    dataset = search_data.get("dataset") or {}
+
+    return LogEntry(
+        query_name=query_name,
+        query_surname=query_surname,
+        threshold=threshold,
+        phonetic=phonetic,
+        matches=matches_json,
+        status=status,
+        user_decision=user_decision,
+        dataset_version=dataset.get("version"),
+        dataset_built_at=dataset.get("built_at")
+    )
+
 def log_search(db: Session, search_data: dict, user_decision: str = None):
     """
     Persists a search log entry in the PostgreSQL database.
@@ -27,31 +63,11 @@ def log_search(db: Session, search_data: dict, user_decision: str = None):
         if user_decision:
             logger.info(f"User Decision: {user_decision}")
 
-        # Encode all fields to UTF-8 safely
-        query_name = search_data["query"]["name"].encode("utf-8", "ignore").decode("utf-8")
-        query_surname = search_data["query"]["surname"].encode("utf-8", "ignore").decode("utf-8")
-        threshold = str(search_data["query"]["threshold"])
-        phonetic = str(search_data["query"]["phonetic"])
-
-        # Convert matches into a JSON string and print it
-        matches_json = json.dumps(search_data["result"]["matches"], ensure_ascii=False).encode("utf-8", "ignore").decode("utf-8")
-        logger.info(f"Processed Matches JSON: {matches_json}")
-
-        # Ensure the status field is UTF-8 encoded
-        status = search_data["result"]["status"].encode("utf-8", "ignore").decode("utf-8")
+        entry = build_log_entry(search_data, user_decision)
 
         # Print final log entry before inserting into DB
-        logger.info(f"Final Log Entry -> Name: {query_name}, Surname: {query_surname}, Matches: {matches_json}")
-
-        entry = LogEntry(
-            query_name=query_name,
-            query_surname=query_surname,
-            threshold=threshold,
-            phonetic=phonetic,
-            matches=matches_json,
-            status=status,
-            user_decision=user_decision
-        )
+        logger.info(f"Processed Matches JSON: {entry.matches}")
+        logger.info(f"Final Log Entry -> Name: {entry.query_name}, Surname: {entry.query_surname}, Matches: {entry.matches}")
 
         db.add(entry)
         db.commit()
@@ -67,6 +83,27 @@ def log_search(db: Session, search_data: dict, user_decision: str = None):
 
     return entry
 
+def log_search_bulk(db: Session, searches: List[dict]) -> List[LogEntry]:
+    """
+    Persists the search log entries of a batch screening in a single commit.
+    
+    Args:
+        db (Session): SQLAlchemy database session
+        searches (list): Search data of each screened row, as passed to log_search
+    """
+    try:
+        entries = [build_log_entry(search_data) for search_data in searches]
+        db.add_all(entries)
+        db.commit()
+        logger.info(f"Logged {len(entries)} batch searches")
+    
+    except Exception as e:
+        db.rollback()
+        logger.error(f"❌ Error logging batch searches: {e}")
+        raise e
+
+    return entries
+
 def log_registration(db: Session, search_log_id: int, registration_data: dict, document_paths: list, pdf_path: str = None):
     """
     Persists a customer registration entry in the PostgreSQL database.
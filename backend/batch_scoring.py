@@ -0,0 +1,372 @@
+
+
+# batch_scoring.py
+
+import os
+import copy
+import logging
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+from rapidfuzz import fuzz, process
+
+from token_cache import TokenScoreCache
+
+logger = logging.getLogger("ComplianceService")
+
+# Threads rapidfuzz may use for one cdist call (-1 = all cores)
+SCORING_WORKERS = int(os.getenv("SCORING_WORKERS", "-1"))
+
+# Margin below the exact score cutoffs, so float rounding never drops a real match
+CUTOFF_MARGIN = 1e-6
+
+# Queries scored against at least this share of a name column's distinct names
+# score their tokens against all of them and memoize that (see TokenScoreCache)
+TOKEN_CACHE_MIN_SHARE = 0.5
+
+class ScoringEngine:
+    """
+    Columnar copy of the match views of a loaded dataset, scored with
+    rapidfuzz.process.cdist instead of one fuzz.ratio call per pair.
+
+    Produces the same per-record score as matching.match_record for every
+    record that reaches the query threshold. Scores below the threshold may
+    come out lower than match_record's, because cdist drops pairs under the
+    score cutoff that cannot contribute to a match.
+
+    Query tokens are scored once against each distinct first name and surname
+    (`name_vocab`, `surname_vocab`), and those scores are memoized across
+    requests in `token_cache`.
+    """
+
+    def __init__(self, records: Sequence, workers: int = SCORING_WORKERS):
+        self.workers = workers
+        count = len(records)
+
+        # Record columns: person name parts ("" for non-person records)
+        self.is_person = np.zeros(count, dtype=bool)
+        names, name_keys, surnames, surname_keys = [], [], [], []
+
+        # Variant columns: every string compared with the full query (full name,
+        # reversed name, aliases, reversed aliases), grouped by record
+        texts, keys = [], []
+        self.variant_offsets = np.zeros(count + 1, dtype=np.int64)
+
+        # Entity name forms of non-person records, compared with the query's, grouped by record
+        entity_texts, entity_keys = [], []
+        self.entity_offsets = np.zeros(count + 1, dtype=np.int64)
+
+        for position, record in enumerate(records):
+            view = record.match_view
+            self.is_person[position] = record.schema.lower() == "person"
+            names.append(view.name)
+            name_keys.append(view.name_key)
+            surnames.append(view.surname)
+            surname_keys.append(view.surname_key)
+
+            for text, key in ((view.full_name, view.full_name_key), (view.reversed_name, view.reversed_name_key),
+                              *zip(view.aliases, view.alias_keys),
+                              *zip(view.reversed_aliases, view.reversed_alias_keys)):
+                if text:
+                    texts.append(text)
+                    keys.append(key)
+            self.variant_offsets[position + 1] = len(texts)
+            entity_texts.extend(view.entity_names)
+            entity_keys.extend(view.entity_name_keys)
+            self.entity_offsets[position + 1] = len(entity_texts)
+
+        self.names = np.array(names, dtype=object)
+        self.name_keys = np.array(name_keys, dtype=str)
+        self.surnames = np.array(surnames, dtype=object)
+        self.surname_keys = np.array(surname_keys, dtype=str)
+        self.variant_texts = np.array(texts, dtype=object)
+        self.variant_keys = np.array(keys, dtype=str)
+        self.entity_texts = np.array(entity_texts, dtype=object)
+        self.entity_keys = np.array(entity_keys, dtype=str)
+
+        # Lengths for the score upper bounds
+        self.name_lengths = np.array([len(n) for n in names], dtype=np.int64)
+        self.surname_lengths = np.array([len(n) for n in surnames], dtype=np.int64)
+        self.variant_lengths = np.array([len(t) for t in texts], dtype=np.int64)
+        self.entity_lengths = np.array([len(t) for t in entity_texts], dtype=np.int64)
+
+        # Distinct first names and surnames with their keys, and each record's index into them
+        self.name_vocab, self.name_vocab_keys, self.name_codes = _vocabulary(self.names, self.name_keys)
+        self.surname_vocab, self.surname_vocab_keys, self.surname_codes = _vocabulary(self.surnames, self.surname_keys)
+        self.token_cache = TokenScoreCache()
+
+        logger.info(f"Built scoring engine: {count} records, {len(texts)} name variants")
+
+    def extended(self, records: Sequence) -> "ScoringEngine":
+        """Copy of the engine with `records` at the positions after its own; this engine stays unchanged."""
+        added = ScoringEngine(records, self.workers)
+        other = copy.copy(self)
+        for column in ("is_person", "names", "name_keys", "surnames", "surname_keys", "variant_texts",
+                       "variant_keys", "entity_texts", "entity_keys", "name_lengths", "surname_lengths",
+                       "variant_lengths", "entity_lengths"):
+            setattr(other, column, np.concatenate([getattr(self, column), getattr(added, column)]))
+        for column in ("variant_offsets", "entity_offsets"):
+            offsets, added_offsets = getattr(self, column), getattr(added, column)
+            setattr(other, column, np.concatenate([offsets, added_offsets[1:] + offsets[-1]]))
+        # Added names extend the vocabularies, even those already in them
+        for column in ("name", "surname"):
+            vocab, added_vocab = getattr(self, f"{column}_vocab"), getattr(added, f"{column}_vocab")
+            setattr(other, f"{column}_vocab", np.concatenate([vocab, added_vocab]))
+            setattr(other, f"{column}_vocab_keys",
+                    np.concatenate([getattr(self, f"{column}_vocab_keys"), getattr(added, f"{column}_vocab_keys")]))
+            setattr(other, f"{column}_codes",
+                    np.concatenate([getattr(self, f"{column}_codes"), getattr(added, f"{column}_codes") + len(vocab)]))
+        other.token_cache = TokenScoreCache()
+        return other
+
+    def freeze(self) -> None:
+        """
+        Store the string columns as fixed-width numpy arrays instead of Python
+        strings, so a snapshot can keep every column out of band and memory-mapped.
+        """
+        for column in ("names", "surnames", "variant_texts", "entity_texts", "name_vocab", "surname_vocab"):
+            setattr(self, column, getattr(self, column).astype(str))
+
+    def score(self, query, positions: Optional[np.ndarray] = None, min_score: Optional[float] = None,
+              scan_size: Optional[int] = None) -> np.ndarray:
+        """
+        Score one compiled query against the records at `positions` (all records
+        when None). Returns one score per record, in `positions` order.
+        """
+        return self.score_many([query], positions, min_score, scan_size)[0]
+
+    def score_many(self, queries: List, positions: Optional[np.ndarray] = None,
+                   min_score: Optional[float] = None, scan_size: Optional[int] = None) -> np.ndarray:
+        """
+        Score several compiled queries against the records at `positions` (all
+        records when None). Returns a (len(queries), len(positions)) array.
+        Scores are exact from `min_score` up (default: the lowest query threshold).
+        `scan_size` is the number of records the queries are scored against in
+        all, when `positions` is one chunk of them; it decides whether token
+        scores are memoized (default: len(positions)).
+        """
+        if positions is None:
+            positions = np.arange(len(self.is_person))
+        positions = np.asarray(positions, dtype=np.int64)
+        if scan_size is None:
+            scan_size = len(positions)
+        scores = np.zeros((len(queries), len(positions)))
+        if not len(positions):
+            return scores
+
+        # Empty queries score 0 against everything, as in match_record
+        active = [i for i, q in enumerate(queries) if q.text]
+        if not active:
+            return scores
+        queries = [queries[i] for i in active]
+
+        # Lowest final score a comparison (or a part of a two-part average) can
+        # have and still matter; everything below may be dropped by cdist.
+        threshold = min(q.threshold for q in queries) if min_score is None else min_score
+        use_phonetic = any(q.use_phonetic for q in queries)
+        cutoff = _text_cutoff(threshold, use_phonetic)
+        part_cutoff = _text_cutoff(2 * threshold - 100, use_phonetic)
+
+        result = self._score_variants(queries, positions, cutoff)
+        np.maximum(result, self._score_groups([q.entity_name for q in queries], [q.entity_name_key for q in queries],
+                                              queries, positions, cutoff, self.entity_offsets, self.entity_texts,
+                                              self.entity_keys), out=result)
+
+        # Worth scoring the query tokens against every distinct name once
+        memoize = {column: self.token_cache.max_bytes > 0
+                   and scan_size >= TOKEN_CACHE_MIN_SHARE * len(getattr(self, f"{column}_vocab"))
+                   for column in ("name", "surname")}
+
+        for row, query in enumerate(queries):
+            best = result[row]
+
+            if len(query.tokens) == 1:
+                # Single word query - check against both name and surname, slightly reduced weight
+                name_score = self._pair_scores([query.text], [query.key], "name", positions,
+                                               query.use_phonetic, cutoff, memoize)[0]
+                surname_score = self._pair_scores([query.text], [query.key], "surname", positions,
+                                                  query.use_phonetic, cutoff, memoize)[0]
+                np.maximum(best, name_score * 0.9, out=best)
+                np.maximum(best, surname_score * 0.9, out=best)
+
+            elif len(query.tokens) >= 2:
+                # Part combinations, as in match_name_parts
+                token_names = self._pair_scores(query.tokens, query.token_keys, "name", positions,
+                                                query.use_phonetic, part_cutoff, memoize)
+                token_surnames = self._pair_scores(query.tokens, query.token_keys, "surname", positions,
+                                                   query.use_phonetic, part_cutoff, memoize)
+                rest_surname = self._pair_scores([query.rest], [query.rest_key], "surname", positions,
+                                                 query.use_phonetic, part_cutoff, memoize)[0]
+                other_names = self._pair_scores(query.others, query.other_keys, "name", positions,
+                                                query.use_phonetic, part_cutoff, memoize)
+
+                # First part against the first name, the rest against the surname
+                first = token_names[0]
+                np.maximum(best, np.where(first > 70, (first + rest_surname) / 2, 0.0), out=best)
+
+                # Any part against the surname, the other parts against the first name
+                for i in range(len(query.tokens)):
+                    part = token_surnames[i]
+                    np.maximum(best, np.where(part > 70, (part + other_names[i]) / 2, 0.0), out=best)
+
+        scores[active] = result
+        return scores
+
+    def upper_bounds(self, query, positions: np.ndarray) -> np.ndarray:
+        """
+        Highest score each record at `positions` could reach against a compiled
+        query, from string lengths alone. Never below the record's real score.
+        """
+        bounds = np.zeros(len(positions))
+        if not query.text or not len(positions):
+            return bounds
+        use_phonetic = query.use_phonetic
+
+        variant_ids, group_starts, nonempty = self._variant_groups(positions)
+        if len(variant_ids):
+            lengths = _ratio_bound(len(query.text), self.variant_lengths[variant_ids], use_phonetic)
+            bounds[nonempty] = np.maximum.reduceat(lengths, group_starts[nonempty])
+        entity_ids, group_starts, nonempty = self._variant_groups(positions, self.entity_offsets)
+        if len(entity_ids):
+            lengths = _ratio_bound(len(query.entity_name), self.entity_lengths[entity_ids], use_phonetic)
+            bounds[nonempty] = np.maximum(bounds[nonempty], np.maximum.reduceat(lengths, group_starts[nonempty]))
+
+        names = self.name_lengths[positions]
+        surnames = self.surname_lengths[positions]
+        if len(query.tokens) == 1:
+            np.maximum(bounds, 0.9 * _ratio_bound(len(query.text), names, use_phonetic), out=bounds)
+            np.maximum(bounds, 0.9 * _ratio_bound(len(query.text), surnames, use_phonetic), out=bounds)
+        elif len(query.tokens) >= 2:
+            first = _ratio_bound(len(query.tokens[0]), names, use_phonetic)
+            np.maximum(bounds, (first + _ratio_bound(len(query.rest), surnames, use_phonetic)) / 2, out=bounds)
+            for token, other in zip(query.tokens, query.others):
+                part = _ratio_bound(len(token), surnames, use_phonetic)
+                np.maximum(bounds, (part + _ratio_bound(len(other), names, use_phonetic)) / 2, out=bounds)
+        return bounds
+
+    def _variant_groups(self, positions: np.ndarray, offsets: Optional[np.ndarray] = None):
+        """
+        Flat indices of the variants (or the strings of other grouped columns,
+        by their `offsets`) of the records at `positions`, still grouped by
+        record, with the start of each record's run and which runs are non-empty.
+        """
+        if offsets is None:
+            offsets = self.variant_offsets
+        starts = offsets[positions]
+        counts = offsets[positions + 1] - starts
+        group_starts = np.cumsum(counts) - counts
+        variant_ids = np.arange(int(counts.sum())) - np.repeat(group_starts - starts, counts)
+        return variant_ids, group_starts, counts > 0
+
+    def _score_variants(self, queries: List, positions: np.ndarray, cutoff: float) -> np.ndarray:
+        """Best score of each query against the full-name and alias variants of each record."""
+        return self._score_groups([q.text for q in queries], [q.key for q in queries], queries, positions, cutoff,
+                                  self.variant_offsets, self.variant_texts, self.variant_keys)
+
+    def _score_groups(self, query_texts: List[str], query_keys: List[str], queries: List, positions: np.ndarray,
+                      cutoff: float, offsets: np.ndarray, column: np.ndarray, column_keys: np.ndarray) -> np.ndarray:
+        """Best score of each query string against the strings of a grouped column for each record."""
+        best = np.zeros((len(queries), len(positions)))
+        variant_ids, group_starts, nonempty = self._variant_groups(positions, offsets)
+        if not len(variant_ids):
+            return best
+
+        texts = column[variant_ids]
+        variant_keys = column_keys[variant_ids]
+        has_key = variant_keys != ""
+
+        ratios = self._ratio_matrix(query_texts, texts, cutoff)
+        for row, (query, query_key) in enumerate(zip(queries, query_keys)):
+            ratios[row] = _combine(ratios[row], query_key, variant_keys, has_key, query.use_phonetic)
+
+        # Per-record maximum over each record's run of variants
+        best[:, nonempty] = np.maximum.reduceat(ratios, group_starts[nonempty], axis=1)
+        return best
+
+    def _pair_scores(self, query_texts: List[str], query_keys: List[str], column: str, positions: np.ndarray,
+                     use_phonetic: bool, cutoff: float, memoize: Dict[str, bool]) -> np.ndarray:
+        """
+        Combined scores of each query string against one name column ("name" or
+        "surname") of the records at `positions`; 0 where the name is empty.
+        Rows come from the token cache, or with `memoize[column]` are computed
+        against every distinct name and cached; otherwise only the names at
+        `positions` are compared.
+        """
+        vocab = getattr(self, f"{column}_vocab")
+        vocab_keys = getattr(self, f"{column}_vocab_keys")
+        codes = getattr(self, f"{column}_codes")[positions]
+
+        ratios = np.empty((len(query_texts), len(positions)))
+        missing = []
+        for row, (text, query_key) in enumerate(zip(query_texts, query_keys)):
+            key = TokenScoreCache.key(text, column, use_phonetic)
+            scores = self.token_cache.get(key, miss=memoize[column])
+            if scores is None and memoize[column]:
+                scores = self._column_scores([text], [query_key], vocab, vocab_keys, use_phonetic, 0.0)[0]
+                self.token_cache.put(key, scores)
+            if scores is None:
+                missing.append(row)
+            else:
+                ratios[row] = scores[codes]
+
+        if missing:
+            texts = getattr(self, f"{column}s")[positions]
+            keys = getattr(self, f"{column}_keys")[positions]
+            ratios[missing] = self._column_scores([query_texts[row] for row in missing],
+                                                  [query_keys[row] for row in missing], texts, keys,
+                                                  use_phonetic, cutoff)
+        return ratios
+
+    def _column_scores(self, query_texts: List[str], query_keys: List[str], texts: np.ndarray, keys: np.ndarray,
+                       use_phonetic: bool, cutoff: float) -> np.ndarray:
+        """Combined scores of each query string against a column of names; 0 against empty names."""
+        ratios = self._ratio_matrix(query_texts, texts, cutoff)
+        has_key = keys != ""
+        for row, query_key in enumerate(query_keys):
+            ratios[row] = _combine(ratios[row], query_key, keys, has_key, use_phonetic)
+        ratios[:, texts == ""] = 0.0
+        return ratios
+
+    def _ratio_matrix(self, query_texts: List[str], texts: np.ndarray, cutoff: float) -> np.ndarray:
+        """fuzz.ratio of every query string against every text, as float64."""
+        if texts.dtype.kind == "U":
+            # Frozen column: cdist reads Python strings faster than numpy ones
+            texts = texts.tolist()
+        if self.workers != 1 and len(query_texts) < len(texts):
+            # cdist spreads rows across workers; put the long side on rows (ratio is symmetric)
+            return process.cdist(texts, query_texts, scorer=fuzz.ratio, dtype=np.float64,
+                                 score_cutoff=cutoff, workers=self.workers).T.copy()
+        return process.cdist(query_texts, texts, scorer=fuzz.ratio, dtype=np.float64,
+                             score_cutoff=cutoff, workers=self.workers)
+
+def _vocabulary(texts: np.ndarray, keys: np.ndarray):
+    """Distinct values of a name column, their keys, and the index of each row's value among them."""
+    vocab, first, codes = np.unique(texts.astype(str), return_index=True, return_inverse=True)
+    return vocab.astype(object), keys[first], codes.astype(np.int32)
+
+def _text_cutoff(min_score: float, use_phonetic: bool) -> float:
+    """fuzz.ratio below which a comparison cannot reach `min_score` once combined."""
+    if use_phonetic:
+        # A phonetic agreement adds 40 points on top of 0.6 * ratio
+        min_score = min(min_score, (min_score - 40) / 0.6)
+    return max(0.0, min_score - CUTOFF_MARGIN)
+
+def _ratio_bound(length: int, lengths: np.ndarray, use_phonetic: bool) -> np.ndarray:
+    """
+    Upper bound of the combined score of a string of `length` characters against
+    strings of `lengths` characters: fuzz.ratio <= 200 * min(a, b) / (a + b).
+    Empty strings score 0, as in the engine.
+    """
+    ratios = 200.0 * np.minimum(length, lengths) / np.maximum(length + lengths, 1)
+    if use_phonetic:
+        # Key agreement can lift a comparison to 40 + 0.6 * ratio
+        ratios = 40.0 + 0.6 * ratios
+    return np.where(lengths > 0, ratios + CUTOFF_MARGIN, 0.0)
+
+def _combine(ratios: np.ndarray, query_key: str, keys: np.ndarray, has_key: np.ndarray, use_phonetic: bool) -> np.ndarray:
+    """Vectorized matching.prepared_similarity_score for precomputed ratios."""
+    if not use_phonetic or not query_key:
+        return ratios
+    phonetic_score = np.where(keys == query_key, 100.0, 0.0)
+    # Weighted average: 40% phonetic, 60% textual; text only where the record has no key
+    return np.where(has_key, 0.4 * phonetic_score + 0.6 * ratios, ratios)
@@ -32,7 +32,7 @@ def create_tables():
         # Verify columns in each table
         if "search_logs" in tables:
             columns = {col['name'] for col in inspector.get_columns("search_logs")}
-            expected_columns = {"id", "timestamp", "query_name", "query_surname", "threshold", "phonetic", "matches", "status", "user_decision"}
+            expected_columns = {"id", "timestamp", "query_name", "query_surname", "threshold", "phonetic", "matches", "status", "user_decision", "dataset_version", "dataset_built_at"}
             missing = expected_columns - columns
             if missing:
                 logger.warning(f"Missing columns in search_logs: {missing}")
@@ -3,115 +3,628 @@
 
 #data_ingetion.py
 
+import io
+import os
+import sys
+import gzip
 import json
+import time
+import hashlib
+import threading
 import unicodedata
 import re
 import logging
-from typing import List, Dict, Any
-from models import SanctionRecord
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Dict, Any, Callable, Iterable, Iterator, Optional, Tuple
+from models import SanctionRecord, MatchView, CompactRecord
+from phonetic_cache import compute_phonetic_key
+from search_index import SanctionIndex
+
+try:
+    import orjson
+except ImportError:  # optional dependency
+    orjson = None
+
+try:
+    import zstandard
+except ImportError:  # optional dependency
+    zstandard = None
+
+try:
+    import icu
+except ImportError:  # optional dependency
+    icu = None
 
 logger = logging.getLogger("ComplianceService")
 
+# Processes parsing the dataset (default: one per core) and the byte range each one parses at a time
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "0")) or os.cpu_count() or 1
+INGEST_CHUNK_BYTES = int(os.getenv("INGEST_CHUNK_BYTES", str(16 * 2**20)))
+
+# Start method of every worker pool of the service. Pools are created on reload
+# from request and watcher threads, and a child forked there could inherit a
+# lock (logging, the record store, the delta journal) held by another thread
+# and deadlock on it; a fork server starts workers from a clean process
+POOL_CONTEXT = multiprocessing.get_context(
+    "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn")
+
+# Lines per batch when a compressed dataset is streamed to the workers
+INGEST_BATCH_LINES = 20000
+
+# Malformed lines logged one by one; the rest are only counted
+MALFORMED_SAMPLES = 5
+
+# Operations of a delta file, by the names it may give them
+DELTA_OPS = {"ADD": "add", "MOD": "modify", "MODIFY": "modify", "DEL": "delete", "DELETE": "delete"}
+
+NON_ALPHANUMERIC = re.compile(r'[^a-z0-9\s]')
+NON_IDENTIFIER = re.compile(r'[^a-z0-9]')
+CYRILLIC = re.compile(r'[\u0400-\u04ff]')
+GREEK = re.compile(r'[\u0370-\u03ff]')
+
+# Romanization of names in other scripts: ICU's Any-Latin when PyICU is
+# installed, otherwise the built-in Cyrillic and Greek tables below. Recorded
+# in snapshots; change the label when the built-in rules change
+TRANSLITERATION = "icu" if icu is not None else "builtin-elot743"
+
+# Cyrillic romanization (BGN/PCGN, as on the English-language lists), lowercase,
+# with the Ukrainian, Belarusian, Serbian and Macedonian letters
+CYRILLIC_ROMANIZATION = {
+    "а": "a", "б": "b", "в": "v", "г": "g", "д": "d", "е": "e", "ё": "e", "ж": "zh", "з": "z", "и": "i",
+    "й": "y", "к": "k", "л": "l", "м": "m", "н": "n", "о": "o", "п": "p", "р": "r", "с": "s", "т": "t",
+    "у": "u", "ф": "f", "х": "kh", "ц": "ts", "ч": "ch", "ш": "sh", "щ": "shch", "ъ": "", "ы": "y", "ь": "",
+    "э": "e", "ю": "yu", "я": "ya", "є": "ye", "і": "i", "ї": "yi", "ґ": "g", "ў": "u", "ђ": "dj", "ј": "j",
+    "љ": "lj", "њ": "nj", "ћ": "c", "џ": "dz", "ѓ": "gj", "ќ": "kj", "ѕ": "dz",
+}
+
+# Other romanizations Cyrillic names are commonly found in, as changes to the
+# one above: ICAO Doc 9303 (machine-readable passports) and the scholarly
+# system with its diacritics dropped
+CYRILLIC_SCHEMES = {
+    "icao": {"й": "i", "ъ": "ie", "ю": "iu", "я": "ia", "є": "ie", "ї": "i"},
+    "scholarly": {"ж": "z", "й": "j", "х": "h", "ц": "c", "ч": "c", "ш": "s", "щ": "sc", "ю": "ju", "я": "ja",
+                  "є": "je", "ї": "ji"},
+}
+
+# Greek romanization (ELOT 743 without diacritics), lowercase, accented vowels
+# included; letter by letter, after the digraphs of elot_digraphs
+GREEK_ROMANIZATION = {
+    "α": "a", "β": "v", "γ": "g", "δ": "d", "ε": "e", "ζ": "z", "η": "i", "θ": "th", "ι": "i", "κ": "k",
+    "λ": "l", "μ": "m", "ν": "n", "ξ": "x", "ο": "o", "π": "p", "ρ": "r", "σ": "s", "ς": "s", "τ": "t",
+    "υ": "y", "φ": "f", "χ": "ch", "ψ": "ps", "ω": "o", "ά": "a", "έ": "e", "ή": "i", "ί": "i", "ό": "o",
+    "ύ": "y", "ώ": "o", "ϊ": "i", "ϋ": "y", "ΐ": "i", "ΰ": "y",
+}
+
+# ELOT 743 digraphs: word-initial μπ and ντ, αυ/ευ/ηυ (v before vowels and
+# voiced consonants, f before voiceless ones and at the end), then the pairs
+GREEK_INITIAL_STOPS = re.compile(r'(?<!\w)(μπ|ντ)')
+GREEK_DIPHTHONGS = re.compile(r'([αεη])[υύ](?=(.?))', re.DOTALL)
+GREEK_PAIRS = re.compile(r'ου|ού|γγ|γκ|γξ|γχ')
+GREEK_VOICELESS = frozenset("θκξπστφχψς")
+GREEK_PAIR_ROMANIZATION = {"ου": "ou", "ού": "ou", "γγ": "ng", "γκ": "gk", "γξ": "nx", "γχ": "nch"}
+
+# Other romanizations Greek names are found in: letter by letter without the
+# digraphs (older documents: "Papadopoylos"), and with χ as h ("Hristodoulou")
+GREEK_SCHEMES = {
+    "letters": ({}, False),
+    "phonetic": ({"χ": "h"}, True),
+}
+
+# Latin letters that Unicode decomposition does not reduce to a-z
+LATIN_FOLDING = {
+    "ß": "ss", "æ": "ae", "œ": "oe", "ø": "o", "ł": "l", "đ": "d", "ð": "d", "þ": "th", "ı": "i", "ħ": "h",
+    "ŧ": "t", "ŀ": "l",
+}
+
+ROMANIZATION_TABLE = str.maketrans({**LATIN_FOLDING, **GREEK_ROMANIZATION, **CYRILLIC_ROMANIZATION})
+
+# (script, translation table, whether the ELOT digraphs apply first) of the other romanizations
+SCHEME_TABLES = [
+    *((CYRILLIC, str.maketrans({**LATIN_FOLDING, **GREEK_ROMANIZATION, **CYRILLIC_ROMANIZATION, **changes}), False)
+      for changes in CYRILLIC_SCHEMES.values()),
+    *((GREEK, str.maketrans({**LATIN_FOLDING, **GREEK_ROMANIZATION, **CYRILLIC_ROMANIZATION, **changes}), digraphs)
+      for changes, digraphs in GREEK_SCHEMES.values()),
+]
+
+# Legal forms and filler words of company names, normalized ("L.L.C." -> "llc"),
+# left out of the entity name forms compared regardless of them (see entity_name_form)
+ENTITY_NOISE_WORDS = frozenset({
+    "llc", "ltd", "limited", "inc", "incorporated", "corp", "corporation", "co", "company", "plc", "lp", "llp",
+    "gmbh", "mbh", "ag", "kg", "ev", "sa", "sas", "sarl", "srl", "spa", "sl", "sab", "cv", "bv", "nv", "ab",
+    "as", "asa", "oy", "oyj", "aps", "kft", "zrt", "sro", "doo", "ood", "ooo", "oao", "zao", "pao", "ao",
+    "tov", "pat", "jsc", "ojsc", "cjsc", "pjsc", "fze", "fzco", "fzc", "fzllc", "pte", "pty", "pvt", "sdn",
+    "bhd", "tbk", "kk", "the", "and", "of",
+})
+
+# Properties holding document, registration and other identifier numbers
+IDENTIFIER_PROPERTIES = ("passportNumber", "idNumber", "registrationNumber", "uniqueEntityId", "taxNumber",
+                         "socialSecurityNumber", "innCode", "ogrnCode", "vatCode", "leiCode", "dunsCode",
+                         "swiftBic", "imoNumber", "okpoCode", "npiCode")
+
+# Schemas of nested entities whose "number" property identifies the record holding them
+IDENTIFICATION_SCHEMAS = {"Identification", "Passport"}
+
 def normalize_text(text: str) -> str:
-    """Normalize text by removing accents, converting to lowercase, and removing special characters."""
+    """
+    Normalize text by romanizing other scripts, removing accents, converting
+    to lowercase, and removing special characters.
+    """
     if not isinstance(text, str):
         return ""
     
-    text = ''.join(
-        c for c in unicodedata.normalize('NFD', text)
-        if unicodedata.category(c) != 'Mn'
+    # Accents are split off as combining marks, which the character filter drops
+    if not text.isascii():
+        text = unicodedata.normalize('NFD', romanize(text.lower()))
+    return NON_ALPHANUMERIC.sub('', text.lower()).strip()
+
+_transliterators = threading.local()
+
+def romanize(text: str) -> str:
+    """Latin form of lowercase text in other scripts: with ICU when installed, otherwise by the built-in tables."""
+    if icu is None:
+        if GREEK.search(text):
+            text = elot_digraphs(text)
+        return text.translate(ROMANIZATION_TABLE)
+    # ICU transliterators are not thread-safe; each thread creates its own
+    transliterator = getattr(_transliterators, "any_latin", None)
+    if transliterator is None:
+        transliterator = _transliterators.any_latin = icu.Transliterator.createInstance("Any-Latin; Latin-ASCII")
+    return transliterator.transliterate(text)
+
+def elot_digraphs(text: str) -> str:
+    """Lowercase Greek text with the ELOT 743 digraphs romanized, before the letter table."""
+    text = GREEK_INITIAL_STOPS.sub(lambda m: "b" if m.group(1) == "μπ" else "d", text)
+    text = GREEK_DIPHTHONGS.sub(lambda m: GREEK_ROMANIZATION[m.group(1)]
+                                + ("f" if not m.group(2).isalpha() or m.group(2) in GREEK_VOICELESS else "v"), text)
+    return GREEK_PAIRS.sub(lambda m: GREEK_PAIR_ROMANIZATION[m.group(0)], text)
+
+def latin_variants(text: str) -> List[str]:
+    """
+    Normalized forms of a name written in Cyrillic or Greek under the other
+    common romanizations (CYRILLIC_SCHEMES, GREEK_SCHEMES, and the built-in
+    one when ICU romanizes), where they differ from normalize_text's.
+    """
+    if not isinstance(text, str) or text.isascii():
+        return []
+    schemes = [(table, digraphs) for script, table, digraphs in SCHEME_TABLES if script.search(text)]
+    if not schemes:
+        return []
+    if icu is not None:
+        schemes.insert(0, (ROMANIZATION_TABLE, True))
+    primary = normalize_text(text)
+    variants = []
+    for table, digraphs in schemes:
+        lowered = text.lower()
+        if digraphs and GREEK.search(lowered):
+            lowered = elot_digraphs(lowered)
+        variant = NON_ALPHANUMERIC.sub('', unicodedata.normalize('NFD', lowered.translate(table))).strip()
+        if variant and variant != primary and variant not in variants:
+            variants.append(variant)
+    return variants
+
+def normalize_identifier(value: str) -> str:
+    """Normalize a document or registration number: lowercase, without spaces, punctuation or accents."""
+    if not isinstance(value, str):
+        return ""
+    if not value.isascii():
+        value = unicodedata.normalize('NFKD', value)
+    return NON_IDENTIFIER.sub('', value.lower())
+
+def entry_identifiers(record: Dict[str, Any]) -> Tuple[str, ...]:
+    """
+    Distinct normalized identifiers of one raw dataset entry: its identifier
+    properties and the numbers of nested Identification and Passport entities.
+    """
+    props = record.get("properties", {})
+    values = [v for prop in IDENTIFIER_PROPERTIES for v in props.get(prop, [])]
+    for nested in props.values():
+        if not isinstance(nested, list):
+            continue
+        for entity in nested:
+            if isinstance(entity, dict) and entity.get("schema") in IDENTIFICATION_SCHEMAS:
+                values.extend(entity.get("properties", {}).get("number", []))
+    return tuple(dict.fromkeys(i for i in map(normalize_identifier, values) if i))
+
+def entity_name_form(text: str) -> str:
+    """
+    Normalized entity name without legal forms and filler words, its tokens
+    sorted, so that names differing only in those or in word order are equal.
+    A name made of nothing else keeps all its tokens.
+    """
+    tokens = text.split()
+    return " ".join(sorted([token for token in tokens if token not in ENTITY_NOISE_WORDS] or tokens))
+
+def build_match_view(record: SanctionRecord) -> MatchView:
+    """
+    Precompute the normalized names, name orders, tokens, reversed aliases,
+    entity name forms and Soundex keys that matching compares a query against.
+    """
+    return _match_view(record.schema, record.name, record.surname, record.properties, record.caption, record.aliases)
+
+def _match_view(schema: str, name: str, surname: str, properties: Optional[Dict], caption: str,
+                aliases: Optional[List[str]]) -> MatchView:
+    """build_match_view from the record fields. Strings are interned, so names and keys repeated across records are stored once."""
+    intern = sys.intern
+    reversed_name = ""
+    
+    if schema.lower() == "person":
+        name = normalize_text(name)
+        surname = normalize_text(surname)
+        full_name = normalize_text(f"{name} {surname}")
+        reversed_name = normalize_text(f"{surname} {name}")
+        if reversed_name == full_name:
+            reversed_name = ""
+    else:
+        # Same lookup order as the matcher: first "name" property, then caption
+        name = surname = ""
+        name_list = properties.get("name", []) if properties else []
+        entity_name = name_list[0] if name_list else ""
+        if not entity_name:
+            entity_name = caption
+        full_name = normalize_text(entity_name)
+    
+    normalized_aliases, reversed_aliases = [], []
+    for alias in aliases or []:
+        alias = normalize_text(alias)
+        if not alias:
+            continue
+        alias_parts = alias.split()
+        normalized_aliases.append(intern(alias))
+        reversed_aliases.append(intern(" ".join(reversed(alias_parts))) if len(alias_parts) >= 2 else "")
+    
+    aliases = normalized_aliases
+    tokens = dict.fromkeys(full_name.split() + [t for a in aliases for t in a.split()])
+    entity_names = []
+    if schema.lower() != "person":
+        entity_names = [intern(n) for n in dict.fromkeys(entity_name_form(t) for t in [full_name, *aliases] if t)]
+    
+    return MatchView(
+        full_name=intern(full_name),
+        full_name_key=intern(compute_phonetic_key(full_name)),
+        reversed_name=intern(reversed_name),
+        reversed_name_key=intern(compute_phonetic_key(reversed_name)),
+        name=intern(name),
+        name_key=intern(compute_phonetic_key(name)),
+        surname=intern(surname),
+        surname_key=intern(compute_phonetic_key(surname)),
+        tokens=tuple(intern(t) for t in tokens),
+        aliases=tuple(aliases),
+        alias_keys=tuple(intern(compute_phonetic_key(a)) for a in aliases),
+        reversed_aliases=tuple(reversed_aliases),
+        reversed_alias_keys=tuple(intern(compute_phonetic_key(a)) for a in reversed_aliases),
+        entity_names=tuple(entity_names),
+        entity_name_keys=tuple(intern(compute_phonetic_key(n)) for n in entity_names),
+    )
+
+def entry_names(record: Dict[str, Any]) -> Tuple[str, str, List[str]]:
+    """
+    Normalized name, surname and aliases of one raw dataset entry. Names and
+    aliases written in Cyrillic add their other romanizations as aliases.
+    """
+    entity_schema = record.get("schema", "").lower()
+    props = record.get("properties", {})
+    
+    # Extract and add person-specific fields
+    if entity_schema == "person":
+        # Handle first name
+        first_names = props.get("firstName", [])
+        first_name = first_names[0] if first_names and first_names[0] else ""
+        
+        # Handle last name
+        last_names = props.get("lastName", [])
+        last_name = last_names[0] if last_names and last_names[0] else ""
+        
+        # If first_name or last_name is missing but we have a name field
+        if (not first_name or not last_name) and "name" in props and props["name"]:
+            full_name = props["name"][0]
+            parts = full_name.split()
+            if parts:
+                if not first_name:
+                    first_name = parts[0]
+                if not last_name and len(parts) > 1:
+                    last_name = parts[-1]
+        
+        # If we still don't have names, try to use caption
+        if not first_name and not last_name:
+            parts = record.get("caption", "").split()
+            if parts:
+                first_name = parts[0]
+                if len(parts) > 1:
+                    last_name = parts[-1]
+        
+        # Normalized names
+        name = normalize_text(first_name)
+        surname = normalize_text(last_name)
+        original_name = f"{first_name} {last_name}" if isinstance(first_name, str) and isinstance(last_name, str) else ""
+        
+    else:  # For non-person records
+        # For companies or other entities, use name fields or caption
+        names = props.get("name", [])
+        entity_name = names[0] if names else record.get("caption", "")
+        
+        # Store the name in both name fields for consistency in matching
+        name = normalize_text(entity_name)
+        surname = ""  # Empty for non-person entities
+        original_name = entity_name
+    
+    # Handle aliases
+    aliases = [a for a in props.get("alias", []) if a]
+    normalized = [normalize_text(a) for a in aliases]
+    variants = dict.fromkeys(v for text in [original_name, *aliases] for v in latin_variants(text))
+    return name, surname, normalized + [v for v in variants if v not in normalized]
+
+def parse_record(record: Dict[str, Any]) -> SanctionRecord:
+    """Build a SanctionRecord, with its normalized names and aliases, from one raw dataset entry."""
+    name, surname, aliases = entry_names(record)
+    return SanctionRecord(
+        id=record.get("id", ""),
+        caption=record.get("caption", ""),
+        schema=record.get("schema", ""),
+        properties=record.get("properties", {}),
+        referents=record.get("referents", []),
+        datasets=record.get("datasets", []),
+        first_seen=record.get("first_seen", ""),
+        last_seen=record.get("last_seen", ""),
+        last_change=record.get("last_change", ""),
+        target=record.get("target", False),
+        name=name,
+        surname=surname,
+        aliases=aliases
+    )
+
+def _well_typed(record: Dict[str, Any]) -> bool:
+    """
+    Whether a raw entry certainly passes SanctionRecord validation. Entries that
+    do not are validated by pydantic instead, so both paths accept the same data.
+    """
+    return (all(isinstance(record.get(field, ""), str)
+                for field in ("id", "caption", "schema", "first_seen", "last_seen", "last_change"))
+            and isinstance(record.get("properties", {}), dict)
+            and all(isinstance(record.get(field, []), list) and all(isinstance(v, str) for v in record.get(field, []))
+                    for field in ("referents", "datasets"))
+            and isinstance(record.get("target", False), bool))
+
+def compact_record(record: Dict[str, Any]) -> CompactRecord:
+    """
+    Keep only what screening needs from one raw dataset entry: identifiers,
+    names, interned datasets, countries and topics, and the precomputed match
+    view. Raises like parse_record on entries SanctionRecord would reject.
+    """
+    if not _well_typed(record):
+        parse_record(record)
+    intern = sys.intern
+    props = record.get("properties", {})
+    schema = record.get("schema", "")
+    caption = record.get("caption", "")
+    name, surname, aliases = entry_names(record)
+    return CompactRecord(
+        id=record.get("id", ""),
+        caption=caption,
+        schema=intern(schema),
+        name=name,
+        surname=surname,
+        last_change=intern(record.get("last_change", "")),
+        datasets=tuple(intern(d) for d in record.get("datasets", [])),
+        countries=tuple(intern(c) for c in props.get("country", []) if isinstance(c, str)),
+        topics=tuple(intern(t) for t in props.get("topics", []) if isinstance(t, str)),
+        identifiers=entry_identifiers(record),
+        birth_dates=tuple(intern(d) for d in props.get("birthDate", []) if isinstance(d, str) and d),
+        match_view=_match_view(schema, name, surname, props, caption, aliases),
     )
-    text = text.lower()
-    text = re.sub(r'[^a-z0-9\s]', '', text)
-    return text.strip()
 
-def load_dataset(file_path: str) -> List[SanctionRecord]:
-    """Load and parse the sanctions dataset from a file."""
-    sanction_records = []
+def loads_json(data: bytes) -> Any:
+    """Parse one JSON document, with orjson when it is installed."""
+    return orjson.loads(data) if orjson is not None else json.loads(data)
+
+def dump_json(value: Any) -> bytes:
+    """One JSON document as a UTF-8 line body, with orjson when it is installed."""
+    if orjson is not None:
+        return orjson.dumps(value)
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+def parse_delta(lines: Iterable[bytes]) -> Tuple[Dict[str, Tuple[str, Optional[CompactRecord], Optional[bytes]]], int]:
+    """
+    Parse the lines of a delta file, one {"op": "ADD" | "MOD" | "DEL", "entity": {...}}
+    object per line (OpenSanctions delta format). Returns the last operation on
+    each entity id, as (op, compact record, entity JSON) with the record and JSON
+    None for deletions, and the number of malformed lines.
+    """
+    operations: Dict[str, Tuple[str, Optional[CompactRecord], Optional[bytes]]] = {}
+    malformed = 0
+    for number, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        try:
+            entry = loads_json(line)
+            op = DELTA_OPS[str(entry.get("op", "")).upper()]
+            entity = entry["entity"]
+            entity_id = entity["id"]
+            if not isinstance(entity_id, str) or not entity_id:
+                raise ValueError("entity id must be a non-empty string")
+            operations.pop(entity_id, None)
+            if op == "delete":
+                operations[entity_id] = (op, None, None)
+            else:
+                operations[entity_id] = (op, compact_record(entity), dump_json(entity))
+        except Exception as e:
+            malformed += 1
+            if malformed <= MALFORMED_SAMPLES:
+                logger.error(f"Error parsing delta line {number}: {e!r}")
+    return operations, malformed
+
+def dataset_compression(file_path: str) -> Optional[str]:
+    """"gzip" or "zstd" when the dataset file is compressed (by its magic bytes), None for plain JSONL."""
+    with open(file_path, "rb") as f:
+        magic = f.read(4)
+    if magic[:2] == b"\x1f\x8b":
+        return "gzip"
+    if magic == b"\x28\xb5\x2f\xfd":
+        return "zstd"
+    return None
+
+def open_dataset_file(file_path: str):
+    """Open a dataset file as a binary stream, decompressing gzip and zstd input on the fly."""
+    compression = dataset_compression(file_path)
+    if compression == "gzip":
+        return gzip.open(file_path, "rb")
+    if compression == "zstd":
+        if zstandard is None:
+            raise RuntimeError(f"{file_path} is zstd-compressed; install the zstandard package to read it")
+        return io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(open(file_path, "rb"), closefd=True))
+    return open(file_path, "rb")
+
+def byte_ranges(file_path: str, chunk_bytes: int = INGEST_CHUNK_BYTES) -> List[Tuple[int, int]]:
+    """Split a plain JSONL file into (start, end) byte ranges of about `chunk_bytes`, cut at line starts."""
+    size = os.path.getsize(file_path)
+    bounds = [0]
+    with open(file_path, "rb") as f:
+        while bounds[-1] + chunk_bytes < size:
+            f.seek(bounds[-1] + chunk_bytes)
+            f.readline()
+            if f.tell() >= size:
+                break
+            bounds.append(f.tell())
+    bounds.append(size)
+    return list(zip(bounds, bounds[1:]))
+
+def _parse_lines(lines: List[bytes]) -> Tuple[List[CompactRecord], List[int], int, List[Tuple[int, str]]]:
+    """
+    Compact records of the dataset lines that parse, the indexes of those lines,
+    the number of malformed lines and the first few errors by line index.
+    """
+    records, kept, errors = [], [], []
+    malformed = 0
+    for i, line in enumerate(lines):
+        if not line.strip():
+            continue
+        try:
+            records.append(compact_record(loads_json(line)))
+            kept.append(i)
+        except Exception as e:
+            malformed += 1
+            if len(errors) < MALFORMED_SAMPLES:
+                errors.append((i, str(e)))
+    return records, kept, malformed, errors
+
+def _parse_range(file_path: str, start: int, end: int):
+    """_parse_lines over one byte range of a plain file, with the (offset, length) of each kept line."""
+    with open(file_path, "rb") as f:
+        f.seek(start)
+        lines = list(io.BytesIO(f.read(end - start)))
+    offsets = [start]
+    for line in lines:
+        offsets.append(offsets[-1] + len(line))
+    records, kept, malformed, errors = _parse_lines(lines)
+    spans = [(offsets[i], len(lines[i])) for i in kept]
+    return records, spans, malformed, [(f"byte {offsets[i]}", e) for i, e in errors]
+
+def _line_batches(stream, size: int) -> Iterator[Tuple[List[bytes]]]:
+    batch = []
+    for line in stream:
+        batch.append(line)
+        if len(batch) >= size:
+            yield (batch,)
+            batch = []
+    if batch:
+        yield (batch,)
+
+def _ordered_map(function: Callable, arguments: Iterable[tuple], workers: int) -> Iterator[Tuple[tuple, Any]]:
+    """
+    (args, function(*args)) for each argument tuple, in order, computed on up to
+    `workers` processes with a bounded number of tasks in flight; in-process for one.
+    """
+    if workers <= 1:
+        for args in arguments:
+            yield args, function(*args)
+        return
+    with ProcessPoolExecutor(max_workers=workers, mp_context=POOL_CONTEXT) as pool:
+        pending = deque()
+        for args in arguments:
+            pending.append((args, pool.submit(function, *args)))
+            if len(pending) >= 2 * workers:
+                args, future = pending.popleft()
+                yield args, future.result()
+        while pending:
+            args, future = pending.popleft()
+            yield args, future.result()
+
+def load_dataset(file_path: str, store=None) -> List[CompactRecord]:
+    """
+    Load and parse the sanctions dataset (JSONL, optionally gzip or zstd
+    compressed) into compact records, in file order. Plain files are split into
+    byte ranges parsed by INGEST_WORKERS processes; compressed files are
+    decompressed as a stream and parsed in line batches.
+    When a RecordStore over the same file is given, every loaded record is
+    registered there, at the same position, for hydrating match details later.
+    """
+    started = time.perf_counter()
+    sanction_records: List[CompactRecord] = []
+    malformed = 0
+    samples: List[Tuple[str, str]] = []
     
     try:
-        with open(file_path, "r", encoding="utf-8") as f:
-            for line in f:
-                try:
-                    record = json.loads(line)
-                    entity_schema = record.get("schema", "").lower()
-                    props = record.get("properties", {})
-                    
-                    # Create a base SanctionRecord instance
-                    sanction_record = SanctionRecord(
-                        id=record.get("id", ""),
-                        caption=record.get("caption", ""),
-                        schema=record.get("schema", ""),
-                        properties=props,
-                        referents=record.get("referents", []),
-                        datasets=record.get("datasets", []),
-                        first_seen=record.get("first_seen", ""),
-                        last_seen=record.get("last_seen", ""),
-                        last_change=record.get("last_change", ""),
-                        target=record.get("target", False),
-                        aliases=[]  # Initialize with empty list
-                    )
-                    
-                    # Extract and add person-specific fields
-                    if entity_schema == "person":
-                        # Handle first name
-                        first_names = props.get("firstName", [])
-                        first_name = first_names[0] if first_names and first_names[0] else ""
-                        
-                        # Handle last name
-                        last_names = props.get("lastName", [])
-                        last_name = last_names[0] if last_names and last_names[0] else ""
-                        
-                        # If first_name or last_name is missing but we have a name field
-                        if (not first_name or not last_name) and "name" in props and props["name"]:
-                            full_name = props["name"][0]
-                            parts = full_name.split()
-                            if parts:
-                                if not first_name:
-                                    first_name = parts[0]
-                                if not last_name and len(parts) > 1:
-                                    last_name = parts[-1]
-                        
-                        # If we still don't have names, try to use caption
-                        if not first_name and not last_name:
-                            parts = record.get("caption", "").split()
-                            if parts:
-                                first_name = parts[0]
-                                if len(parts) > 1:
-                                    last_name = parts[-1]
-                        
-                        # Set normalized names
-                        sanction_record.name = normalize_text(first_name)
-                        sanction_record.surname = normalize_text(last_name)
-                        
-                        # Handle aliases
-                        aliases = props.get("alias", [])
-                        sanction_record.aliases = [normalize_text(a) for a in aliases if a]
-                        
-                    else:  # For non-person records
-                        # For companies or other entities, use name fields or caption
-                        names = props.get("name", [])
-                        entity_name = names[0] if names else record.get("caption", "")
-                        
-                        # Store the name in both name fields for consistency in matching
-                        sanction_record.name = normalize_text(entity_name)
-                        sanction_record.surname = ""  # Empty for non-person entities
-                        
-                        # Handle aliases for non-person entities
-                        aliases = props.get("alias", [])
-                        sanction_record.aliases = [normalize_text(a) for a in aliases if a]
-                    
-                    sanction_records.append(sanction_record)
-                    
-                except json.JSONDecodeError as e:
-                    logger.error(f"Error parsing JSON line: {e}")
-                except Exception as e:
-                    logger.error(f"Error processing record: {e}")
-                    
-        logger.info(f"Successfully loaded {len(sanction_records)} records from dataset")
+        if dataset_compression(file_path) is None:
+            ranges = [(file_path, start, end) for start, end in byte_ranges(file_path)]
+            for _, (records, spans, bad, errors) in _ordered_map(_parse_range, ranges, min(INGEST_WORKERS, len(ranges))):
+                sanction_records.extend(records)
+                if store is not None:
+                    for offset, length in spans:
+                        store.append(offset, length)
+                malformed += bad
+                samples.extend(errors)
+        else:
+            with open_dataset_file(file_path) as stream:
+                line_number = 0
+                for (lines,), (records, kept, bad, errors) in _ordered_map(
+                        _parse_lines, _line_batches(stream, INGEST_BATCH_LINES), INGEST_WORKERS):
+                    sanction_records.extend(records)
+                    if store is not None:
+                        for i in kept:
+                            store.append_raw(lines[i].strip())
+                    malformed += bad
+                    samples.extend((f"line {line_number + i + 1}", e) for i, e in errors)
+                    line_number += len(lines)
+        
+        if store is not None:
+            store.ids = [record.id for record in sanction_records]
+        
+        for where, error in samples[:MALFORMED_SAMPLES]:
+            logger.error(f"Error parsing dataset {where}: {error}")
+        
+        elapsed = max(time.perf_counter() - started, 1e-9)
+        megabytes = os.path.getsize(file_path) / 2**20
+        logger.info(f"Successfully loaded {len(sanction_records)} records from dataset in {elapsed:.1f}s "
+                    f"({megabytes / elapsed:.1f} MB/s, {len(sanction_records) / elapsed:.0f} records/s), "
+                    f"{malformed} malformed lines")
         
     except Exception as e:
         logger.error(f"Error opening or reading dataset file: {e}")
         raise
         
-    return sanction_records
\ No newline at end of file
+    return sanction_records
+
+def dataset_version(records: List[CompactRecord]) -> str:
+    """Short hash of the loaded dataset: record ids, their last change and their order."""
+    return version_digest((record.id, record.last_change) for record in records)
+
+def version_digest(identities: Iterable[Tuple[str, str]]) -> str:
+    """dataset_version from the (id, last_change) pairs of the records, in dataset order."""
+    digest = hashlib.sha256()
+    for record_id, last_change in identities:
+        digest.update(f"{record_id}\x1f{last_change}\x1e".encode("utf-8"))
+    return digest.hexdigest()[:16]
+
+def build_search_index(records: List[CompactRecord]) -> SanctionIndex:
+    """Build the n-gram, phonetic, TF-IDF, exact name and attribute indexes of loaded records."""
+    index = SanctionIndex()
+    index.tfidf.fit(records)
+    for position, record in enumerate(records):
+        index.add_record(record, position)
+    index.ngrams.seal()
+    logger.info(f"Built search index: {len(index.ngrams.variant_records)} name variants, "
+                f"{len(index.ngrams.postings)} gram buckets, {len(index.ngrams.deletions.hashes)} deletion keys, "
+                f"{len(index.tfidf.postings)} TF-IDF grams, {len(index.phonetic.codes)} phonetic keys, "
+                f"{len(index.exact.keys)} exact names, {len(index.identifiers.keys)} identifiers")
+    return index
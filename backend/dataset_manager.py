@@ -0,0 +1,406 @@
+
+
+
+# dataset_manager.py
+
+import os
+import time
+import logging
+import threading
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, Iterator, List, Mapping, Optional, Sequence, Set, Tuple
+
+from data_ingestion import parse_delta, version_digest
+from delta_journal import DeltaJournal
+from record_store import RecordStore, StoredRecords
+from sharded_scoring import ShardedScreener
+from snapshot import open_dataset, source_signature
+
+logger = logging.getLogger("ComplianceService")
+
+# Seconds between checks of the dataset file for a new export (0 disables the watcher)
+DATASET_WATCH_INTERVAL = float(os.getenv("DATASET_WATCH_INTERVAL", "30"))
+
+# Change sets of applied deltas kept for GET /admin/dataset/changes
+DELTA_HISTORY = int(os.getenv("DELTA_HISTORY", "20"))
+
+# Journal of the applied deltas (default: the dataset file name + ".deltas")
+DATASET_DELTAS = os.getenv("DATASET_DELTAS", "")
+
+class DatasetGeneration:
+    """
+    One load of the sanctions dataset with everything screening reads from it:
+    compact records, record store, id lookup, shard screeners and version.
+    A generation is never modified; a reload builds a new one, and a delta
+    derives one that shares everything its changes do not touch.
+
+    Records deleted by deltas keep their position in `records` (listed in
+    `removed`) but are gone from `positions` and from the screeners.
+    `journal_offset` is how far the generation has applied the delta journal.
+    """
+
+    def __init__(self, records: Sequence, store: RecordStore, screener: ShardedScreener,
+                 source: Optional[Dict[str, int]] = None, positions: Optional[Mapping[str, int]] = None,
+                 removed: Optional[Set[int]] = None, version: Optional[str] = None):
+        self.records = records
+        self.store = store
+        self.screener = screener
+        self.source = source
+        self.removed = removed or set()
+        if positions is None:
+            positions = {record.id: position for position, record in enumerate(records)}
+        self.positions = positions
+        self.version = version or live_version(records, self.removed)
+        self.built_at = datetime.now(timezone.utc).isoformat()
+        self.journal_offset = 0
+        # Requests currently using the generation; a retired one is closed once none are left
+        self.users = 0
+        self.retired = False
+
+    def info(self) -> Dict[str, Any]:
+        """Version, build time and size, as reported to clients and the audit log."""
+        return {"version": self.version, "built_at": self.built_at, "records": len(self.records) - len(self.removed)}
+
+    def close(self) -> None:
+        """Stop the scoring shards and unmap the dataset file."""
+        self.screener.close()
+        self.store.close()
+
+class DatasetChanges:
+    """
+    Change set of one applied delta: the entity ids added, modified and
+    deleted, and the dataset versions before and after. Deletions of unknown
+    ids are listed as ignored.
+    """
+
+    def __init__(self, from_version: str, to_version: str, added: List[str], modified: List[str],
+                 deleted: List[str], ignored: List[str], malformed: int = 0):
+        self.from_version = from_version
+        self.to_version = to_version
+        self.added = added
+        self.modified = modified
+        self.deleted = deleted
+        self.ignored = ignored
+        self.malformed = malformed
+        self.applied_at = datetime.now(timezone.utc).isoformat()
+
+    def changed_ids(self) -> Set[str]:
+        """Ids whose screening results may differ between the two versions."""
+        return {*self.added, *self.modified, *self.deleted}
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "from_version": self.from_version,
+            "to_version": self.to_version,
+            "applied_at": self.applied_at,
+            "added": self.added,
+            "modified": self.modified,
+            "deleted": self.deleted,
+            "ignored": self.ignored,
+            "malformed": self.malformed,
+        }
+
+def live_version(records: Sequence, removed: Set[int]) -> str:
+    """dataset_version of the records still in the dataset, without rebuilding mapped ones."""
+    if isinstance(records, StoredRecords):
+        identity = records.identity
+    else:
+        identity = lambda position: (records[position].id, records[position].last_change)
+    return version_digest(identity(position) for position in range(len(records)) if position not in removed)
+
+def build_generation(dataset_file: str) -> DatasetGeneration:
+    """Load the dataset (mapped from its snapshot when possible) and start its scoring shards."""
+    source = source_signature(dataset_file) if os.path.exists(dataset_file) else None
+    loaded = open_dataset(dataset_file)
+    screener = ShardedScreener(loaded.records, screeners=loaded.screeners, snapshot=loaded.snapshot)
+    return DatasetGeneration(loaded.records, loaded.store, screener, source, loaded.positions, version=loaded.version)
+
+def derive_generation(generation: DatasetGeneration, operations: Dict[str, Tuple]) -> Tuple[DatasetGeneration, DatasetChanges]:
+    """
+    Generation after applying parsed delta operations (see parse_delta) to
+    `generation`, keyed by entity id. Deleted and modified records are removed
+    from the indexes; new versions and added records go to fresh positions at
+    the end. Only the postings of those records are recomputed.
+    """
+    count = len(generation.records)
+    positions = dict(generation.positions)
+    removed: List[Tuple[Any, int]] = []
+    added: List[Tuple[Any, int]] = []
+    lines: List[bytes] = []
+    added_ids, modified_ids, deleted_ids, ignored_ids = [], [], [], []
+
+    for entity_id, (op, record, line) in operations.items():
+        position = positions.pop(entity_id, None)
+        if position is not None:
+            removed.append((generation.records[position], position))
+        if op == "delete":
+            (deleted_ids if position is not None else ignored_ids).append(entity_id)
+            continue
+        (modified_ids if position is not None else added_ids).append(entity_id)
+        positions[entity_id] = count + len(added)
+        added.append((record, count + len(added)))
+        lines.append(line)
+
+    if not removed and not added:
+        return generation, DatasetChanges(generation.version, generation.version, [], [], [], ignored_ids)
+
+    store = generation.store.extended(lines)
+    if isinstance(generation.records, StoredRecords):
+        records = generation.records.extended(store, count + len(added))
+    else:
+        records = list(generation.records) + [record for record, _ in added]
+    try:
+        screener = generation.screener.updated(records, removed, added)
+    except Exception:
+        store.close()
+        raise
+    derived = DatasetGeneration(records, store, screener, generation.source, positions,
+                                generation.removed | {position for _, position in removed})
+    return derived, DatasetChanges(generation.version, derived.version, added_ids, modified_ids, deleted_ids, ignored_ids)
+
+class DatasetManager:
+    """
+    Serves the active dataset generation and replaces it without a restart.
+
+    A reload (from the admin endpoint or the file watcher) builds the next
+    generation in a background thread while requests keep using the current
+    one, then swaps it in atomically. Requests hold the generation they started
+    with until they finish; the old generation is closed after the last of them.
+    New exports should replace the dataset file by rename, so the mapped file
+    of the old generation stays intact while it drains.
+
+    Applied deltas are recorded in a DeltaJournal and replayed on top of the
+    dataset file by every load, so they survive reloads and restarts until a
+    new export replaces the file. The watcher of every worker process applies
+    the deltas that other workers recorded, in the same order, so all of them
+    serve the same dataset version.
+    """
+
+    def __init__(self, dataset_file: str):
+        self.dataset_file = dataset_file
+        self.generation: Optional[DatasetGeneration] = None
+        self.lock = threading.Lock()
+        self.reload_lock = threading.Lock()
+        self.reloading = False
+        self.last_error: Optional[str] = None
+        self.reloads = 0
+        self.deltas = 0
+        self.changes: "deque[DatasetChanges]" = deque(maxlen=DELTA_HISTORY)
+        self.journal = DeltaJournal(DATASET_DELTAS or f"{dataset_file}.deltas")
+        self._watcher: Optional[threading.Thread] = None
+
+    def load(self) -> DatasetGeneration:
+        """Build the first generation; an unreadable dataset gives an empty one, as before."""
+        try:
+            generation = self._build()
+            logger.info(f"Loaded {len(generation.records)} sanction records.")
+        except Exception as e:
+            logger.error(f"Error loading dataset: {e}")
+            self.last_error = str(e)
+            generation = DatasetGeneration([], RecordStore(), ShardedScreener([]))
+        self._swap(generation)
+        return generation
+
+    @contextmanager
+    def use(self) -> Iterator[DatasetGeneration]:
+        """The active generation, kept open until the block exits."""
+        with self.lock:
+            generation = self.generation
+            generation.users += 1
+        try:
+            yield generation
+        finally:
+            with self.lock:
+                generation.users -= 1
+                drained = generation.retired and generation.users == 0
+            if drained:
+                self._close(generation)
+
+    def reload(self) -> bool:
+        """
+        Build a new generation from the dataset file and swap it in. Runs one
+        reload at a time; the current generation stays active if the build fails.
+        """
+        with self.reload_lock:
+            return self._reload()
+
+    def request_reload(self) -> bool:
+        """Start a reload in the background; False when one is already running."""
+        if not self.reload_lock.acquire(blocking=False):
+            return False
+        threading.Thread(target=self._reload, kwargs={"release": True}, name="dataset-reload", daemon=True).start()
+        return True
+
+    def _reload(self, release: bool = False) -> bool:
+        # Called with reload_lock held; `release` hands it back when done
+        self.reloading = True
+        started = time.perf_counter()
+        try:
+            generation = self._build()
+            previous = self._swap(generation)
+        except Exception as e:
+            logger.error(f"Dataset reload failed, keeping version {self.generation.version}: {e}")
+            self.last_error = str(e)
+            return False
+        finally:
+            self.reloading = False
+            if release:
+                self.reload_lock.release()
+        self.last_error = None
+        self.reloads += 1
+        logger.info(f"Reloaded dataset in {time.perf_counter() - started:.1f}s: "
+                    f"version {previous.version} -> {generation.version}, {len(generation.records)} records")
+        return True
+
+    def apply_delta(self, lines: Iterable[bytes]) -> DatasetChanges:
+        """
+        Apply a delta file (add / modify / delete by entity id) to the active
+        generation and swap the result in, like a reload but without rebuilding
+        anything the delta does not touch. The delta is recorded in the journal
+        first, after the deltas other workers recorded. Raises ValueError when
+        no line of the delta is valid. The change set is returned and kept in
+        `changes`.
+        """
+        started = time.perf_counter()
+        lines = list(lines)
+        operations, malformed = parse_delta(lines)
+        if not operations:
+            raise ValueError(f"Delta has no valid operations ({malformed} malformed lines)")
+
+        with self.reload_lock, self.journal.locked():
+            # Recorded on top of the current dataset file and every delta recorded so far
+            generation = self._caught_up()
+            offset = self.journal.append(generation.source, generation.journal_offset, lines)
+            generation, changes = derive_generation(generation, operations)
+            generation.journal_offset = offset
+            changes.malformed = malformed
+            if generation is not self.generation:
+                self._swap(generation)
+            self.changes.append(changes)
+            self.deltas += 1
+
+        logger.info(f"Applied dataset delta in {time.perf_counter() - started:.2f}s: "
+                    f"{len(changes.added)} added, {len(changes.modified)} modified, {len(changes.deleted)} deleted, "
+                    f"{len(changes.ignored)} ignored, {malformed} malformed; "
+                    f"version {changes.from_version} -> {changes.to_version}")
+        return changes
+
+    def start_watcher(self, interval: float = DATASET_WATCH_INTERVAL) -> None:
+        """Poll the dataset file every `interval` seconds and reload when it changes."""
+        if interval <= 0 or self._watcher is not None:
+            return
+        self._watcher = threading.Thread(target=self._watch, args=(interval,), name="dataset-watcher", daemon=True)
+        self._watcher.start()
+        logger.info(f"Watching {self.dataset_file} for changes every {interval:g}s")
+
+    def status(self) -> Dict[str, Any]:
+        """Active generation and reload state, for the admin endpoint."""
+        return {
+            **self.generation.info(),
+            "dataset_file": self.dataset_file,
+            "reloading": self.reloading,
+            "reloads": self.reloads,
+            "deltas": self.deltas,
+            "deleted_positions": len(self.generation.removed),
+            "delta_journal": self.journal.path,
+            "last_error": self.last_error,
+        }
+
+    def sync_deltas(self) -> bool:
+        """
+        Apply the deltas other workers recorded in the journal since this one
+        last read it (reloading when the journal was restarted under it).
+        False when the dataset could not be brought up to date.
+        """
+        with self.reload_lock, self.journal.locked():
+            try:
+                self._caught_up()
+            except Exception as e:
+                logger.error(f"Could not apply recorded dataset deltas: {e}")
+                self.last_error = str(e)
+                return False
+        return True
+
+    def _build(self) -> DatasetGeneration:
+        """A new generation from the dataset file, with the deltas recorded for it replayed."""
+        generation = build_generation(self.dataset_file)
+        with self.journal.locked():
+            recorded = self.journal.read(generation.source)
+            for lines, offset in recorded[0]:
+                generation = self._replay(generation, lines, offset)
+            generation.journal_offset = recorded[1]
+        return generation
+
+    def _caught_up(self) -> DatasetGeneration:
+        """
+        The active generation with the deltas recorded since it was built
+        swapped in. Rebuilt from the dataset file when that was replaced, or
+        when the journal no longer continues the generation. Call with both
+        locks held.
+        """
+        generation = self.generation
+        current = source_signature(self.dataset_file) if os.path.exists(self.dataset_file) else None
+        recorded = self.journal.read(generation.source, generation.journal_offset)
+        if current != generation.source or recorded is None:
+            logger.info(f"Rebuilding the dataset before applying deltas to {self.dataset_file}")
+            generation = self._build()
+        else:
+            for lines, offset in recorded[0]:
+                generation = self._replay(generation, lines, offset)
+            generation.journal_offset = max(generation.journal_offset, recorded[1])
+        if generation is not self.generation:
+            self._swap(generation)
+        return generation
+
+    def _replay(self, generation: DatasetGeneration, lines: List[bytes], offset: int) -> DatasetGeneration:
+        """Generation after one recorded delta, which ends at `offset` of the journal."""
+        operations, malformed = parse_delta(lines)
+        derived, changes = derive_generation(generation, operations)
+        derived.journal_offset = offset
+        changes.malformed = malformed
+        self.changes.append(changes)
+        self.deltas += 1
+        logger.info(f"Replayed recorded dataset delta: {len(changes.added)} added, {len(changes.modified)} modified, "
+                    f"{len(changes.deleted)} deleted; version {changes.from_version} -> {changes.to_version}")
+        return derived
+
+    def _swap(self, generation: DatasetGeneration) -> Optional[DatasetGeneration]:
+        with self.lock:
+            previous, self.generation = self.generation, generation
+            if previous is not None:
+                previous.retired = True
+                drained = previous.users == 0
+        if previous is not None and drained:
+            self._close(previous)
+        return previous
+
+    def _close(self, generation: DatasetGeneration) -> None:
+        try:
+            generation.close()
+            logger.info(f"Closed dataset generation {generation.version}")
+        except Exception as e:
+            logger.error(f"Error closing dataset generation {generation.version}: {e}")
+
+    def _watch(self, interval: float) -> None:
+        # A change is picked up once the file has stopped changing for one
+        # interval, so an export still being written is not loaded half-way.
+        # A file that failed to load is only retried after it changes again.
+        # Deltas recorded by other workers are applied as soon as they appear.
+        seen = failed = None
+        journal = self.journal.signature()
+        while True:
+            time.sleep(interval)
+            try:
+                current = source_signature(self.dataset_file)
+            except OSError:
+                continue
+            if current not in (self.generation.source, failed) and current == seen and not self.reload_lock.locked():
+                logger.info(f"{self.dataset_file} changed, reloading dataset")
+                journal = self.journal.signature()
+                failed = None if self.reload() else current
+            elif current == self.generation.source and self.journal.signature() != journal:
+                journal = self.journal.signature()
+                self.sync_deltas()
+            seen = current
@@ -21,6 +21,8 @@ class LogEntry(Base):
     matches = Column(Text)     # JSON or text representation of matches
     status = Column(String(50))
     user_decision = Column(String(20))  # "match", "no_match", or null
+    dataset_version = Column(String(32))  # Dataset generation the search was screened against
+    dataset_built_at = Column(String(40))  # ISO timestamp of that generation's build
 
 class CustomerRegistration(Base):
     __tablename__ = "customer_registrations"
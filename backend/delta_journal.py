@@ -0,0 +1,148 @@
+
+
+
+# delta_journal.py
+# Deltas applied to the running dataset, kept in a file next to it so that
+# they survive reloads and restarts and reach every worker process.
+
+import os
+import json
+import logging
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+try:
+    import fcntl
+except ImportError:  # not available on Windows
+    fcntl = None
+
+logger = logging.getLogger("ComplianceService")
+
+JOURNAL_FORMAT = 1
+
+# (lines of one delta, journal offset after it)
+Block = Tuple[List[bytes], int]
+
+class DeltaJournal:
+    """
+    Append-only file of the deltas applied on top of one dataset file. It
+    starts with a header naming that file by its source signature (size and
+    modification time); each delta follows as a marker line with its line
+    count and the delta's lines as received.
+
+    A journal whose header names another signature belongs to a previous
+    export and is restarted by the next append. Offsets are byte positions in
+    the file: a generation remembers how far it has applied the journal, and
+    reading from there returns the deltas appended since. A delta cut short by
+    a crash is ignored and overwritten by the next append.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        # Lock held by this process, re-entered by its own nested calls
+        self._mutex = threading.RLock()
+        self._depth = 0
+        self._lock_file = None
+
+    @contextmanager
+    def locked(self) -> Iterator[None]:
+        """Exclusive lock on the journal across worker processes, re-entrant within this one."""
+        with self._mutex:
+            if self._depth == 0 and fcntl is not None:
+                self._lock_file = open(f"{self.path}.lock", "w")
+                fcntl.flock(self._lock_file, fcntl.LOCK_EX)
+            self._depth += 1
+            try:
+                yield
+            finally:
+                self._depth -= 1
+                if self._depth == 0 and self._lock_file is not None:
+                    fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+                    self._lock_file.close()
+                    self._lock_file = None
+
+    def signature(self) -> Optional[Tuple[int, int]]:
+        """(size, modification time) of the journal file, None when there is none."""
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None
+        return stat.st_size, stat.st_mtime_ns
+
+    def read(self, base: Optional[Dict[str, int]], offset: int = 0) -> Optional[Tuple[List[Block], int]]:
+        """
+        Deltas recorded for the dataset file with source signature `base` after
+        `offset`, and the offset after the last complete one. A journal for
+        another file (or none) has nothing for offset 0. None when the journal
+        does not continue from `offset`: it was removed, restarted or truncated.
+        """
+        try:
+            with open(self.path, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            return ([], 0) if offset == 0 else None
+
+        header_end = data.find(b"\n") + 1
+        header = _parse(data[:header_end]) if header_end else None
+        if not isinstance(header, dict) or header.get("base") != base or header.get("format") != JOURNAL_FORMAT:
+            return ([], 0) if offset == 0 else None
+        if offset > len(data):
+            return None
+
+        blocks: List[Block] = []
+        position = max(offset, header_end)
+        while position < len(data):
+            marker_end = data.find(b"\n", position) + 1
+            marker = _parse(data[position:marker_end]) if marker_end else None
+            if not isinstance(marker, dict) or not isinstance(marker.get("delta"), dict):
+                break
+            lines, end = [], marker_end
+            for _ in range(int(marker["delta"].get("lines", 0))):
+                line_end = data.find(b"\n", end) + 1
+                if not line_end:
+                    break
+                lines.append(data[end:line_end - 1])
+                end = line_end
+            if len(lines) != int(marker["delta"].get("lines", 0)):
+                break
+            blocks.append((lines, end))
+            position = end
+        return blocks, position
+
+    def append(self, base: Optional[Dict[str, int]], offset: int, lines: Sequence[bytes]) -> int:
+        """
+        Record one delta after `offset`, the end of the deltas already applied
+        to the dataset file `base` (see read); a journal for another file is
+        restarted. Call with the lock held. Returns the offset after the delta.
+        """
+        lines = [line.strip() for line in lines if line.strip()]
+        marker = json.dumps({"delta": {"lines": len(lines), "applied_at": datetime.now(timezone.utc).isoformat()}})
+        block = b"".join([marker.encode("utf-8") + b"\n", *(line + b"\n" for line in lines)])
+
+        if offset == 0:
+            # New journal for this dataset file
+            header = json.dumps({"format": JOURNAL_FORMAT, "base": base}).encode("utf-8") + b"\n"
+            temp_path = f"{self.path}.tmp"
+            with open(temp_path, "wb") as f:
+                f.write(header + block)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp_path, self.path)
+            return len(header) + len(block)
+
+        with open(self.path, "r+b") as f:
+            # Drops a delta cut short by a crash, if any
+            f.truncate(offset)
+            f.seek(offset)
+            f.write(block)
+            f.flush()
+            os.fsync(f.fileno())
+        return offset + len(block)
+
+def _parse(line: bytes) -> Any:
+    try:
+        return json.loads(line)
+    except ValueError:
+        return None
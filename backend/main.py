@@ -7,30 +7,35 @@ import logging
 import uvicorn
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from routes import router  # We'll create routes.py in the next step
 
 # Setup logging for operational quality
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("ComplianceService")
 
-# Create the FastAPI app
-app = FastAPI(
-    title="Financial Compliance Sanction Verification Service",
-    description="API for customer verification and compliance management",
-    version="1.0.0"
+# Processes of uvicorn's reloader and of the scoring and ingestion pools start
+# by importing this file as __mp_main__; only the server itself needs the app,
+# and building it there would load the dataset once more in every worker
+if __name__ != "__mp_main__":
+    from routes import router  # We'll create routes.py in the next step
+
+    # Create the FastAPI app
+    app = FastAPI(
+        title="Financial Compliance Sanction Verification Service",
+        description="API for customer verification and compliance management",
+        version="1.0.0"
+        )
+
+    # Enable CORS to allow your React app to communicate with this backend.
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=["*"],  # Adjust in production for security (specify domains)
+        allow_credentials=True,
+        allow_methods=["*"],
+        allow_headers=["*"],
     )
 
-# Enable CORS to allow your React app to communicate with this backend.
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],  # Adjust in production for security (specify domains)
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
-
-# Include the router from routes.py
-app.include_router(router)
+    # Include the router from routes.py
+    app.include_router(router)
 
 if __name__ == "__main__":
     # Launch the server
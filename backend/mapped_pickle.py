@@ -0,0 +1,87 @@
+
+
+
+# mapped_pickle.py
+# Pickle files whose large buffers (numpy arrays) are stored out of band and
+# memory-mapped on load: every process loading the same file shares one copy
+# of them through the page cache instead of holding its own.
+#
+# Unpickling runs whatever code the file names, so a mapped pickle is trusted
+# like the service's own code: it is only loaded when owned by the user the
+# service runs as (or root) and not writable by group or others.
+
+import os
+import mmap
+import stat
+import pickle
+from typing import Any, BinaryIO, List, Tuple
+
+# Alignment of the payload and of every out-of-band buffer in the file
+ALIGNMENT = 64
+
+def _padding(position: int) -> int:
+    return -position % ALIGNMENT
+
+def dump_mapped(path: str, header: Any, payload: Any) -> None:
+    """
+    Write `header` as a plain pickle, readable on its own with read_header, then
+    `payload` pickled with protocol 5, its numpy arrays as aligned raw buffers.
+    """
+    buffers: List[pickle.PickleBuffer] = []
+    body = pickle.dumps(payload, protocol=5, buffer_callback=buffers.append)
+    parts = [memoryview(body), *(buffer.raw() for buffer in buffers)]
+
+    # Offsets relative to the aligned end of the layout pickle
+    layout, offset = [], 0
+    for part in parts:
+        offset += _padding(offset)
+        layout.append((offset, part.nbytes))
+        offset += part.nbytes
+
+    # Never group- or world-writable, or check_trusted would refuse the file
+    with os.fdopen(os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644), "wb") as f:
+        os.fchmod(f.fileno(), stat.S_IMODE(os.fstat(f.fileno()).st_mode) & ~(stat.S_IWGRP | stat.S_IWOTH))
+        pickle.dump(header, f, protocol=pickle.HIGHEST_PROTOCOL)
+        pickle.dump(layout, f, protocol=pickle.HIGHEST_PROTOCOL)
+        base = f.tell() + _padding(f.tell())
+        for (start, _), part in zip(layout, parts):
+            f.seek(base + start)
+            f.write(part)
+        f.truncate(base + offset)
+
+def check_trusted(f: BinaryIO) -> None:
+    """
+    Raise PermissionError unless the open file is owned by this user or root
+    and cannot be written by group or others. Checked on the open file, so it
+    cannot be swapped between the check and the read.
+    """
+    if os.name != "posix":
+        return
+    info = os.fstat(f.fileno())
+    if info.st_uid not in (0, os.geteuid()):
+        raise PermissionError(f"{f.name} is owned by uid {info.st_uid}, not by this user or root")
+    if info.st_mode & (stat.S_IWGRP | stat.S_IWOTH):
+        raise PermissionError(f"{f.name} is writable by group or others (mode {stat.S_IMODE(info.st_mode):o})")
+
+def read_header(f: BinaryIO) -> Any:
+    """
+    Header of a mapped pickle file opened in binary mode, without reading the
+    payload. Raises PermissionError for an untrusted file (see check_trusted).
+    """
+    check_trusted(f)
+    return pickle.load(f)
+
+def load_mapped(path: str) -> Tuple[Any, Any]:
+    """
+    Header and payload of a mapped pickle file. The payload's numpy arrays are
+    read-only views of the mapped file, which stays mapped while any is alive.
+    Raises PermissionError for an untrusted file (see check_trusted).
+    """
+    with open(path, "rb") as f:
+        header = read_header(f)
+        layout = pickle.load(f)
+        base = f.tell() + _padding(f.tell())
+        mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    view = memoryview(mapping)
+    parts = [view[base + start:base + start + length] for start, length in layout]
+    return header, pickle.loads(parts[0], buffers=parts[1:])
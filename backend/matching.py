@@ -1,20 +1,118 @@
 #matching.py
 
-import textdistance
 from rapidfuzz import fuzz
+import os
 import logging
-from models import SanctionRecord
-from data_ingestion import normalize_text
+from datetime import datetime
+from typing import Dict, List, Optional, Union
+from models import SanctionRecord, MatchView
+from data_ingestion import normalize_text, build_match_view, entity_name_form
+from phonetic_cache import compute_phonetic_key
+from search_index import ratio_length_bounds
 
 logger = logging.getLogger("ComplianceService")
 
+# Years either side of a queried year of birth that records may be born in
+BIRTH_YEAR_TOLERANCE = int(os.getenv("BIRTH_YEAR_TOLERANCE", "1"))
+
+# Birth dates a query may give, as in the dataset: a year, a month or a day,
+# by the length of the date
+BIRTH_DATE_FORMATS = {4: "%Y", 7: "%Y-%m", 10: "%Y-%m-%d"}
+
+# Candidate retrieval: every record that can reach the threshold ("index"), or
+# the records nearest to the query in TF-IDF space ("tfidf")
+RETRIEVAL_MODES = ("index", "tfidf")
+
+# Records per shard rescored after TF-IDF retrieval
+TFIDF_CANDIDATES = int(os.getenv("TFIDF_CANDIDATES", "200"))
+
 def phonetic_key_soundex(name: str) -> str:
     """
     Compute the Soundex phonetic key for a given name.
     """
     if not name:
         return ""
-    return textdistance.soundex(name)
+    return compute_phonetic_key(name)
+
+class CompiledQuery:
+    """
+    A screening query normalized, split and keyed once per request so that
+    matching every record reads precomputed strings instead of recomputing them.
+    An optional birth date, year of birth and country restrict the records
+    screened to those that fit them or do not list them; `facets` restricts
+    them to datasets, topics and countries (see search_index.FacetIndex).
+    With `retrieval` "tfidf", only the TFIDF_CANDIDATES records per shard with
+    the closest names in TF-IDF space are scored (see search_index.TfidfIndex).
+    """
+
+    def __init__(self, query: str, threshold: float = 0.0, use_phonetic: bool = False,
+                 birth_date: Optional[str] = None, birth_year: Optional[int] = None, country: Optional[str] = None,
+                 facets: Optional[Dict[str, List[str]]] = None, retrieval: str = "index"):
+        self.raw = query
+        self.threshold = threshold
+        self.use_phonetic = use_phonetic
+        self.birth_date = birth_date or None
+        self.birth_years = None
+        if birth_year is not None:
+            self.birth_years = [str(year) for year in range(birth_year - BIRTH_YEAR_TOLERANCE,
+                                                            birth_year + BIRTH_YEAR_TOLERANCE + 1)]
+        self.country = country.strip().lower() if country and country.strip() else None
+        self.facets = {facet: [v.lower() for v in values] for facet, values in (facets or {}).items() if values}
+        self.tfidf_candidates = TFIDF_CANDIDATES if retrieval == "tfidf" else 0
+        
+        # Full normalized query and its tokens
+        self.text = normalize_text(query)
+        self.key = phonetic_key_soundex(self.text)
+        self.tokens: List[str] = self.text.split()
+        self.token_keys = [phonetic_key_soundex(t) for t in self.tokens]
+        
+        # Token combinations used by part matching: everything after the first
+        # token, and every order-preserving combination that leaves one token out
+        self.rest = " ".join(self.tokens[1:])
+        self.rest_key = phonetic_key_soundex(self.rest)
+        self.others = [" ".join(self.tokens[:i] + self.tokens[i+1:]) for i in range(len(self.tokens))]
+        self.other_keys = [phonetic_key_soundex(o) for o in self.others]
+
+        # Query without legal forms and filler words, tokens sorted, for the entity name forms of records
+        self.entity_name = entity_name_form(self.text)
+        self.entity_name_key = phonetic_key_soundex(self.entity_name)
+        
+        # Lowest fuzz.ratio a single comparison needs for the final score to reach
+        # the threshold; a phonetic agreement adds 40 points on top of 0.6 * ratio.
+        self.min_text_score = threshold
+        if use_phonetic:
+            self.min_text_score = min(threshold, (threshold - 40) / 0.6)
+        
+        # Record string lengths that can still reach the threshold against the full query
+        self.min_length, self.max_length = ratio_length_bounds(len(self.text), self.min_text_score)
+
+    def variants(self) -> List[str]:
+        """Every distinct query string that matching compares against record strings."""
+        return list(dict.fromkeys(v for v in [self.text, *self.tokens, self.rest, *self.others, self.entity_name] if v))
+
+    def phonetic_keys(self) -> List[str]:
+        """Every distinct phonetic key of those query strings."""
+        return list(dict.fromkeys(k for k in [self.key, *self.token_keys, self.rest_key, *self.other_keys,
+                                              self.entity_name_key] if k))
+
+def valid_birth_date(value: str) -> bool:
+    """Whether `value` is a real year, month or day written YYYY, YYYY-MM or YYYY-MM-DD."""
+    date_format = BIRTH_DATE_FORMATS.get(len(value))
+    if date_format is None or not value.isascii():
+        return False
+    try:
+        datetime.strptime(value, date_format)
+    except ValueError:
+        return False
+    return True
+
+def compile_query(query: str, threshold: float = 0.0, use_phonetic: bool = False, birth_date: Optional[str] = None,
+                  birth_year: Optional[int] = None, country: Optional[str] = None,
+                  facets: Optional[Dict[str, List[str]]] = None, retrieval: str = "index") -> CompiledQuery:
+    """
+    Prepare a query string once per request for matching against many records.
+    """
+    return CompiledQuery(query, threshold, use_phonetic, birth_date, birth_year, country, facets, retrieval)
 
 def string_similarity(a: str, b: str) -> float:
     """
@@ -64,76 +162,106 @@ def combined_similarity_score(query_name: str, record_name: str, use_phonetic: b
         
     return final_score
 
-def match_reversed_names(query: str, name: str, surname: str, use_phonetic: bool = False) -> float:
+def prepared_similarity_score(query_name: str, query_key: str, record_name: str, record_key: str,
+                              use_phonetic: bool = False) -> float:
+    """
+    Same score as combined_similarity_score, for inputs that are already
+    normalized and whose Soundex keys are already known.
+    """
+    if not query_name or not record_name:
+        return 0.0
+    
+    text_score = fuzz.ratio(query_name, record_name)
+    
+    if use_phonetic:
+        # If either phonetic key is empty, use just the text score
+        if not query_key or not record_key:
+            return text_score
+        
+        phonetic_score = 100.0 if query_key == record_key else 0.0
+        
+        # Weighted average: 40% phonetic, 60% textual
+        return 0.4 * phonetic_score + 0.6 * text_score
+    
+    return text_score
+
+def match_reversed_names(query: CompiledQuery, view: MatchView, use_phonetic: bool = False) -> float:
     """
-    Match a query against both normal and reversed name order.
+    Match a compiled query against both normal and reversed name order.
     Returns the highest similarity score found.
     """
     max_score = 0.0
+    query_key = query.key
+    query = query.text
     
     # Try normal order: "firstname lastname"
-    normal_order = f"{name} {surname}".strip()
-    if normal_order:
-        score = combined_similarity_score(query, normal_order, use_phonetic)
+    if view.full_name:
+        score = prepared_similarity_score(query, query_key, view.full_name, view.full_name_key, use_phonetic)
         max_score = max(max_score, score)
-        logger.debug(f"Normal order score for '{normal_order}': {score}")
+        logger.debug("Normal order score for '%s': %s", view.full_name, score)
     
-    # Try reversed order: "lastname firstname"
-    reversed_order = f"{surname} {name}".strip()
-    if reversed_order and reversed_order != normal_order:  # Avoid duplicate if one is empty
-        score = combined_similarity_score(query, reversed_order, use_phonetic)
+    # Try reversed order: "lastname firstname" (empty when identical to the normal order)
+    if view.reversed_name:
+        score = prepared_similarity_score(query, query_key, view.reversed_name, view.reversed_name_key, use_phonetic)
         max_score = max(max_score, score)
-        logger.debug(f"Reversed order score for '{reversed_order}': {score}")
+        logger.debug("Reversed order score for '%s': %s", view.reversed_name, score)
     
     return max_score
 
-def match_name_parts(query: str, name: str, surname: str, use_phonetic: bool = False) -> float:
+def match_name_parts(query: CompiledQuery, view: MatchView, use_phonetic: bool = False) -> float:
     """
-    Match query against individual name parts and their combinations.
+    Match a compiled query against individual name parts and their combinations.
     This helps with cases where only partial names are used.
     """
     max_score = 0.0
-    query_parts = query.split()
+    name, name_key = view.name, view.name_key
+    surname, surname_key = view.surname, view.surname_key
     
-    if len(query_parts) >= 2:
+    if len(query.tokens) >= 2:
         # If query has multiple parts, try matching each part against name/surname
-        for i, part in enumerate(query_parts):
+        for i, part in enumerate(query.tokens):
+            part_key = query.token_keys[i]
+            
             # Match first part of query against first name
             if i == 0 and name:
-                score = combined_similarity_score(part, name, use_phonetic)
+                score = prepared_similarity_score(part, part_key, name, name_key, use_phonetic)
                 if score > 70:  # If good match on first name
                     # Check if remaining query matches surname
-                    remaining_query = " ".join(query_parts[1:])
-                    surname_score = combined_similarity_score(remaining_query, surname, use_phonetic)
+                    surname_score = prepared_similarity_score(query.rest, query.rest_key,
+                                                              surname, surname_key, use_phonetic)
                     combined_score = (score + surname_score) / 2
                     max_score = max(max_score, combined_score)
                     
             # Match against surname
             if surname:
-                score = combined_similarity_score(part, surname, use_phonetic)
+                score = prepared_similarity_score(part, part_key, surname, surname_key, use_phonetic)
                 if score > 70:  # If good match on surname
                     # Check if other parts match first name
-                    other_parts = query_parts[:i] + query_parts[i+1:]
-                    if other_parts:
-                        other_query = " ".join(other_parts)
-                        name_score = combined_similarity_score(other_query, name, use_phonetic)
-                        combined_score = (score + name_score) / 2
-                        max_score = max(max_score, combined_score)
+                    name_score = prepared_similarity_score(query.others[i], query.other_keys[i],
+                                                           name, name_key, use_phonetic)
+                    combined_score = (score + name_score) / 2
+                    max_score = max(max_score, combined_score)
     
     return max_score
 
-def match_record(query: str, record: SanctionRecord, use_phonetic: bool = False) -> float:
+def match_record(query: Union[str, CompiledQuery], record: SanctionRecord, use_phonetic: bool = False) -> float:
     """
     Match a query (full name) against a sanction record by comparing the full name and any aliases.
-    Now handles reversed names and partial matches better.
+    Handles reversed names and partial matches, reading the record's precomputed match view.
+    Pass a CompiledQuery when matching the same query against many records.
     Returns the highest similarity score found.
     """
     try:
-        # Normalize query text
-        query = normalize_text(query)
-        if not query:
+        # Normalize query text unless the caller compiled it already
+        if not isinstance(query, CompiledQuery):
+            query = compile_query(query, use_phonetic=use_phonetic)
+        if not query.text:
             logger.warning("Empty query after normalization")
             return 0.0
+        compiled, query_key, query = query, query.key, query.text
+            
+        # Records not produced by load_dataset get their view built on the fly
+        view = getattr(record, "match_view", None) or build_match_view(record)
             
         # Initial score is 0
         max_score = 0.0
@@ -143,73 +271,58 @@ def match_record(query: str, record: SanctionRecord, use_phonetic: bool = False)
         
         # For person records
         if is_person:
-            # Get name and surname safely
-            name = getattr(record, 'name', '')
-            surname = getattr(record, 'surname', '')
-            
             # Try both normal and reversed order
-            reversed_score = match_reversed_names(query, name, surname, use_phonetic)
+            reversed_score = match_reversed_names(compiled, view, use_phonetic)
             max_score = max(max_score, reversed_score)
             
             # Try matching individual parts for partial matches
-            parts_score = match_name_parts(query, name, surname, use_phonetic)
+            parts_score = match_name_parts(compiled, view, use_phonetic)
             max_score = max(max_score, parts_score)
             
             # Check name and surname separately for single name queries
-            query_parts = query.split()
-            if len(query_parts) == 1:
+            if len(compiled.tokens) == 1:
                 # Single word query - check against both name and surname
-                if name:
-                    name_score = combined_similarity_score(query, name, use_phonetic)
+                if view.name:
+                    name_score = prepared_similarity_score(query, query_key, view.name, view.name_key, use_phonetic)
                     max_score = max(max_score, name_score * 0.9)  # Slightly reduced weight for single name
-                    logger.debug(f"Single name match for '{name}': {name_score}")
+                    logger.debug("Single name match for '%s': %s", view.name, name_score)
                     
-                if surname:
-                    surname_score = combined_similarity_score(query, surname, use_phonetic)
+                if view.surname:
+                    surname_score = prepared_similarity_score(query, query_key, view.surname, view.surname_key, use_phonetic)
                     max_score = max(max_score, surname_score * 0.9)  # Slightly reduced weight for single name
-                    logger.debug(f"Single surname match for '{surname}': {surname_score}")
+                    logger.debug("Single surname match for '%s': %s", view.surname, surname_score)
                 
         else:
-            # For non-person records, use caption or name property
-            entity_name = ""
-            
-            # Try to get name from properties
-            if hasattr(record, 'properties') and record.properties:
-                props = record.properties
-                name_list = props.get("name", [])
-                if name_list:
-                    entity_name = name_list[0]
-            
-            # If no name found in properties, use caption
-            if not entity_name and hasattr(record, 'caption'):
-                entity_name = record.caption
-                
-            # Match against entity name
-            if entity_name:
-                score = combined_similarity_score(query, entity_name, use_phonetic)
+            # For non-person records the view holds the name property or caption
+            if view.full_name:
+                score = prepared_similarity_score(query, query_key, view.full_name, view.full_name_key, use_phonetic)
+                max_score = max(max_score, score)
+                logger.debug("Entity name score for '%s': %s", view.full_name, score)
+
+            # Names and aliases again, regardless of legal forms, filler words and word order
+            for i, entity_name in enumerate(view.entity_names):
+                score = prepared_similarity_score(compiled.entity_name, compiled.entity_name_key, entity_name,
+                                                  view.entity_name_keys[i], use_phonetic)
                 max_score = max(max_score, score)
-                logger.debug(f"Entity name score for '{entity_name}': {score}")
         
         # Check against aliases - also try reversed for aliases
-        aliases = getattr(record, 'aliases', []) or []
-        for alias in aliases:
-            if alias:
-                # Direct alias match
-                alias_score = combined_similarity_score(query, alias, use_phonetic)
-                max_score = max(max_score, alias_score)
-                logger.debug(f"Alias score for '{alias}': {alias_score}")
-                
-                # If alias contains spaces, try reversed
-                alias_parts = alias.split()
-                if len(alias_parts) >= 2:
-                    reversed_alias = " ".join(reversed(alias_parts))
-                    reversed_alias_score = combined_similarity_score(query, reversed_alias, use_phonetic)
-                    max_score = max(max_score, reversed_alias_score)
-                    logger.debug(f"Reversed alias score for '{reversed_alias}': {reversed_alias_score}")
+        for i, alias in enumerate(view.aliases):
+            # Direct alias match
+            alias_score = prepared_similarity_score(query, query_key, alias, view.alias_keys[i], use_phonetic)
+            max_score = max(max_score, alias_score)
+            logger.debug("Alias score for '%s': %s", alias, alias_score)
+            
+            # If alias contains spaces, try reversed
+            reversed_alias = view.reversed_aliases[i]
+            if reversed_alias:
+                reversed_alias_score = prepared_similarity_score(query, query_key, reversed_alias,
+                                                                 view.reversed_alias_keys[i], use_phonetic)
+                max_score = max(max_score, reversed_alias_score)
+                logger.debug("Reversed alias score for '%s': %s", reversed_alias, reversed_alias_score)
                 
-        logger.debug(f"Final max score for record: {max_score}")
+        logger.debug("Final max score for record: %s", max_score)
         return max_score
         
     except Exception as e:
         logger.error(f"Error in match_record: {e}")
-        return 0.0
\ No newline at end of file
+        return 0.0
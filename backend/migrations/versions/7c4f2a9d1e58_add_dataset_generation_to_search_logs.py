@@ -0,0 +1,28 @@
+"""Add dataset generation to search_logs
+
+Revision ID: 7c4f2a9d1e58
+Revises: 3526e89c8cb2
+Create Date: 2026-10-17 10:12:41.518203
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '7c4f2a9d1e58'
+down_revision: Union[str, None] = '3526e89c8cb2'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('search_logs', sa.Column('dataset_version', sa.String(length=32), nullable=True))
+    op.add_column('search_logs', sa.Column('dataset_built_at', sa.String(length=40), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column('search_logs', 'dataset_built_at')
+    op.drop_column('search_logs', 'dataset_version')
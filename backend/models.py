@@ -8,6 +8,61 @@ from pydantic import BaseModel, Field
 
 
 
+class MatchView:
+    """
+    Normalized strings and Soundex keys of a record, precomputed once at load time for matching.
+    One is held per loaded record, so it is a slotted class with tuple fields.
+    """
+    __slots__ = ("full_name", "full_name_key", "reversed_name", "reversed_name_key", "name", "name_key",
+                 "surname", "surname_key", "tokens", "aliases", "alias_keys", "reversed_aliases",
+                 "reversed_alias_keys", "entity_names", "entity_name_keys")
+
+    def __init__(self, full_name: str = "", full_name_key: str = "", reversed_name: str = "",
+                 reversed_name_key: str = "", name: str = "", name_key: str = "", surname: str = "",
+                 surname_key: str = "", tokens: tuple = (), aliases: tuple = (), alias_keys: tuple = (),
+                 reversed_aliases: tuple = (), reversed_alias_keys: tuple = (), entity_names: tuple = (),
+                 entity_name_keys: tuple = ()):
+        self.full_name = full_name                      # "name surname" for persons, entity name otherwise
+        self.full_name_key = full_name_key
+        self.reversed_name = reversed_name              # "surname name", empty when identical to full_name
+        self.reversed_name_key = reversed_name_key
+        self.name = name
+        self.name_key = name_key
+        self.surname = surname
+        self.surname_key = surname_key
+        self.tokens = tokens
+        self.aliases = aliases
+        self.alias_keys = alias_keys
+        self.reversed_aliases = reversed_aliases        # empty for single-word aliases
+        self.reversed_alias_keys = reversed_alias_keys
+        self.entity_names = entity_names                # non-person names and aliases, see entity_name_form
+        self.entity_name_keys = entity_name_keys
+
+class CompactRecord:
+    """
+    In-memory form of a loaded sanction record: identifiers, normalized names,
+    the interned values screening filters on and the match view. The full
+    properties stay in the RecordStore until a response needs them.
+    """
+    __slots__ = ("id", "caption", "schema", "name", "surname", "last_change",
+                 "datasets", "countries", "topics", "identifiers", "birth_dates", "match_view")
+
+    def __init__(self, id: str, caption: str, schema: str, name: str, surname: str, last_change: str,
+                 datasets: tuple = (), countries: tuple = (), topics: tuple = (), identifiers: tuple = (),
+                 birth_dates: tuple = (), match_view: Optional[MatchView] = None):
+        self.id = id
+        self.caption = caption
+        self.schema = schema
+        self.name = name
+        self.surname = surname
+        self.last_change = last_change
+        self.datasets = datasets
+        self.countries = countries
+        self.topics = topics
+        self.identifiers = identifiers  # normalized document and registration numbers
+        self.birth_dates = birth_dates  # as listed: "1970", "1970-05" or "1970-05-12"
+        self.match_view = match_view
+
 class SanctionRecord(BaseModel):
     id: str
     caption: str
@@ -31,6 +86,20 @@ class VerifyIdentityRequest(BaseModel):
     threshold: float = 80.0
     phonetic: bool = False
     top_n: int = 5
+    identifier: str = ""
+    birth_date: Optional[str] = None
+    birth_year: Optional[int] = None
+    country: Optional[str] = None
+    datasets: List[str] = Field(default_factory=list)
+    topics: List[str] = Field(default_factory=list)
+    countries: List[str] = Field(default_factory=list)
+    retrieval: str = "index"
+
+class BatchScreeningRow(BaseModel):
+    name: str = ""
+    surname: str = ""
+    entity_type: str = "person"
+    birth_date: Optional[str] = None
 
 class MatchResult(BaseModel):
     name: str
@@ -38,12 +107,16 @@ class MatchResult(BaseModel):
     country: Optional[str] = None
     birth_date: Optional[str] = None
     score: float
+    identifier_match: bool = False  # the record carries the queried document or registration number
     details: Dict
 
 class VerifyIdentityResponse(BaseModel):
     timestamp: str
     matches: List[MatchResult]
     status: str
+    dataset_version: Optional[str] = None  # Version of the dataset generation that was screened
+    dataset_built_at: Optional[str] = None
+    facets: Optional[Dict[str, Dict[str, int]]] = None  # Matches per dataset, topic and country
 
 # New models for OCR and AI functionality
 
@@ -1,18 +1,128 @@
 
 
 
+# phonetic_cache.py
 
+import os
+import re
+import logging
+from array import array
+from typing import Dict, Iterable, List, Sequence, Tuple
 
-# phonetic_cache.py
+import numpy as np
 
-import textdistance
-from typing import Dict
+logger = logging.getLogger("ComplianceService")
 
-# A global dictionary to store phonetic keys, keyed by record ID or index.
-PHONETIC_CACHE: Dict[int, str] = {}
+# "soundex" (default) or "double_metaphone"; the latter needs the optional `metaphone` package
+PHONETIC_ALGORITHM = os.getenv("PHONETIC_ALGORITHM", "soundex").lower()
 
-def compute_phonetic_key(full_name: str) -> str:
+try:
+    from metaphone import doublemetaphone
+except ImportError:  # optional dependency
+    doublemetaphone = None
+
+if PHONETIC_ALGORITHM == "double_metaphone" and doublemetaphone is None:
+    logger.warning("PHONETIC_ALGORITHM=double_metaphone but the metaphone package is not installed; using Soundex")
+    PHONETIC_ALGORITHM = "soundex"
+
+# American Soundex digit for each consonant; vowels, H, W and Y carry no code.
+SOUNDEX_CODES: Dict[str, str] = {
+    letter: digit
+    for letters, digit in (
+        ("BFPV", "1"),
+        ("CGJKQSXZ", "2"),
+        ("DT", "3"),
+        ("L", "4"),
+        ("MN", "5"),
+        ("R", "6"),
+    )
+    for letter in letters
+}
+
+# Letters translated to their Soundex digit; vowels and Y become "0" (they separate
+# equal digits), H and W are dropped (they do not)
+SOUNDEX_TABLE = str.maketrans({**SOUNDEX_CODES, **dict.fromkeys("AEIOUY", "0"), "H": None, "W": None})
+NON_LETTERS = re.compile(r"[^A-Z]+")
+REPEATED_DIGITS = re.compile(r"(\d)\1+")
+
+def soundex(full_name: str) -> str:
     """
     Compute the Soundex key for a given name or full_name.
+    Non-letter characters (spaces, digits) are ignored; returns "" if no letters remain.
     """
-    return textdistance.soundex(full_name)
+    letters = NON_LETTERS.sub("", full_name.upper())
+    if not letters:
+        return ""
+
+    # Digits after the first letter, led by the first letter's own code so that
+    # a run continuing it is dropped too; then collapse runs and drop separators
+    first = letters[0]
+    digits = SOUNDEX_CODES.get(first, "0") + letters[1:].translate(SOUNDEX_TABLE)
+    digits = REPEATED_DIGITS.sub(r"\1", digits)[1:].replace("0", "")
+
+    return (first + digits + "000")[:4]
+
+def compute_phonetic_key(full_name: str) -> str:
+    """
+    Compute the phonetic key used for matching: Soundex, or the primary
+    Double Metaphone code when PHONETIC_ALGORITHM selects it.
+    """
+    if PHONETIC_ALGORITHM == "double_metaphone":
+        return doublemetaphone(full_name)[0]
+    return soundex(full_name)
+
+def record_codes(record) -> List[str]:
+    """Distinct phonetic keys of the record's match view: whole names, aliases and name tokens."""
+    view = record.match_view
+    if view is None:
+        return []
+    keys = [view.full_name_key, view.reversed_name_key, view.name_key, view.surname_key,
+            *view.alias_keys, *view.reversed_alias_keys, *view.entity_name_keys,
+            *(compute_phonetic_key(token) for token in view.tokens)]
+    return list(dict.fromkeys(k for k in keys if k))
+
+class PhoneticIndex:
+    """
+    Blocking index from phonetic keys to the positions of the records carrying
+    them, built once at load time from the keys of whole names, aliases and
+    individual name tokens.
+    """
+
+    def __init__(self):
+        self.codes: Dict[str, array] = {}
+
+    def add_record(self, record, position: int) -> None:
+        """Register every phonetic key of the record's match view."""
+        for code in record_codes(record):
+            self.codes.setdefault(code, array("I")).append(position)
+
+    def updated(self, removed: Sequence[Tuple[object, int]], added: Sequence[Tuple[object, int]]) -> "PhoneticIndex":
+        """
+        Copy of the index without the `removed` and with the `added` (record,
+        position) pairs. Only the postings of their keys are rewritten.
+        """
+        other = PhoneticIndex()
+        other.codes = dict(self.codes)
+        if removed:
+            dropped = np.array([position for _, position in removed], dtype=np.uint32)
+            codes = {code for record, _ in removed for code in record_codes(record)}
+            for code in codes:
+                kept = np.frombuffer(other.codes[code], dtype=np.uint32)
+                kept = kept[~np.isin(kept, dropped)]
+                if len(kept):
+                    other.codes[code] = array("I", kept.tobytes())
+                else:
+                    del other.codes[code]
+        for code in {code for record, _ in added for code in record_codes(record)}:
+            if code in other.codes:
+                other.codes[code] = array("I", other.codes[code].tobytes())
+        for record, position in added:
+            other.add_record(record, position)
+        return other
+
+    def lookup(self, codes: Iterable[str]) -> np.ndarray:
+        """Sorted positions of the records sharing at least one of the given keys."""
+        postings = [np.frombuffer(self.codes[code], dtype=np.uint32) for code in codes if code in self.codes]
+        if not postings:
+            return np.zeros(0, dtype=np.int64)
+        return np.unique(np.concatenate(postings)).astype(np.int64)
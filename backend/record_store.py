@@ -0,0 +1,255 @@
+
+
+
+# record_store.py
+
+import os
+import json
+import mmap
+import logging
+from array import array
+from collections.abc import Mapping, Sequence
+from typing import Any, Dict, Iterator, List, Optional, Tuple, Union
+
+import numpy as np
+
+from data_ingestion import parse_record, compact_record, dataset_compression
+from models import SanctionRecord
+
+logger = logging.getLogger("ComplianceService")
+
+class DatasetChangedError(RuntimeError):
+    """The mapped dataset file no longer holds the record expected at a position (it was overwritten in place)."""
+
+class PackedLines(Sequence):
+    """
+    Record lines packed into one byte buffer with their offsets, so a snapshot
+    stores them as two arrays that are memory-mapped out of band instead of
+    unpickled into every process. Lines appended later (by deltas) are kept
+    in a list next to them.
+    """
+
+    def __init__(self, data: np.ndarray, offsets: np.ndarray, extra: Optional[List[bytes]] = None):
+        self.data = data
+        self.offsets = offsets
+        self.extra = extra if extra is not None else []
+
+    @classmethod
+    def pack(cls, lines: List[bytes]) -> "PackedLines":
+        offsets = np.zeros(len(lines) + 1, dtype=np.uint64)
+        np.cumsum([len(line) for line in lines], out=offsets[1:])
+        return cls(np.frombuffer(b"".join(lines), dtype=np.uint8), offsets)
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1 + len(self.extra)
+
+    def __getitem__(self, position: int) -> bytes:
+        packed = len(self.offsets) - 1
+        if position >= packed:
+            return self.extra[position - packed]
+        return self.data[int(self.offsets[position]):int(self.offsets[position + 1])].tobytes()
+
+    def append(self, line: bytes) -> None:
+        self.extra.append(line)
+
+    def copy(self) -> "PackedLines":
+        """Copy sharing the packed buffer, with its own list of appended lines."""
+        return PackedLines(self.data, self.offsets, list(self.extra))
+
+class RecordStore:
+    """
+    On-disk store of the raw OpenSanctions JSON of the loaded records: the
+    dataset file, memory-mapped, plus the byte offset and length of each
+    record by dataset position. Record bodies stay off the Python heap; a
+    record is only read and parsed (hydrated) when a response needs it.
+    A compressed dataset cannot be mapped, so its record lines are kept in
+    memory (`blobs`) instead, or in the snapshot as PackedLines.
+
+    Lines read from the mapped file are checked against `ids`, the record id
+    expected at each position, so a dataset file overwritten in place (rather
+    than replaced by rename) raises DatasetChangedError instead of returning
+    another entity's details or faulting on a truncated mapping.
+    """
+
+    def __init__(self, file_path: Optional[str] = None):
+        self.file_path = file_path
+        self.offsets = array("Q")
+        self.lengths = array("I")
+        self._file = None
+        self._map: Optional[mmap.mmap] = None
+        self.blobs: Optional[Union[List[bytes], PackedLines]] = None
+        # Record ids by position in the mapped file (None: not checked)
+        self.ids: Optional[Sequence[str]] = None
+        # Lines of records added by deltas, by position
+        self.overlay: Dict[int, bytes] = {}
+
+        if file_path is not None and dataset_compression(file_path) is not None:
+            self.blobs = []
+        elif file_path is not None:
+            self._file = open(file_path, "rb")
+            if os.fstat(self._file.fileno()).st_size:
+                self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def append(self, offset: int, length: int) -> None:
+        """Register the line at `offset` of the file as the next dataset position."""
+        self.offsets.append(offset)
+        self.lengths.append(length)
+
+    def append_raw(self, line: bytes) -> None:
+        """
+        Register a record line that is not in the mapped file (from a compressed
+        dataset or a delta) as the next dataset position.
+        """
+        if self.blobs is not None:
+            self.blobs.append(line)
+            return
+        self.overlay[len(self.offsets)] = line
+        self.append(0, 0)
+
+    def extended(self, lines: List[bytes]) -> "RecordStore":
+        """
+        Copy of the store with `lines` at the next positions. The copy maps the
+        same file through its own descriptor, so closing either one leaves the
+        other readable, even after the dataset file was replaced by rename.
+        """
+        other = RecordStore()
+        other.file_path = self.file_path
+        other.offsets = array("Q", self.offsets.tobytes())
+        other.lengths = array("I", self.lengths.tobytes())
+        other.blobs = self.blobs.copy() if self.blobs is not None else None
+        other.overlay = dict(self.overlay)
+        other.ids = self.ids
+        if self._file is not None:
+            other._file = os.fdopen(os.dup(self._file.fileno()), "rb")
+            if self._map is not None:
+                other._map = mmap.mmap(other._file.fileno(), 0, access=mmap.ACCESS_READ)
+        for line in lines:
+            other.append_raw(line)
+        return other
+
+    def __len__(self) -> int:
+        return len(self.blobs) if self.blobs is not None else len(self.offsets)
+
+    def raw_bytes(self, position: int) -> bytes:
+        """The JSON line of the record at `position`, as stored in the dataset file."""
+        line = self._line(position)
+        if self._checked(position):
+            self._check(position, line, _entry(line))
+        return line
+
+    def raw(self, position: int) -> Dict[str, Any]:
+        """The dataset entry at `position`, as parsed JSON."""
+        line = self._line(position)
+        if not self._checked(position):
+            return json.loads(line)
+        entry = _entry(line)
+        self._check(position, line, entry)
+        return entry
+
+    def _line(self, position: int) -> bytes:
+        if self.blobs is not None:
+            return self.blobs[position]
+        if position in self.overlay:
+            return self.overlay[position]
+        offset = self.offsets[position]
+        end = offset + self.lengths[position]
+        # Reading past the end of a file truncated since it was mapped faults the process
+        if end > os.fstat(self._file.fileno()).st_size:
+            raise DatasetChangedError(f"{self.file_path} was truncated since it was loaded")
+        return self._map[offset:end].strip()
+
+    def _checked(self, position: int) -> bool:
+        # Only lines read from the mapped file can change under the store
+        return (self.blobs is None and self.ids is not None and position < len(self.ids)
+                and position not in self.overlay)
+
+    def _check(self, position: int, line: bytes, entry: Any) -> None:
+        expected = str(self.ids[position])
+        found = entry.get("id") if isinstance(entry, dict) else None
+        if found != expected:
+            raise DatasetChangedError(f"{self.file_path} changed since it was loaded: expected record "
+                                      f"{expected} at position {position}, found {found or line[:40]!r}")
+
+    def hydrate(self, position: int) -> SanctionRecord:
+        """The full SanctionRecord at `position`, as load_dataset used to keep it."""
+        return parse_record(self.raw(position))
+
+    def close(self) -> None:
+        """Unmap and close the dataset file."""
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+def _entry(line: bytes) -> Any:
+    """Parsed JSON line, or None when it is not valid JSON."""
+    try:
+        return json.loads(line)
+    except ValueError:
+        return None
+
+class StoredRecords(Sequence):
+    """
+    The compact records of a dataset served from a snapshot, without keeping
+    them in memory: ids and last changes come from (mapped) columns, and a
+    record is rebuilt from the record store when it is accessed.
+    """
+
+    def __init__(self, store: RecordStore, ids: np.ndarray, last_changes: np.ndarray, count: Optional[int] = None):
+        self.store = store
+        self.ids = ids
+        self.last_changes = last_changes
+        self.count = len(ids) if count is None else count
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __getitem__(self, position):
+        if isinstance(position, slice):
+            return [self[p] for p in range(*position.indices(self.count))]
+        if not -self.count <= position < self.count:
+            raise IndexError(position)
+        return compact_record(self.store.raw(position % self.count))
+
+    def identity(self, position: int) -> Tuple[str, str]:
+        """(id, last_change) of the record at `position`, as dataset_version hashes it."""
+        if position < len(self.ids):
+            return str(self.ids[position]), str(self.last_changes[position])
+        record = self[position]
+        return record.id, record.last_change
+
+    def extended(self, store: RecordStore, count: int) -> "StoredRecords":
+        """The records of `store`, a copy of this one's store with records added up to `count`."""
+        return StoredRecords(store, self.ids, self.last_changes, count)
+
+class PositionIndex(Mapping):
+    """
+    Read-only id -> dataset position lookup over ids sorted into a (mapped)
+    array, searched by bisection instead of held in a dict.
+    """
+
+    def __init__(self, ids: np.ndarray, positions: np.ndarray):
+        self.ids = ids
+        self.positions = positions
+
+    @classmethod
+    def build(cls, ids: List[str]) -> "PositionIndex":
+        """Index of ids listed in dataset order; a repeated id maps to its last position, like a dict."""
+        ids = np.array(ids, dtype=str)
+        # np.unique keeps the first occurrence, so search the ids from the end
+        unique, first = np.unique(ids[::-1], return_index=True)
+        return cls(unique, (len(ids) - 1 - first).astype(np.int64))
+
+    def __getitem__(self, record_id: str) -> int:
+        i = int(np.searchsorted(self.ids, record_id))
+        if i < len(self.ids) and self.ids[i] == record_id:
+            return int(self.positions[i])
+        raise KeyError(record_id)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.ids.tolist())
+
+    def __len__(self) -> int:
+        return len(self.ids)
@@ -3,11 +3,16 @@
 # routes.py
 
 import os
+import io
+import csv
+import gzip
 import json
 import logging
 from datetime import datetime, timezone
 from fastapi import APIRouter, Query, Depends, HTTPException, Request, File, Form, UploadFile, BackgroundTasks
-from fastapi.responses import JSONResponse, FileResponse
+from fastapi.responses import JSONResponse, FileResponse, StreamingResponse, Response
+from starlette.concurrency import run_in_threadpool
+from pydantic import ValidationError
 from sqlalchemy.orm import Session
 from typing import List, Optional, Dict, Any
 import tempfile
@@ -15,11 +20,13 @@ import shutil
 import base64
 
 
-from data_ingestion import load_dataset
-from matching import match_record
-from models import VerifyIdentityResponse, MatchResult
-from audit_log import log_search
-from database import get_db
+from matching import compile_query, valid_birth_date, RETRIEVAL_MODES
+from screening_cache import ScreeningCache
+from dataset_manager import DatasetManager
+from record_store import DatasetChangedError
+from models import VerifyIdentityResponse, MatchResult, SanctionRecord, BatchScreeningRow
+from audit_log import log_search, log_search_bulk
+from database import get_db, SessionLocal
 from db_models import LogEntry, CustomerRegistration
 # from screenshot_bySelenium import take_screenshot
 from pdfBuilder import generate_pdf_report
@@ -37,171 +44,269 @@ router = APIRouter()
 
 DATASET_FILE = r"Open_sanctions_target_nested_json_dataset"
 
-# Load dataset once at startup
-try:
-    sanction_dataset = load_dataset(DATASET_FILE)
-    logger.info(f"Loaded {len(sanction_dataset)} sanction records.")
-except Exception as e:
-    logger.error(f"Error loading dataset: {e}")
-    sanction_dataset = []
+# Rows of a batch screening sent to the scoring shards and audited per round
+BATCH_CHUNK_SIZE = int(os.getenv("BATCH_CHUNK_SIZE", "200"))
+
+# Load the dataset at startup (from its snapshot when current): compact records
+# for screening, raw entries in the record store for match details, candidate
+# indexes and batch scoring split across worker processes. A new export is
+# picked up by the watcher or POST /admin/reload_dataset without a restart.
+sanction_datasets = DatasetManager(DATASET_FILE)
+sanction_datasets.load()
+sanction_datasets.start_watcher()
+logger.info(f"Dataset version: {sanction_datasets.generation.version}")
+
+# Recent screening results, tied to the version of the dataset they came from
+screening_cache = ScreeningCache()
+
+
+def dataset_changed(error: DatasetChangedError) -> HTTPException:
+    """
+    503 for a dataset file overwritten in place under the loaded dataset,
+    after starting the reload that picks up its new contents.
+    """
+    logger.error(f"{error}; reloading the dataset")
+    sanction_datasets.request_reload()
+    return HTTPException(status_code=503, detail="The sanctions dataset file changed and is being reloaded, retry shortly")
+
+
+def build_match_result(record: SanctionRecord, score: float, entity_type: str,
+                       identifier_match: bool = False) -> MatchResult:
+    """
+    Format a scored sanction record for the verify_identity response.
+    """
+    props = getattr(record, 'properties', {})
+    
+    # Format match data differently based on entity type
+    if entity_type.lower() == "person":
+        # Safe extraction with fallbacks
+        first_name = ""
+        last_name = ""
+        birth_date = "N/A"
+        country = "N/A"
+        
+        # Extract first and last name
+        if "firstName" in props and props["firstName"]:
+            first_name = props["firstName"][0]
+        if "lastName" in props and props["lastName"]:
+            last_name = props["lastName"][0]
+            
+        # Extract birth date
+        if "birthDate" in props and props["birthDate"]:
+            birth_date = props["birthDate"][0]
+            
+        # Extract country
+        if "country" in props and props["country"]:
+            country = props["country"][0]
+
+        # If names are missing, try to use record.name and record.surname
+        if not first_name:
+            first_name = getattr(record, 'name', '')
+        if not last_name:
+            last_name = getattr(record, 'surname', '')
+            
+        # If still missing, use caption
+        if not first_name and not last_name:
+            caption_parts = getattr(record, 'caption', '').split()
+            if caption_parts:
+                first_name = caption_parts[0]
+                if len(caption_parts) > 1:
+                    last_name = ' '.join(caption_parts[1:])
+
+        display_name = first_name
+        
+    else:  # Entity or Company                
+        # For non-person entities
+        name_list = props.get("name", [])
+        if not name_list:
+            display_name = getattr(record, 'caption', 'Unknown Entity')
+        else:
+            display_name = name_list[0]
+            
+        country = "N/A"
+        if "country" in props and props["country"]:
+            country = props["country"][0]
+            
+        birth_date = "N/A"
+        if "createdAt" in props and props["createdAt"]:
+            birth_date = props["createdAt"][0]
+        
+        # Entity-specific extra details
+        reg_numbers = props.get("registrationNumber", ["N/A"])
+        unique_ids = props.get("uniqueEntityId", ["N/A"])
+        aliases = props.get("alias", [])
+
+        # Format the properties for better display
+        props_clean = {
+            "full_name": name_list or [display_name],
+            "aliases": aliases or [],
+            "registration_numbers": reg_numbers,
+            "unique_entity_ids": unique_ids,
+            "address": props.get("address", ["N/A"]),
+            "country": country,
+            "created_at": birth_date,
+            "topics": props.get("topics", ["N/A"])
+        }
+        
+        # For non-person entities, we use the props_clean
+        props = props_clean
+        last_name = ""  # Empty for non-person entities
+
+    # Create the match result
+    return MatchResult(
+        name=display_name,
+        surname=last_name,
+        country=country,
+        birth_date=birth_date,
+        score=round(score, 2),
+        identifier_match=identifier_match,
+        details={
+            "id": getattr(record, 'id', 'unknown'),
+            "caption": getattr(record, 'caption', 'unknown'),
+            "properties": props,
+            "datasets": getattr(record, 'datasets', []),
+            "referents": getattr(record, 'referents', []),
+            "first_seen": getattr(record, 'first_seen', ''),
+            "last_seen": getattr(record, 'last_seen', ''),
+            "last_change": getattr(record, 'last_change', ''),
+            "target": getattr(record, 'target', False)
+        }
+    )
+
+
+def facet_filters(**params: List[str]) -> Dict[str, List[str]]:
+    """Facet filters of a request; each parameter may be repeated or hold comma-separated values."""
+    filters = {}
+    for facet, values in params.items():
+        values = [v.strip() for value in values for v in value.split(",") if v.strip()]
+        if values:
+            filters[facet] = values
+    return filters
 
 
 #---------------------------------------------------------------------
 
 @router.get("/verify_identity", response_model=VerifyIdentityResponse)
 def verify_identity(
-    name: str,
+    name: str = "",
     surname: str = "",
     entity_type: str = Query("person"),
     threshold: float = Query(80.0),
     phonetic: bool = Query(False),
     top_n: int = Query(5),
+    identifier: str = Query(""),
+    birth_date: str = Query(""),
+    birth_year: Optional[int] = Query(None),
+    country: str = Query(""),
+    datasets: List[str] = Query([]),
+    topics: List[str] = Query([]),
+    countries: List[str] = Query([]),
+    retrieval: str = Query("index"),
     db: Session = Depends(get_db)
 ):
+    """
+    Screen a name against the sanctions dataset. With an `identifier` (passport,
+    ID or registration number, e.g. the document number read by OCR), records
+    carrying it are returned first and flagged, scored on the name when one is
+    given and 100 otherwise; the name alone can then be left out.
+
+    `birth_date` (YYYY, YYYY-MM or YYYY-MM-DD), `birth_year` and `country` (a
+    country code) leave out the records that list another birth date, year of
+    birth (beyond BIRTH_YEAR_TOLERANCE) or country before any name is scored.
+
+    `datasets`, `topics` and `countries` screen only the records in one of the
+    given values of each ("eu_fsf,un_sc_sanctions"); a value starting with "-"
+    leaves out the records carrying it ("-role.pep"). The response counts all
+    the matches per dataset, topic and country, not only the returned ones.
+
+    `retrieval` "tfidf" scores only the records whose names are closest to the
+    query in TF-IDF space instead of every record within reach of the
+    threshold: faster for long company names, at the cost of completeness.
+    """
     # Input validation
-    if not name:
-        raise HTTPException(status_code=400, detail="Name parameter is required")
+    if not name and not identifier:
+        raise HTTPException(status_code=400, detail="Name or identifier parameter is required")
+    if birth_date and not valid_birth_date(birth_date):
+        raise HTTPException(status_code=400, detail="Birth date must be a real date written YYYY, YYYY-MM or YYYY-MM-DD")
+    if retrieval not in RETRIEVAL_MODES:
+        raise HTTPException(status_code=400, detail=f"Retrieval must be one of {', '.join(RETRIEVAL_MODES)}")
     
     if threshold < 0 or threshold > 100:
         raise HTTPException(status_code=400, detail="Threshold must be between 0 and 100")
     
     # Log request details
-    logger.info(f"Processing verify_identity request: name='{name}', surname='{surname}', type='{entity_type}', threshold={threshold}")
+    logger.info(f"Processing verify_identity request: name='{name}', surname='{surname}', type='{entity_type}', "
+                f"threshold={threshold}, identifier='{identifier}', birth_date='{birth_date}', "
+                f"birth_year={birth_year}, country='{country}', retrieval='{retrieval}'")
     
     # Construct query full name
     query_full_name = f"{name} {surname}".strip()
     logger.info(f"Constructed full name for matching: '{query_full_name}'")
     
-    matches = []
-    logger.info(f"Starting match process against {len(sanction_dataset)} records...")
+    # Normalize, split and key the query once for the whole scan
+    facets = facet_filters(datasets=datasets, topics=topics, countries=countries)
+    compiled_query = compile_query(query_full_name, threshold, phonetic, birth_date, birth_year, country, facets,
+                                   retrieval)
     
-    # Debug: Check if we have data
-    if not sanction_dataset:
-        logger.warning("No records in sanction dataset to match against!")
-
-    # Track some metrics
-    records_processed = 0
-    potential_matches = 0
-
-    for record in sanction_dataset:
-        records_processed += 1
-        
-        # Filter based on selected type
-        record_schema = getattr(record, 'schema', '').lower()
-        if entity_type.lower() == "person" and record_schema != "person":
-            continue
-        elif entity_type.lower() != "person" and record_schema == "person":
-            continue
-        
-        # Match the record
-        logger.debug(f"Matching against record ID={getattr(record, 'id', 'unknown')}, caption='{getattr(record, 'caption', 'unknown')}'")
-        score = match_record(query_full_name, record, use_phonetic=phonetic)
+    matches = []
+    # The whole request runs on one dataset generation, even if a reload swaps in another
+    with sanction_datasets.use() as dataset:
+        logger.info(f"Starting match process against {len(dataset.records)} records...")
         
-        if score >= threshold:
-            potential_matches += 1
+        # Debug: Check if we have data
+        if not dataset.records:
+            logger.warning("No records in sanction dataset to match against!")
+
+        # Records carrying the identifier, straight from the identifier index
+        person = entity_type.lower() == "person"
+        identifier_matches = []
+        if identifier:
+            identifier_matches = dataset.screener.lookup(identifier, compiled_query, person)
+        if identifier_matches:
+            logger.info(f"Identifier '{identifier}' found on {len(identifier_matches)} records")
+
+        # Candidate lookup, scoring and top-N selection run on the dataset shards,
+        # unless the same normalized query was screened recently
+        top_matches, potential_matches, records_processed = [], 0, 0
+        if name:
+            cache_key = (compiled_query.text, entity_type.lower(), threshold, phonetic, top_n,
+                         compiled_query.birth_date, birth_year, compiled_query.country,
+                         tuple((facet, tuple(values)) for facet, values in compiled_query.facets.items()), retrieval)
+            screening = screening_cache.get(dataset.version, cache_key)
+            if screening is None:
+                screening = dataset.screener.screen(compiled_query, person, top_n)
+                screening_cache.put(dataset.version, cache_key, screening)
+            else:
+                logger.info(f"Screening cache hit for '{compiled_query.text}'")
+            top_matches, potential_matches, records_processed = screening
+
+        # Facet counts cover every match. When the top-N screening stopped at
+        # top_n it may have left some out, and the shards count a full one
+        identified_positions = [position for position, _ in identifier_matches]
+        if name and len(top_matches) >= top_n:
+            facets_key = ("facets", *cache_key, tuple(identified_positions))
+            facets_found = screening_cache.get(dataset.version, facets_key)
+            if facets_found is None:
+                facets_found = dataset.screener.facet_counts(identified_positions, compiled_query, person)
+                screening_cache.put(dataset.version, facets_key, facets_found)
+        else:
+            facets_found = dataset.screener.facet_counts(identified_positions + [p for p, _ in top_matches])
+
+        # Identifier matches first, then name matches not already among them
+        identified = {position for position, _ in identifier_matches}
+        ranked = identifier_matches + [match for match in top_matches if match[0] not in identified]
+        ranked = ranked[:top_n]
+
+        # Only the returned records are formatted, already ranked by score
+        for position, score in ranked:
+            try:
+                record = dataset.store.hydrate(position)
+            except DatasetChangedError as e:
+                raise dataset_changed(e)
             logger.info(f"Match found with score {score} for record: {getattr(record, 'caption', 'unknown')}")
-            
-            props = getattr(record, 'properties', {})
-            
-            # Format match data differently based on entity type
-            if entity_type.lower() == "person":
-                # Safe extraction with fallbacks
-                first_name = ""
-                last_name = ""
-                birth_date = "N/A"
-                country = "N/A"
-                
-                # Extract first and last name
-                if "firstName" in props and props["firstName"]:
-                    first_name = props["firstName"][0]
-                if "lastName" in props and props["lastName"]:
-                    last_name = props["lastName"][0]
-                    
-                # Extract birth date
-                if "birthDate" in props and props["birthDate"]:
-                    birth_date = props["birthDate"][0]
-                    
-                # Extract country
-                if "country" in props and props["country"]:
-                    country = props["country"][0]
-
-                # If names are missing, try to use record.name and record.surname
-                if not first_name:
-                    first_name = getattr(record, 'name', '')
-                if not last_name:
-                    last_name = getattr(record, 'surname', '')
-                    
-                # If still missing, use caption
-                if not first_name and not last_name:
-                    caption_parts = getattr(record, 'caption', '').split()
-                    if caption_parts:
-                        first_name = caption_parts[0]
-                        if len(caption_parts) > 1:
-                            last_name = ' '.join(caption_parts[1:])
-
-                display_name = first_name
-                
-            else:  # Entity or Company                
-                # For non-person entities
-                name_list = props.get("name", [])
-                if not name_list:
-                    display_name = getattr(record, 'caption', 'Unknown Entity')
-                else:
-                    display_name = name_list[0]
-                    
-                country = "N/A"
-                if "country" in props and props["country"]:
-                    country = props["country"][0]
-                    
-                birth_date = "N/A"
-                if "createdAt" in props and props["createdAt"]:
-                    birth_date = props["createdAt"][0]
-                
-                # Entity-specific extra details
-                reg_numbers = props.get("registrationNumber", ["N/A"])
-                unique_ids = props.get("uniqueEntityId", ["N/A"])
-                aliases = props.get("alias", [])
-
-                # Format the properties for better display
-                props_clean = {
-                    "full_name": name_list or [display_name],
-                    "aliases": aliases or [],
-                    "registration_numbers": reg_numbers,
-                    "unique_entity_ids": unique_ids,
-                    "address": props.get("address", ["N/A"]),
-                    "country": country,
-                    "created_at": birth_date,
-                    "topics": props.get("topics", ["N/A"])
-                }
-                
-                # For non-person entities, we use the props_clean
-                props = props_clean
-                last_name = ""  # Empty for non-person entities
-
-            # Create the match result
-            matches.append(
-                MatchResult(
-                    name=display_name,
-                    surname=last_name,
-                    country=country,
-                    birth_date=birth_date,
-                    score=round(score, 2),
-                    details={
-                        "id": getattr(record, 'id', 'unknown'),
-                        "caption": getattr(record, 'caption', 'unknown'),
-                        "properties": props,
-                        "datasets": getattr(record, 'datasets', []),
-                        "referents": getattr(record, 'referents', []),
-                        "first_seen": getattr(record, 'first_seen', ''),
-                        "last_seen": getattr(record, 'last_seen', ''),
-                        "last_change": getattr(record, 'last_change', ''),
-                        "target": getattr(record, 'target', False)
-                    }
-                )
-            )
+            matches.append(build_match_result(record, score, entity_type, position in identified))
+        dataset_info = dataset.info()
 
-    # Sort matches by score (highest first) and limit to top_n
-    matches = sorted(matches, key=lambda x: x.score, reverse=True)[:top_n]
     status = "success" if matches else "no matches found"
     
     # Add timestamp
@@ -218,12 +323,19 @@ def verify_identity(
             "surname": surname,
             "entity_type": entity_type,
             "threshold": threshold,
-            "phonetic": phonetic
+            "phonetic": phonetic,
+            "identifier": identifier or None,
+            "birth_date": birth_date or None,
+            "birth_year": birth_year,
+            "country": country or None,
+            "facets": facets or None,
+            "retrieval": retrieval
         },
         "result": {
             "matches": [match.dict() for match in matches],
             "status": status
-        }
+        },
+        "dataset": dataset_info
     }
     
     # Log to database
@@ -236,7 +348,272 @@ def verify_identity(
     return VerifyIdentityResponse(
         timestamp=search_time,
         matches=matches,
-        status=status
+        status=status,
+        dataset_version=dataset_info["version"],
+        dataset_built_at=dataset_info["built_at"],
+        facets=facets_found
+    )
+
+
+@router.get("/records/{record_id}")
+def get_record(record_id: str):
+    """
+    Full OpenSanctions entry of a loaded record, read from the record store.
+    """
+    with sanction_datasets.use() as dataset:
+        position = dataset.positions.get(record_id)
+        if position is None:
+            raise HTTPException(status_code=404, detail=f"Record {record_id} not found")
+        try:
+            content = dataset.store.raw_bytes(position)
+        except DatasetChangedError as e:
+            raise dataset_changed(e)
+        return Response(content=content, media_type="application/json", headers={"X-Dataset-Version": dataset.version})
+
+
+@router.get("/screening_cache/stats")
+def screening_cache_stats():
+    """
+    Hit and miss counters of the screening result cache.
+    """
+    return JSONResponse(screening_cache.stats())
+
+
+@router.get("/token_cache/stats")
+def token_cache_stats():
+    """
+    Hit and miss counters of the token score cache of the scoring shards.
+    """
+    with sanction_datasets.use() as dataset:
+        return JSONResponse({"dataset_version": dataset.version, **dataset.screener.token_cache_stats()})
+
+
+@router.get("/admin/dataset")
+def dataset_status():
+    """
+    Version, build time and size of the active dataset generation, and reload state.
+    """
+    return JSONResponse(sanction_datasets.status())
+
+
+@router.post("/admin/reload_dataset")
+def reload_dataset():
+    """
+    Rebuild the dataset from DATASET_FILE in the background and swap it in once
+    ready; requests keep using the current generation until then.
+    """
+    started = sanction_datasets.request_reload()
+    if started:
+        logger.info("Dataset reload requested")
+    return JSONResponse(
+        {"reload_started": started, **sanction_datasets.status()},
+        status_code=202 if started else 409
+    )
+
+
+@router.post("/admin/apply_delta")
+async def apply_dataset_delta(request: Request):
+    """
+    Apply an OpenSanctions delta file (JSON lines of {"op": "ADD" | "MOD" | "DEL",
+    "entity": {...}}, optionally gzip-compressed) to the live dataset, sent as
+    the request body or as a "file" upload. The delta is recorded next to the
+    dataset file, so it survives reloads and the other workers apply it too.
+    Returns the change set.
+    """
+    if request.headers.get("content-type", "").startswith("multipart/form-data"):
+        form = await request.form()
+        upload = form.get("file")
+        if upload is None or not hasattr(upload, "filename"):
+            raise HTTPException(status_code=400, detail="Delta file must be uploaded in the 'file' field")
+        body = await upload.read()
+    else:
+        body = await request.body()
+
+    try:
+        if body[:2] == b"\x1f\x8b":
+            body = gzip.decompress(body)
+    except (OSError, EOFError) as e:
+        raise HTTPException(status_code=400, detail=f"Invalid delta: {e}")
+    try:
+        changes = await run_in_threadpool(sanction_datasets.apply_delta, body.splitlines())
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid delta: {e}")
+    except OSError as e:
+        # Not applied: a delta is only applied once it is recorded in the journal
+        logger.error(f"Could not record dataset delta: {e}")
+        raise HTTPException(status_code=503, detail=f"Could not record the delta: {e}")
+    return JSONResponse(changes.to_dict())
+
+
+@router.get("/admin/dataset/changes")
+def dataset_changes():
+    """
+    Change sets of the most recently applied deltas, oldest first.
+    """
+    return JSONResponse([changes.to_dict() for changes in sanction_datasets.changes])
+
+
+#---------------------------------------------------------------------
+
+async def read_batch_rows(request: Request) -> List[Dict[str, Any]]:
+    """
+    Read the rows of a batch screening request: a JSON array (or an object with
+    a "rows" array) or a CSV with a header row, sent as the request body or as
+    a "file" upload. Columns: name, surname, entity_type, birth_date.
+    """
+    content_type = request.headers.get("content-type", "")
+    if content_type.startswith("multipart/form-data"):
+        form = await request.form()
+        upload = form.get("file")
+        if upload is None or not hasattr(upload, "filename"):
+            raise HTTPException(status_code=400, detail="Batch file must be uploaded in the 'file' field")
+        body = await upload.read()
+        is_json = "json" in (upload.content_type or "") or (upload.filename or "").lower().endswith(".json")
+    else:
+        body = await request.body()
+        is_json = "json" in content_type
+
+    try:
+        text = body.decode("utf-8-sig")
+        if is_json:
+            rows = json.loads(text)
+            if isinstance(rows, dict):
+                rows = rows.get("rows")
+            if not isinstance(rows, list):
+                raise ValueError("expected a JSON array of rows")
+        else:
+            reader = csv.DictReader(io.StringIO(text))
+            rows = [
+                {key.strip().lower(): (value or "").strip() for key, value in row.items() if key}
+                for row in reader
+            ]
+    except (UnicodeDecodeError, ValueError, csv.Error) as e:
+        raise HTTPException(status_code=400, detail=f"Invalid batch: {e}")
+
+    if not rows:
+        raise HTTPException(status_code=400, detail="Batch contains no rows")
+    return rows
+
+
+def birth_date_agrees(query_date: Optional[str], record_date: Optional[str]) -> Optional[bool]:
+    """
+    Whether a batch row's birth date fits a match's: equal, or one is a prefix
+    of the other ("1976" fits "1976-07-10"). None when either date is unknown.
+    """
+    if not query_date or not record_date or record_date == "N/A":
+        return None
+    return query_date.startswith(record_date) or record_date.startswith(query_date)
+
+
+def stream_batch_results(rows: List[Dict[str, Any]], threshold: float, phonetic: bool, top_n: int,
+                         retrieval: str = "index"):
+    """
+    Screen a batch in chunks of BATCH_CHUNK_SIZE rows and yield one NDJSON line
+    per row, in input order. Each chunk is scored by the shards in a single
+    call and its audit entries are committed together.
+    """
+    db = SessionLocal()
+    screened_rows = 0
+    # The whole batch runs on one dataset generation, even if a reload swaps in another
+    with sanction_datasets.use() as dataset:
+        dataset_info = dataset.info()
+        try:
+            for start in range(0, len(rows), BATCH_CHUNK_SIZE):
+                lines: Dict[int, Dict[str, Any]] = {}
+                valid = []
+                for row_number, raw_row in enumerate(rows[start:start + BATCH_CHUNK_SIZE], start + 1):
+                    if not isinstance(raw_row, dict):
+                        lines[row_number] = {"row": row_number, "status": "error", "detail": "Row must be an object"}
+                        continue
+                    try:
+                        row = BatchScreeningRow(**raw_row)
+                    except ValidationError as e:
+                        lines[row_number] = {"row": row_number, "status": "error", "detail": f"Invalid row: {e}"}
+                        continue
+                    if not row.name:
+                        lines[row_number] = {"row": row_number, "status": "error", "detail": "Name is required"}
+                        continue
+                    valid.append((row_number, row))
+
+                results = dataset.screener.screen_many(
+                    [compile_query(f"{row.name} {row.surname}".strip(), threshold, phonetic, retrieval=retrieval)
+                     for _, row in valid],
+                    [row.entity_type.lower() == "person" for _, row in valid],
+                    top_n
+                )
+
+                searches = []
+                for (row_number, row), (top_matches, _, _) in zip(valid, results):
+                    matches = []
+                    try:
+                        for position, score in top_matches:
+                            match = build_match_result(dataset.store.hydrate(position), score, row.entity_type).dict()
+                            match["birth_date_match"] = birth_date_agrees(row.birth_date, match["birth_date"])
+                            matches.append(match)
+                    except DatasetChangedError as e:
+                        lines[row_number] = {"row": row_number, "status": "error", "detail": dataset_changed(e).detail}
+                        continue
+
+                    search = {
+                        "timestamp": datetime.now(timezone.utc).isoformat(),
+                        "query": {
+                            "name": row.name,
+                            "surname": row.surname,
+                            "entity_type": row.entity_type,
+                            "birth_date": row.birth_date or None,
+                            "threshold": threshold,
+                            "phonetic": phonetic,
+                            "retrieval": retrieval
+                        },
+                        "result": {
+                            "matches": matches,
+                            "status": "success" if matches else "no matches found"
+                        },
+                        "dataset": dataset_info
+                    }
+                    searches.append(search)
+                    lines[row_number] = {"row": row_number, **search}
+                screened_rows += len(valid)
+
+                # One audit commit per chunk, before its results are released
+                if searches:
+                    try:
+                        log_search_bulk(db, searches)
+                    except Exception as e:
+                        logger.error(f"Error logging batch searches: {e}")
+
+                for row_number in sorted(lines):
+                    yield json.dumps(lines[row_number], ensure_ascii=False) + "\n"
+        finally:
+            db.close()
+            logger.info(f"Batch screening completed: screened {screened_rows} of {len(rows)} rows")
+
+
+@router.post("/verify_identity_batch")
+async def verify_identity_batch(
+    request: Request,
+    threshold: float = Query(80.0),
+    phonetic: bool = Query(False),
+    top_n: int = Query(5),
+    retrieval: str = Query("index")
+):
+    """
+    Screen a CSV or JSON list of names (name, surname, entity_type, optional
+    birth_date) and stream the results as NDJSON, one line per row.
+    `retrieval` is as for verify_identity.
+    """
+    if threshold < 0 or threshold > 100:
+        raise HTTPException(status_code=400, detail="Threshold must be between 0 and 100")
+    if retrieval not in RETRIEVAL_MODES:
+        raise HTTPException(status_code=400, detail=f"Retrieval must be one of {', '.join(RETRIEVAL_MODES)}")
+
+    rows = await read_batch_rows(request)
+    logger.info(f"Processing verify_identity_batch request: {len(rows)} rows, threshold={threshold}, "
+                f"phonetic={phonetic}, retrieval={retrieval}")
+
+    return StreamingResponse(
+        stream_batch_results(rows, threshold, phonetic, top_n, retrieval),
+        media_type="application/x-ndjson"
     )
 
 
@@ -0,0 +1,87 @@
+
+
+
+# screening_cache.py
+
+import os
+import time
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional
+
+logger = logging.getLogger("ComplianceService")
+
+# Screening results kept in memory, and how long each stays valid (seconds)
+SCREENING_CACHE_SIZE = int(os.getenv("SCREENING_CACHE_SIZE", "1024"))
+SCREENING_CACHE_TTL = float(os.getenv("SCREENING_CACHE_TTL", "900"))
+
+class ScreeningCache:
+    """
+    Bounded LRU cache with a TTL for the results of the matching stage.
+
+    Entries are keyed by dataset version as well as query, so a reloaded
+    dataset never serves stale results. Requests still running on a replaced
+    generation keep reading and storing under its version, which neither
+    disturbs the new version's entries nor passes for them; those entries age
+    out like any other. Safe to share between request threads.
+    """
+
+    def __init__(self, maxsize: int = SCREENING_CACHE_SIZE, ttl: float = SCREENING_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evictions = 0
+
+    def get(self, version: str, key: Hashable) -> Optional[Any]:
+        """Cached value for `key` under the dataset `version`, or None."""
+        key = (version, key)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] < time.monotonic():
+                del self.entries[key]
+                self.expired += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, version: str, key: Hashable, value: Any) -> None:
+        """Store `value` for `key` under the dataset `version`, evicting the least recently used entry."""
+        if self.maxsize <= 0:
+            return
+        key = (version, key)
+        with self.lock:
+            self.entries[key] = (time.monotonic() + self.ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self) -> None:
+        """Drop every cached result."""
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit and miss counters and current size."""
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "dataset_versions": len({version for version, _ in self.entries}),
+                "size": len(self.entries),
+                "maxsize": self.maxsize,
+                "ttl_seconds": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "expired": self.expired,
+                "evictions": self.evictions,
+            }
@@ -0,0 +1,762 @@
+
+
+# search_index.py
+
+import os
+import copy
+import math
+import zlib
+import logging
+from abc import ABC, abstractmethod
+from collections import Counter
+from functools import reduce
+from array import array
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+import numpy as np
+
+from phonetic_cache import PhoneticIndex
+
+logger = logging.getLogger("ComplianceService")
+
+# Gram size of the candidate index. fuzz.ratio only guarantees shared grams when
+# LCS - (size - 1) * (edits + 1) > 0, which trigrams never satisfy at the default
+# threshold of 80 for name-length strings; bigrams still prune there.
+NGRAM_SIZE = 2
+
+# fuzz.ratio of two different strings is at most 100 - 100 / (a + b), so below
+# this combined length a score that rounds to 100 comes from equal strings only
+EXACT_SCORE_LENGTH = 20000
+
+# Edits and variant length covered by the deletion index (see DeletionIndex).
+# Longer or more distant variants are read from their whole length bucket.
+SYMSPELL_MAX_EDITS = int(os.getenv("SYMSPELL_MAX_EDITS", "2"))
+SYMSPELL_MAX_LENGTH = int(os.getenv("SYMSPELL_MAX_LENGTH", "8"))
+
+# Most deletion strings generated from one query variant for a lookup
+SYMSPELL_MAX_QUERY_KEYS = int(os.getenv("SYMSPELL_MAX_QUERY_KEYS", "1000"))
+
+# Gram size of the TF-IDF retrieval index, taken within space-padded tokens
+TFIDF_NGRAM_SIZE = 3
+
+def ratio_length_bounds(length: int, min_score: float) -> Tuple[int, int]:
+    """
+    Range of string lengths that can reach `min_score` with fuzz.ratio against a
+    string of `length` characters. fuzz.ratio is at most 200 * min(a, b) / (a + b).
+    """
+    if min_score <= 0:
+        return 0, math.inf
+    min_score = min(min_score, 100.0) - 1e-6  # stay on the safe side of float rounding
+    return math.ceil(length * min_score / (200 - min_score)), math.floor(length * (200 - min_score) / min_score)
+
+def min_shared_ngrams(query_length: int, record_length: int, min_score: float, size: int = NGRAM_SIZE) -> int:
+    """
+    Lower bound on the n-grams two strings of these lengths share when their
+    fuzz.ratio reaches `min_score`. A value <= 0 means no bound can be given.
+
+    fuzz.ratio = 200 * LCS / (a + b). The LCS alignment splits into at most
+    edits + 1 blocks, and every block of s characters keeps s - size + 1 grams.
+    """
+    lcs = required_lcs(query_length, record_length, min_score)
+    edits = query_length + record_length - 2 * lcs
+    return lcs - (size - 1) * (edits + 1)
+
+def required_lcs(query_length: int, record_length: int, min_score: float) -> int:
+    """Length of the longest common subsequence two strings of these lengths need to reach `min_score`."""
+    min_score = min(min_score, 100.0) - 1e-6
+    return math.ceil(min_score * (query_length + record_length) / 200)
+
+def deletions(text: str, count: int) -> List[Set[str]]:
+    """Distinct strings left after deleting 0, 1, ... `count` characters of `text`."""
+    levels = [{text}]
+    for _ in range(min(count, len(text))):
+        levels.append({s[:i] + s[i + 1:] for s in levels[-1] for i in range(len(s))})
+    return levels
+
+def deletion_hash(text: str, length: int) -> int:
+    """Key of a deletion string of a `length`-character variant; stable across processes, unlike hash()."""
+    return zlib.crc32(f"{length} {text}".encode())
+
+def spans(starts: np.ndarray, ends: np.ndarray) -> np.ndarray:
+    """Concatenated index ranges [starts[i], ends[i])."""
+    counts = ends - starts
+    keep = counts > 0
+    starts, counts = starts[keep], counts[keep]
+    if not len(counts):
+        return np.zeros(0, dtype=np.int64)
+    return np.repeat(starts - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())
+
+def ngram_keys(text: str, size: int = NGRAM_SIZE) -> List[str]:
+    """
+    Character n-grams of a string, with repeated grams numbered so that the
+    multiset overlap of two strings is the size of the intersection of their keys.
+    """
+    seen: Dict[str, int] = {}
+    keys = []
+    for i in range(len(text) - size + 1):
+        gram = text[i:i + size]
+        count = seen.get(gram, 0) + 1
+        seen[gram] = count
+        keys.append(gram if count == 1 else f"{gram}{count}")
+    return keys
+
+def record_variants(record) -> List[str]:
+    """Distinct strings the matcher compares a query against for this record."""
+    view = record.match_view
+    if view is None:
+        return []
+    variants = [view.full_name, view.reversed_name, view.name, view.surname,
+                *view.aliases, *view.reversed_aliases, *view.entity_names]
+    return list(dict.fromkeys(v for v in variants if v))
+
+def tfidf_grams(text: str) -> List[str]:
+    """
+    Character n-grams of every token of `text` padded with a space on both
+    sides, as often as they occur, so that word order does not matter.
+    """
+    grams = []
+    for token in text.split():
+        padded = f" {token} "
+        grams.extend(padded[i:i + TFIDF_NGRAM_SIZE] for i in range(max(1, len(padded) - TFIDF_NGRAM_SIZE + 1)))
+    return grams
+
+def tfidf_texts(record) -> List[str]:
+    """Names and aliases of the record embedded in the TF-IDF index."""
+    view = record.match_view
+    if view is None:
+        return []
+    return list(dict.fromkeys(t for t in [view.full_name, *view.aliases] if t))
+
+def exact_keys(record) -> List[str]:
+    """
+    Strings of the record that score 100 against an equal query: full name,
+    reversed name, aliases and reversed aliases, the first name / surname
+    pair of a person, which the part matching compares with query token splits,
+    and the entity name forms of other records, compared with the query's.
+    """
+    view = record.match_view
+    if view is None:
+        return []
+    keys = [view.full_name, view.reversed_name, *view.aliases, *view.reversed_aliases]
+    if view.name and view.surname:
+        keys.append(pair_key(view.name, view.surname))
+    keys.extend(entity_form_key(name) for name in view.entity_names)
+    return list(dict.fromkeys(k for k in keys if k))
+
+def pair_key(name: str, surname: str) -> str:
+    """Key of a first name / surname pair; normalized text never contains the separator."""
+    return f"{name}|{surname}"
+
+def entity_form_key(name: str) -> str:
+    """Key of an entity name form (data_ingestion.entity_name_form), apart from the plain names."""
+    return f"~{name}"
+
+# Key of the records without a value in an attribute index; blocking never excludes them
+UNKNOWN = ""
+
+# Lengths of the year, year-month and full date prefixes of an ISO date
+DATE_PREFIXES = (4, 7, 10)
+
+def birth_date_keys(dates: Sequence[str]) -> List[str]:
+    """
+    Keys of a record's birth dates in the BirthDateIndex: every year, month and
+    day prefix of each date, and each date as listed, marked with "=".
+    """
+    if not dates:
+        return [UNKNOWN]
+    keys = []
+    for date in dates:
+        keys.extend(date[:length] for length in DATE_PREFIXES if len(date) >= length)
+        keys.append(f"={date}")
+    return list(dict.fromkeys(keys))
+
+def without(table: Dict, keys: Iterable, dropped: np.ndarray) -> None:
+    """Replace the `table` arrays at `keys` by copies without the `dropped` values; empty ones are removed."""
+    for key in keys:
+        values = table.get(key)
+        if values is None:
+            continue
+        kept = np.frombuffer(values, dtype=np.uint32)
+        kept = kept[~np.isin(kept, dropped)]
+        if len(kept):
+            table[key] = array("I", kept.tobytes())
+        else:
+            del table[key]
+
+def unshared(table: Dict, keys: Iterable) -> None:
+    """Replace the `table` arrays at `keys` by copies, so appending to them leaves the originals unchanged."""
+    for key in keys:
+        if key in table:
+            table[key] = array("I", table[key].tobytes())
+
+def frozen(table: Dict) -> Dict:
+    """The arrays of `table` as numpy arrays, which pickle out of band (see mapped_pickle)."""
+    return {key: np.frombuffer(values, dtype=np.uint32) for key, values in table.items()}
+
+class DeletionIndex:
+    """
+    Symmetric deletion index (as in SymSpell) over the short name variants of
+    an NgramIndex. Every variant of up to `max_length` characters is stored
+    under the strings left by deleting up to `max_edits` of its characters.
+    Two strings have a common subsequence of length L exactly when deleting
+    down to L characters gives a common string, so looking up the deletions
+    of a query finds exactly the variants reaching a fuzz.ratio threshold,
+    including those too short for n-gram counts to prune at all.
+
+    Distinct strings are indexed once. Their deletion keys are sorted crc32
+    hashes, so the arrays map from a snapshot; a hash collision only adds a
+    candidate that scoring then rejects.
+    """
+
+    def __init__(self, max_edits: int = SYMSPELL_MAX_EDITS, max_length: int = SYMSPELL_MAX_LENGTH):
+        self.max_edits = max_edits
+        self.max_length = max_length
+        self.strings: Dict[str, int] = {}
+        # String id of every indexed variant id
+        self.variant_ids = array("I")
+        self.string_ids = array("I")
+        # Deletion keys of the strings added since the last seal()
+        self.pending_hashes = array("I")
+        self.pending_strings = array("I")
+        # Sealed lookup arrays: hash -> string id, and string id -> variant ids (CSR)
+        self.hashes = np.zeros(0, dtype=np.uint32)
+        self.hash_strings = np.zeros(0, dtype=np.uint32)
+        self.offsets = np.zeros(1, dtype=np.int64)
+        self.variants = np.zeros(0, dtype=np.uint32)
+        self.sealed = True
+
+    def add(self, text: str, variant_id: int) -> None:
+        """Index a variant of at most max_length characters; lookups see it after seal()."""
+        string_id = self.strings.get(text)
+        if string_id is None:
+            string_id = self.strings[text] = len(self.strings)
+            for level in deletions(text, self.max_edits):
+                for deleted in level:
+                    self.pending_hashes.append(deletion_hash(deleted, len(text)))
+                    self.pending_strings.append(string_id)
+        self.variant_ids.append(variant_id)
+        self.string_ids.append(string_id)
+        self.sealed = False
+
+    def seal(self) -> None:
+        """Sort the keys added since the last call into the lookup arrays."""
+        if self.pending_hashes:
+            hashes = np.concatenate([self.hashes, np.frombuffer(self.pending_hashes, dtype=np.uint32)])
+            strings = np.concatenate([self.hash_strings, np.frombuffer(self.pending_strings, dtype=np.uint32)])
+            order = np.argsort(hashes, kind="stable")
+            self.hashes, self.hash_strings = hashes[order], strings[order]
+            self.pending_hashes, self.pending_strings = array("I"), array("I")
+        string_ids = np.frombuffer(self.string_ids, dtype=np.uint32)
+        self.variants = np.frombuffer(self.variant_ids, dtype=np.uint32)[np.argsort(string_ids, kind="stable")]
+        self.offsets = np.zeros(len(self.strings) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(string_ids, minlength=len(self.strings)), out=self.offsets[1:])
+        self.sealed = True
+
+    def updated(self, dropped: np.ndarray) -> "DeletionIndex":
+        """Copy of the index without the `dropped` variant ids; seal() it after adding variants."""
+        other = copy.copy(self)
+        other.strings = dict(self.strings)
+        variant_ids = np.frombuffer(self.variant_ids, dtype=np.uint32)
+        kept = ~np.isin(variant_ids, dropped)
+        other.variant_ids = array("I", variant_ids[kept].tobytes())
+        other.string_ids = array("I", np.frombuffer(self.string_ids, dtype=np.uint32)[kept].tobytes())
+        other.pending_hashes, other.pending_strings = array("I"), array("I")
+        other.sealed = False
+        return other
+
+    def freeze(self) -> None:
+        self.variant_ids = np.frombuffer(self.variant_ids, dtype=np.uint32)
+        self.string_ids = np.frombuffer(self.string_ids, dtype=np.uint32)
+
+    def covers(self, record_length: int, edits: int) -> bool:
+        """Whether the variants of `record_length` characters are indexed down to `edits` deletions."""
+        return self.sealed and record_length <= self.max_length and edits <= self.max_edits
+
+    def lookup(self, text: str, edits: int, record_lengths: Sequence[int]) -> np.ndarray:
+        """
+        Ids of the variants of `record_lengths` characters (each covered with
+        record_length - len(text) + edits deletions) sharing a subsequence of
+        len(text) - edits characters with `text`.
+        """
+        subsequences = deletions(text, edits)[-1] if edits <= len(text) else set()
+        hashes = np.array([deletion_hash(s, length) for length in record_lengths for s in subsequences], dtype=np.uint32)
+        found = spans(np.searchsorted(self.hashes, hashes, "left"), np.searchsorted(self.hashes, hashes, "right"))
+        strings = np.unique(self.hash_strings[found])
+        return self.variants[spans(self.offsets[strings], self.offsets[strings + 1])]
+
+class NgramIndex:
+    """
+    Inverted index from character n-grams to the name variants (full names,
+    reversed names, name parts, aliases) of the loaded records. It returns the
+    records that can still reach a fuzz.ratio threshold, so only those are scored.
+
+    Postings are bucketed by variant length: a query only reads the buckets
+    whose lengths can reach its threshold, and never counts grams elsewhere.
+    Short variants come from the deletion index instead, which returns only
+    those within reach, even where strings are too short for a shared gram.
+    """
+
+    def __init__(self, size: int = NGRAM_SIZE):
+        self.size = size
+        self.postings: Dict[Tuple[str, int], array] = {}
+        self.by_length: Dict[int, array] = {}
+        self.variant_records = array("I")
+        self.max_length = 0
+        self.deletions = DeletionIndex()
+
+    def add(self, text: str, position: int) -> None:
+        """Index one name variant of the record at `position` in the dataset."""
+        variant_id = len(self.variant_records)
+        length = len(text)
+        self.variant_records.append(position)
+        self.max_length = max(self.max_length, length)
+        self.by_length.setdefault(length, array("I")).append(variant_id)
+        for key in ngram_keys(text, self.size):
+            self.postings.setdefault((key, length), array("I")).append(variant_id)
+        if length <= self.deletions.max_length:
+            self.deletions.add(text, variant_id)
+
+    def add_record(self, record, position: int) -> None:
+        """Index every string the matcher compares a query against for this record."""
+        for text in record_variants(record):
+            self.add(text, position)
+
+    def updated(self, removed: Sequence[Tuple[object, int]], added: Sequence[Tuple[object, int]]) -> "NgramIndex":
+        """
+        Copy of the index without the variants of the `removed` (record, position)
+        pairs and with those of `added`. Only the postings of these records are
+        rewritten; the others are shared with this index, which stays unchanged.
+        """
+        other = copy.copy(self)
+        other.postings = dict(self.postings)
+        other.by_length = dict(self.by_length)
+        other.variant_records = array("I", self.variant_records.tobytes())
+
+        dropped = np.zeros(0, dtype=np.uint32)
+        if removed:
+            records = np.frombuffer(other.variant_records, dtype=np.uint32)
+            dropped = np.flatnonzero(np.isin(records, [position for _, position in removed])).astype(np.uint32)
+            del records  # the array grows below; a live buffer view would block that
+            texts = [text for record, _ in removed for text in record_variants(record)]
+            without(other.postings, {(key, len(text)) for text in texts for key in ngram_keys(text, self.size)}, dropped)
+            without(other.by_length, {len(text) for text in texts}, dropped)
+        other.deletions = self.deletions.updated(dropped)
+
+        texts = [text for record, _ in added for text in record_variants(record)]
+        unshared(other.postings, {(key, len(text)) for text in texts for key in ngram_keys(text, self.size)})
+        unshared(other.by_length, {len(text) for text in texts})
+        for record, position in added:
+            other.add_record(record, position)
+        other.deletions.seal()
+        return other
+
+    def seal(self) -> None:
+        """Make the variants added so far visible to deletion index lookups; call after adding records."""
+        self.deletions.seal()
+
+    def freeze(self) -> None:
+        """Turn the posting arrays into numpy arrays, for a memory-mapped snapshot. Call updated() to change it after."""
+        self.postings = frozen(self.postings)
+        self.by_length = frozen(self.by_length)
+        self.variant_records = np.frombuffer(self.variant_records, dtype=np.uint32)
+        self.deletions.freeze()
+
+    def candidates(self, query, min_score: Optional[float] = None) -> Optional[np.ndarray]:
+        """
+        Sorted positions of the records that have a variant within reach of the
+        compiled query's threshold, or None when the threshold cannot prune anything.
+        `min_score` overrides the fuzz.ratio the query needs (query.min_text_score).
+        """
+        if min_score is None:
+            min_score = query.min_text_score
+        if min_score <= 0:
+            return None
+
+        variant_ids = [self._variant_candidates(text, min_score) for text in query.variants()]
+        variant_ids = np.concatenate(variant_ids) if variant_ids else np.zeros(0, dtype=np.uint32)
+        records = np.frombuffer(self.variant_records, dtype=np.uint32)
+        return np.unique(records[variant_ids]).astype(np.int64)
+
+    def _variant_candidates(self, text: str, min_score: float) -> np.ndarray:
+        """Variant ids whose fuzz.ratio with `text` can reach `min_score`."""
+        length = len(text)
+        min_length, max_length = ratio_length_bounds(length, min_score)
+        keys = ngram_keys(text, self.size)
+        found = []
+        # Record lengths looked up in the deletion index, by common subsequence length
+        by_lcs: Dict[int, List[int]] = {}
+
+        for record_length in range(min_length, min(max_length, self.max_length) + 1):
+            lcs = required_lcs(length, record_length, min_score)
+            if (lcs > 0 and self.deletions.covers(record_length, record_length - lcs)
+                    and math.comb(length, lcs) <= SYMSPELL_MAX_QUERY_KEYS):
+                by_lcs.setdefault(lcs, []).append(record_length)
+                continue
+            needed = min_shared_ngrams(length, record_length, min_score, self.size)
+            if needed <= 0:
+                # Too short for a guaranteed shared gram: the bucket is taken whole
+                bucket = self.by_length.get(record_length)
+                if bucket is not None and len(bucket):
+                    found.append(np.frombuffer(bucket, dtype=np.uint32))
+                continue
+
+            postings = [self.postings[k] for k in ((key, record_length) for key in keys) if k in self.postings]
+            if len(postings) < needed:
+                continue
+            ids = np.concatenate([np.frombuffer(p, dtype=np.uint32) for p in postings])
+            if needed > 1:
+                # A variant appears once in the posting of each gram it shares
+                ids, counts = np.unique(ids, return_counts=True)
+                ids = ids[counts >= needed]
+            found.append(ids)
+
+        for lcs, record_lengths in by_lcs.items():
+            found.append(self.deletions.lookup(text, length - lcs, record_lengths))
+        return np.concatenate(found) if found else np.zeros(0, dtype=np.uint32)
+
+class TfidfIndex:
+    """
+    Sparse TF-IDF matrix of the character n-grams (see tfidf_grams) of the
+    names and aliases of the records, stored by column: the postings of a gram
+    list a name once per occurrence, and every name keeps its vector norm.
+    A query is one sparse product with the matrix, ranking the records by
+    the cosine similarity of their closest name. Grams of common words such
+    as "trading" or "international" occur in many names and weigh little,
+    so sharing them alone hardly brings a name closer.
+
+    The weights only choose which records are scored (retrieval "tfidf");
+    the scores themselves are match_record's and do not use them.
+
+    The idf weights are fixed by fit(); names added later by deltas are
+    weighted with them, new grams counting as seen once.
+    """
+
+    def __init__(self):
+        self.postings: Dict[str, array] = {}
+        self.idf: Dict[str, float] = {}
+        self.default_idf = 1.0
+        self.norms = array("f")
+        self.variant_records = array("I")
+
+    def fit(self, records: Sequence) -> None:
+        """Set the idf weights from the names and aliases of `records`; call before adding any."""
+        frequencies: Counter = Counter()
+        count = 0
+        for record in records:
+            for text in tfidf_texts(record):
+                frequencies.update(set(tfidf_grams(text)))
+                count += 1
+        self.idf = {gram: math.log((1 + count) / (1 + frequency)) + 1 for gram, frequency in frequencies.items()}
+        self.default_idf = math.log((1 + count) / 2) + 1
+
+    def weights(self, text: str) -> Dict[str, float]:
+        """TF-IDF weight of every gram of `text`."""
+        return {gram: tf * self.idf.get(gram, self.default_idf) for gram, tf in Counter(tfidf_grams(text)).items()}
+
+    def add_record(self, record, position: int) -> None:
+        for text in tfidf_texts(record):
+            variant_id = len(self.variant_records)
+            self.variant_records.append(position)
+            self.norms.append(math.sqrt(sum(weight * weight for weight in self.weights(text).values())))
+            for gram in tfidf_grams(text):
+                self.postings.setdefault(gram, array("I")).append(variant_id)
+
+    def updated(self, removed: Sequence[Tuple[object, int]], added: Sequence[Tuple[object, int]]) -> "TfidfIndex":
+        """Copy of the index without the names of the `removed` and with those of the `added` (record, position) pairs."""
+        other = copy.copy(self)
+        other.postings = dict(self.postings)
+        other.norms = array("f", self.norms.tobytes())
+        other.variant_records = array("I", self.variant_records.tobytes())
+
+        if removed:
+            records = np.frombuffer(other.variant_records, dtype=np.uint32)
+            dropped = np.flatnonzero(np.isin(records, [position for _, position in removed])).astype(np.uint32)
+            del records  # the array grows below; a live buffer view would block that
+            without(other.postings, {gram for record, _ in removed for text in tfidf_texts(record)
+                                     for gram in tfidf_grams(text)}, dropped)
+
+        unshared(other.postings, {gram for record, _ in added for text in tfidf_texts(record) for gram in tfidf_grams(text)})
+        for record, position in added:
+            other.add_record(record, position)
+        return other
+
+    def freeze(self) -> None:
+        self.postings = frozen(self.postings)
+        self.norms = np.frombuffer(self.norms, dtype=np.float32)
+        self.variant_records = np.frombuffer(self.variant_records, dtype=np.uint32)
+
+    def nearest(self, query, limit: int, keep: Callable[[np.ndarray], np.ndarray]) -> np.ndarray:
+        """
+        Positions of the `limit` records closest to the compiled query, by
+        descending cosine similarity of their closest name, among those with a
+        name sharing a gram with it. `keep` filters an array of positions.
+        """
+        weights = self.weights(query.text)
+        grams = [gram for gram in weights if gram in self.postings]
+        if not grams or limit <= 0:
+            return np.zeros(0, dtype=np.int64)
+        postings = [np.frombuffer(self.postings[gram], dtype=np.uint32) for gram in grams]
+        # A posting lists a name once per occurrence of the gram, so summing
+        # query weight * idf over the postings gives the dot product
+        products = np.bincount(np.concatenate(postings),
+                               np.repeat([weights[gram] * self.idf.get(gram, self.default_idf) for gram in grams],
+                                         [len(p) for p in postings]))
+        variant_ids = np.flatnonzero(products)
+        similarities = products[variant_ids] / np.frombuffer(self.norms, dtype=np.float32)[variant_ids]
+        variant_records = np.frombuffer(self.variant_records, dtype=np.uint32)
+
+        # Only the closest names are sorted; more are taken while too few of
+        # their records pass `keep`
+        count = 4 * limit
+        while True:
+            if count < len(similarities):
+                closest = np.argpartition(-similarities, count)[:count]
+            else:
+                closest = np.arange(len(similarities))
+            closest = closest[np.argsort(-similarities[closest], kind="stable")]
+            records = variant_records[variant_ids[closest]]
+            _, first = np.unique(records, return_index=True)
+            records = keep(records[np.sort(first)].astype(np.int64))
+            if len(records) >= limit or count >= len(similarities):
+                return records[:limit]
+            count *= 4
+
+class KeyIndex(ABC):
+    """
+    Hash index from string keys of the records (given by record_keys) to
+    their positions, answering exact lookups in constant time.
+    """
+
+    def __init__(self):
+        self.keys: Dict[str, array] = {}
+
+    @abstractmethod
+    def record_keys(self, record) -> Sequence[str]:
+        """Keys under which `record` is indexed."""
+
+    def add_record(self, record, position: int) -> None:
+        for key in self.record_keys(record):
+            self.keys.setdefault(key, array("I")).append(position)
+
+    def updated(self, removed: Sequence[Tuple[object, int]], added: Sequence[Tuple[object, int]]) -> "KeyIndex":
+        """Copy of the index without the `removed` and with the `added` (record, position) pairs."""
+        other = copy.copy(self)
+        other.keys = dict(self.keys)
+        if removed:
+            dropped = np.array([position for _, position in removed], dtype=np.uint32)
+            without(other.keys, {key for record, _ in removed for key in self.record_keys(record)}, dropped)
+        unshared(other.keys, {key for record, _ in added for key in self.record_keys(record)})
+        for record, position in added:
+            other.add_record(record, position)
+        return other
+
+    def positions(self, keys: Iterable[str]) -> np.ndarray:
+        """Sorted positions of the records with at least one of `keys`."""
+        postings = [np.frombuffer(self.keys[key], dtype=np.uint32) for key in keys if key in self.keys]
+        if not postings:
+            return np.zeros(0, dtype=np.int64)
+        return np.unique(np.concatenate(postings)).astype(np.int64)
+
+    def mask(self, keys: Iterable[str], count: int) -> np.ndarray:
+        """Flags of the `count` records, set for those with at least one of `keys`; nothing is sorted."""
+        flags = np.zeros(count, dtype=bool)
+        for key in keys:
+            if key in self.keys:
+                flags[np.frombuffer(self.keys[key], dtype=np.uint32)] = True
+        return flags
+
+class ExactIndex(KeyIndex):
+    """
+    Index of the exact strings of the records (see exact_keys). A comparison
+    only scores 100 between equal strings, so the records it returns for a
+    query are exactly those whose score is 100.
+    """
+
+    def record_keys(self, record) -> List[str]:
+        return exact_keys(record)
+
+    def lookup(self, query) -> np.ndarray:
+        """
+        Sorted positions of the records a compiled query scores 100 against: the
+        whole query equal to one of their names or aliases, a split of its
+        tokens equal to their first name and surname, as match_name_parts tries
+        it, or its entity name form equal to one of theirs.
+        """
+        keys = [query.text, entity_form_key(query.entity_name)]
+        if len(query.tokens) >= 2:
+            keys.append(pair_key(query.tokens[0], query.rest))
+            keys.extend(pair_key(other, token) for token, other in zip(query.tokens, query.others))
+        return self.positions(keys)
+
+class IdentifierIndex(KeyIndex):
+    """Index of the normalized passport, ID, registration and other numbers of the records."""
+
+    def record_keys(self, record) -> Sequence[str]:
+        return getattr(record, "identifiers", ())
+
+    def lookup(self, identifier: str) -> np.ndarray:
+        """Sorted positions of the records carrying an identifier, normalized with data_ingestion.normalize_identifier."""
+        return self.positions([identifier])
+
+class BirthDateIndex(KeyIndex):
+    """Index of the birth dates of the records (see birth_date_keys), for blocking by date or year of birth."""
+
+    def record_keys(self, record) -> List[str]:
+        return birth_date_keys(getattr(record, "birth_dates", ()))
+
+    def agreeing(self, date: str, count: int) -> np.ndarray:
+        """
+        Flags of the records with a birth date that fits `date` (one is a
+        prefix of the other, "1976" fits "1976-07-10") or with none.
+        """
+        keys = [date, f"={date}", UNKNOWN]
+        keys.extend(f"={date[:length]}" for length in DATE_PREFIXES if len(date) > length)
+        return self.mask(keys, count)
+
+    def born_in(self, years: Iterable[str], count: int) -> np.ndarray:
+        """Flags of the records born in one of `years`, or without a birth date."""
+        return self.mask([*years, UNKNOWN], count)
+
+class CountryIndex(KeyIndex):
+    """Index of the country codes of the records, for blocking by country."""
+
+    def record_keys(self, record) -> List[str]:
+        return [country.lower() for country in getattr(record, "countries", ())] or [UNKNOWN]
+
+    def linked(self, country: str, count: int) -> np.ndarray:
+        """Flags of the records linked to a country code, or to none."""
+        return self.mask([country.lower(), UNKNOWN], count)
+
+# Record attributes the FacetIndex filters on
+FACETS = ("datasets", "topics", "countries")
+
+class FacetIndex(KeyIndex):
+    """
+    Index of the datasets, topics and countries of the records, keyed
+    "facet:value", for filtering screenings to (or away from) given lists.
+    """
+
+    def record_keys(self, record) -> List[str]:
+        return [f"{facet}:{value.lower()}" for facet in FACETS for value in getattr(record, facet, ())]
+
+    def selected(self, facets: Dict[str, Sequence[str]], count: int) -> np.ndarray:
+        """
+        Flags of the records carrying, for every facet in `facets`, at least one
+        of its values; a value starting with "-" excludes the records carrying it.
+        """
+        flags = np.ones(count, dtype=bool)
+        for facet, values in facets.items():
+            included = [f"{facet}:{v}" for v in values if not v.startswith("-")]
+            excluded = [f"{facet}:{v[1:]}" for v in values if v.startswith("-")]
+            if included:
+                flags &= self.mask(included, count)
+            if excluded:
+                flags &= ~self.mask(excluded, count)
+        return flags
+
+    def counts(self, flags: np.ndarray) -> Dict[str, Dict[str, int]]:
+        """Number of the flagged records carrying each value of each facet; values none of them carries are left out."""
+        counts: Dict[str, Dict[str, int]] = {facet: {} for facet in FACETS}
+        if not flags.any():
+            return counts
+        for key, postings in self.keys.items():
+            found = int(np.count_nonzero(flags[np.frombuffer(postings, dtype=np.uint32)]))
+            if found:
+                facet, value = key.split(":", 1)
+                counts[facet][value] = found
+        return counts
+
+class SanctionIndex:
+    """
+    All candidate indexes of a loaded dataset. Text queries are pruned through
+    the n-gram index; phonetic queries add every record sharing a phonetic key.
+    The TF-IDF index ranks records for approximate top-k retrieval.
+    Exact hits on a name or alias and on an identifier are found through hash
+    indexes, and birth dates, countries and facet filters block out records
+    before scoring.
+    """
+
+    def __init__(self):
+        self.ngrams = NgramIndex()
+        self.phonetic = PhoneticIndex()
+        self.exact = ExactIndex()
+        self.identifiers = IdentifierIndex()
+        self.birth_dates = BirthDateIndex()
+        self.countries = CountryIndex()
+        self.facets = FacetIndex()
+        self.tfidf = TfidfIndex()
+
+    def key_indexes(self) -> List[KeyIndex]:
+        return [self.exact, self.identifiers, self.birth_dates, self.countries, self.facets]
+
+    def add_record(self, record, position: int) -> None:
+        self.ngrams.add_record(record, position)
+        self.phonetic.add_record(record, position)
+        self.tfidf.add_record(record, position)
+        for index in self.key_indexes():
+            index.add_record(record, position)
+
+    def updated(self, removed: Sequence[Tuple[object, int]], added: Sequence[Tuple[object, int]]) -> "SanctionIndex":
+        """Copy of the indexes without the `removed` and with the `added` (record, position) pairs."""
+        other = copy.copy(self)
+        other.ngrams = self.ngrams.updated(removed, added)
+        other.phonetic = self.phonetic.updated(removed, added)
+        other.exact = self.exact.updated(removed, added)
+        other.identifiers = self.identifiers.updated(removed, added)
+        other.birth_dates = self.birth_dates.updated(removed, added)
+        other.countries = self.countries.updated(removed, added)
+        other.facets = self.facets.updated(removed, added)
+        other.tfidf = self.tfidf.updated(removed, added)
+        return other
+
+    def freeze(self) -> None:
+        """Numpy postings for a memory-mapped snapshot; see NgramIndex.freeze."""
+        self.ngrams.freeze()
+        self.phonetic.codes = frozen(self.phonetic.codes)
+        self.tfidf.freeze()
+        for index in self.key_indexes():
+            index.keys = frozen(index.keys)
+
+    def exact_matches(self, query) -> Optional[np.ndarray]:
+        """
+        Sorted positions of the records scoring 100 against the compiled query,
+        or None when names are too long to tell a 100 from a score rounded up to it.
+        """
+        if not query.text or len(query.text) + self.ngrams.max_length >= EXACT_SCORE_LENGTH:
+            return None
+        return self.exact.lookup(query)
+
+    def allowed(self, query, count: int) -> Optional[np.ndarray]:
+        """
+        Flags of the `count` records, set for those that fit the birth date,
+        birth years and country of the compiled query (or lack that attribute)
+        and its facet filters, or None when it sets none of them.
+        """
+        blocks = []
+        if query.facets:
+            blocks.append(self.facets.selected(query.facets, count))
+        if query.birth_date:
+            blocks.append(self.birth_dates.agreeing(query.birth_date, count))
+        if query.birth_years:
+            blocks.append(self.birth_dates.born_in(query.birth_years, count))
+        if query.country:
+            blocks.append(self.countries.linked(query.country, count))
+        if not blocks:
+            return None
+        return reduce(np.logical_and, blocks)
+
+    def candidates(self, query) -> Optional[np.ndarray]:
+        """
+        Sorted positions of the records that can reach the compiled query's threshold,
+        or None when every record has to be scored.
+        """
+        if not query.use_phonetic:
+            return self.ngrams.candidates(query)
+        if query.threshold <= 0:
+            return None
+
+        # Without key agreement a comparison scores 0.6 * ratio (or the bare
+        # ratio when a key is empty), so it needs a ratio of at least the
+        # threshold; comparisons with key agreement come from the phonetic index.
+        positions = self.ngrams.candidates(query, min_score=query.threshold)
+        return np.union1d(positions, self.phonetic.lookup(query.phonetic_keys()))
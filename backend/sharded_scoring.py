@@ -0,0 +1,422 @@
+
+
+# sharded_scoring.py
+
+import os
+import copy
+import heapq
+import logging
+import itertools
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, List, Optional, Sequence, Set, Tuple
+
+import numpy as np
+
+from batch_scoring import ScoringEngine, SCORING_WORKERS, CUTOFF_MARGIN
+from data_ingestion import POOL_CONTEXT, build_search_index, normalize_identifier
+from mapped_pickle import load_mapped
+from search_index import FACETS
+from token_cache import token_cache_stats
+
+logger = logging.getLogger("ComplianceService")
+
+# Number of dataset shards, each scored in its own process (default: one per core)
+SANCTIONS_SHARDS = int(os.getenv("SANCTIONS_SHARDS", "0")) or os.cpu_count() or 1
+
+# Records scored per step of the top-N search, between two cutoff checks
+SCREEN_CHUNK = 1024
+
+# (dataset position, score) of a record that reached the threshold
+Match = Tuple[int, float]
+
+def shard_ranges(count: int, shards: int = SANCTIONS_SHARDS) -> List[Tuple[int, int]]:
+    """Contiguous (start, end) dataset positions of each shard when `count` records are split `shards` ways."""
+    if count == 0:
+        return [(0, 0)]
+    size = -(-count // max(1, min(shards, count)))
+    return [(start, min(start + size, count)) for start in range(0, count, size)]
+
+def rank_key(match: Match) -> Tuple[float, int]:
+    """
+    Ranking of verify_identity: rounded score, highest first, then dataset
+    order, exactly like a stable sort of the full-scan results.
+    """
+    position, score = match
+    return -round(score, 2), position
+
+class ShardScreener:
+    """Candidate indexes and scoring engine over one contiguous slice of the dataset."""
+
+    def __init__(self, records: Sequence, offset: int = 0, workers: int = SCORING_WORKERS):
+        self.offset = offset
+        self.index = build_search_index(records)
+        self.engine = ScoringEngine(records, workers)
+        # Records still in the dataset, by local position (None: all of them)
+        self.live: Optional[np.ndarray] = None
+
+    def screen(self, query, person: bool, top_n: int) -> Tuple[List[Match], int, int]:
+        """
+        Score a compiled query against the records of this shard.
+        Returns the ranked local top-N matches (all matches when top_n <= 0),
+        the number of matches found and the number of records scored.
+        """
+        # Records whose birth date or country rules them out are never considered
+        allowed = self.index.allowed(query, len(self.engine.is_person))
+
+        # Exact hits on a name or alias score 100, the highest score: with top_n
+        # of them the ranking is known without scoring anything else
+        exact = self.index.exact_matches(query) if query.threshold <= 100 else None
+        if exact is None:
+            exact = np.zeros(0, dtype=np.int64)
+        exact = self._filtered(exact, person, allowed)
+        if 0 < top_n <= len(exact):
+            return [(self.offset + position, 100.0) for position in exact[:top_n].tolist()], len(exact), 0
+
+        if query.tfidf_candidates > 0:
+            # Approximate retrieval: only the records with the closest names in TF-IDF space are scored
+            positions = np.sort(self.index.tfidf.nearest(query, query.tfidf_candidates,
+                                                         lambda found: self._filtered(found, person, allowed)))
+        else:
+            positions = self.index.candidates(query)
+            if positions is None:
+                positions = np.arange(len(self.engine.is_person)) if allowed is None else np.flatnonzero(allowed)
+            positions = self._filtered(positions, person, allowed)
+        if len(exact):
+            positions = positions[~np.isin(positions, exact)]
+        exact_matches = [(self.offset + position, 100.0) for position in exact.tolist()]
+
+        # Records whose name lengths cannot reach the threshold are never scored
+        bounds = self.engine.upper_bounds(query, positions)
+        reachable = bounds >= query.threshold
+        positions, bounds = positions[reachable], bounds[reachable]
+
+        if top_n <= 0:
+            scores = self.engine.score(query, positions)
+            matches = exact_matches + [(self.offset + position, score)
+                                       for position, score in zip(positions.tolist(), scores.tolist())
+                                       if score >= query.threshold]
+            matches.sort(key=rank_key)
+            return matches, len(matches), len(positions)
+
+        # Best bounds first. Once the heap holds top_n matches, its worst rounded
+        # score is the cutoff: later chunks are scored from there, and the search
+        # stops at the first chunk whose best bound cannot reach it. The match
+        # count then only covers the records scored. Exact hits start the heap.
+        order = np.argsort(-bounds, kind="stable")
+        heap: List[Tuple[float, int, float]] = [(100.0, -position, 100.0) for position in exact.tolist()]
+        heapq.heapify(heap)
+        found, scored = len(heap), 0
+        for start in range(0, len(order), SCREEN_CHUNK):
+            chunk = order[start:start + SCREEN_CHUNK]
+            min_score = query.threshold
+            if len(heap) == top_n:
+                cutoff = heap[0][0]
+                if round(bounds[chunk[0]], 2) < cutoff:
+                    break
+                min_score = max(min_score, cutoff - 0.005 - CUTOFF_MARGIN)
+
+            chunk_positions = positions[chunk]
+            scores = self.engine.score(query, chunk_positions, min_score, len(positions))
+            scored += len(chunk)
+            for position, score in zip(chunk_positions.tolist(), scores.tolist()):
+                if score < query.threshold:
+                    continue
+                found += 1
+                item = (round(score, 2), -position, score)
+                if len(heap) < top_n:
+                    heapq.heappush(heap, item)
+                elif item > heap[0]:
+                    heapq.heapreplace(heap, item)
+
+        matches = sorted(((self.offset - neg_position, score) for _, neg_position, score in heap), key=rank_key)
+        return matches, found, scored
+
+    def lookup(self, identifier: str, query, person: bool) -> List[Match]:
+        """
+        Ranked matches of the records of this shard carrying a normalized
+        identifier, of the selected type and passing the birth date, country
+        and facet filters of the compiled query. Each scores what the query's
+        name gives it, whatever the threshold, or 100 when there is no name.
+        """
+        allowed = self.index.allowed(query, len(self.engine.is_person)) if query is not None else None
+        positions = self._filtered(self.index.identifiers.lookup(identifier), person, allowed)
+        if query is not None and query.text:
+            scores = self.engine.score(query, positions, 0.0).tolist()
+        else:
+            scores = [100.0] * len(positions)
+        matches = [(self.offset + position, score) for position, score in zip(positions.tolist(), scores)]
+        matches.sort(key=rank_key)
+        return matches
+
+    def facet_counts(self, positions: Sequence[int], query=None, person: bool = True) -> Dict[str, Dict[str, int]]:
+        """
+        Records per dataset, topic and country (see FacetIndex.counts) among
+        the dataset `positions` in this shard and, with a compiled `query`,
+        every record of the selected type that matches it.
+        """
+        count = len(self.engine.is_person)
+        flags = np.zeros(count, dtype=bool)
+        local = np.asarray(positions, dtype=np.int64) - self.offset
+        flags[local[(local >= 0) & (local < count)]] = True
+        if query is not None and query.text:
+            matches, _, _ = self.screen(query, person, 0)
+            flags[np.array([position for position, _ in matches], dtype=np.int64) - self.offset] = True
+        return self.index.facets.counts(flags)
+
+    def _filtered(self, positions: np.ndarray, person: bool, allowed: Optional[np.ndarray] = None) -> np.ndarray:
+        """Local `positions` of records still in the dataset, of the selected type and flagged in `allowed`."""
+        if allowed is not None:
+            positions = positions[allowed[positions]]
+        if self.live is not None:
+            positions = positions[self.live[positions]]
+        is_person = self.engine.is_person[positions]
+        return positions[is_person] if person else positions[~is_person]
+
+    def screen_many(self, queries: Sequence, persons: Sequence[bool], top_n: int) -> List[Tuple[List[Match], int, int]]:
+        """screen() for a list of compiled queries, one result per query."""
+        return [self.screen(query, person, top_n) for query, person in zip(queries, persons)]
+
+    def updated(self, removed: Sequence[Tuple[object, int]], added: Sequence[Tuple[object, int]]) -> "ShardScreener":
+        """
+        Copy of the shard without the `removed` and with the `added` (record,
+        dataset position) pairs. Removed records stay in the scoring columns but
+        are masked out; added ones take the positions after the shard's last.
+        Only their index postings are rewritten; this shard stays unchanged.
+        """
+        count = len(self.engine.is_person)
+        removed = [(record, position - self.offset) for record, position in removed]
+        added = [(record, position - self.offset) for record, position in added]
+        if [position for _, position in added] != list(range(count, count + len(added))):
+            raise ValueError("Added records must follow the last position of the shard")
+
+        other = copy.copy(self)
+        other.index = self.index.updated(removed, added)
+        if added:
+            other.engine = self.engine.extended([record for record, _ in added])
+        live = np.ones(count, dtype=bool) if self.live is None else self.live
+        other.live = np.concatenate([live, np.ones(len(added), dtype=bool)])
+        other.live[[position for _, position in removed]] = False
+        return other
+
+    def token_cache_stats(self) -> Dict[str, Any]:
+        """Counters of the scoring engine's token score cache."""
+        return self.engine.token_cache.stats()
+
+    def freeze(self) -> None:
+        """Convert the index and scoring columns to numpy arrays, for a memory-mapped snapshot."""
+        self.index.freeze()
+        self.engine.freeze()
+
+def live_mask(count: int, removed: Set[int], offset: int = 0) -> Optional[np.ndarray]:
+    """Live flags of `count` records from `offset` on, or None when none of them is in `removed`."""
+    local = [position - offset for position in removed if offset <= position < offset + count]
+    if not local:
+        return None
+    live = np.ones(count, dtype=bool)
+    live[local] = False
+    return live
+
+# Shards held by a worker process, by the key of the ShardedScreener they
+# belong to; set up by _init_shard and derived by _update_shard
+_shards: Dict[int, ShardScreener] = {}
+
+def _init_shard(records: Sequence, offset: int) -> None:
+    # One process per shard already uses every core; keep cdist single-threaded
+    _shards[0] = ShardScreener(records, offset, workers=1)
+
+def _adopt_shard(screener: ShardScreener) -> None:
+    screener.engine.workers = 1
+    _shards[0] = screener
+
+def _attach_shard(snapshot: str, version: str, shard: int) -> None:
+    # Map the snapshot file instead of receiving a pickled copy of the shard
+    header, payload = load_mapped(snapshot)
+    if header["dataset_version"] != version:
+        raise RuntimeError(f"{snapshot} was replaced: version {header['dataset_version']}, expected {version}")
+    _adopt_shard(payload["screeners"][shard])
+
+def _call_shard(key: int, method: str, *args):
+    return getattr(_shards[key], method)(*args)
+
+def _update_shard(key: int, new_key: int, removed: Sequence, added: Sequence) -> int:
+    shard = _shards[key]
+    _shards[new_key] = shard.updated(removed, added) if removed or added else shard
+    return len(_shards[new_key].engine.is_person)
+
+def _drop_shard(key: int) -> None:
+    _shards.pop(key, None)
+
+def _ping_shard() -> int:
+    return len(_shards[0].engine.is_person)
+
+class ShardedScreener:
+    """
+    Splits the dataset into contiguous shards, each indexed and scored in its
+    own persistent worker process. A query is scattered to every shard and the
+    local top-N lists are merged, which gives exactly the serial ranking.
+    With a single shard everything runs in-process.
+    """
+
+    def __init__(self, records: Sequence, shards: int = SANCTIONS_SHARDS,
+                 screeners: Optional[List[ShardScreener]] = None, snapshot: Optional[Tuple[str, str]] = None):
+        """
+        `screeners` are shards already built for shard_ranges(len(records), shards),
+        e.g. by a dataset snapshot; without them every shard is built from `records`.
+        With the (path, dataset version) of that `snapshot`, the worker processes
+        map their shard from the file rather than get a copy of `screeners`.
+        """
+        self.records = records
+        ranges = shard_ranges(len(records), shards)
+        self.ranges = ranges
+        self.shards = len(ranges)
+        self.pools: List[ProcessPoolExecutor] = []
+        self.local: Optional[ShardScreener] = None
+        # Dataset positions deleted by deltas (see updated())
+        self.removed: Set[int] = set()
+        # Screeners derived by updated() share the worker pools; each has its
+        # own key in the workers, and the pools stop with the last of them
+        self.key = 0
+        self.keys = itertools.count(1)
+        self.live_keys = {0}
+        # Held while the in-process fallback is built, so concurrent requests build it once
+        self.fallback_lock = threading.Lock()
+
+        if self.shards == 1:
+            if screeners:
+                self.local = screeners[0]
+                self.local.engine.workers = SCORING_WORKERS
+            else:
+                self.local = ShardScreener(records)
+            return
+
+        for i, (start, end) in enumerate(ranges):
+            if screeners and snapshot:
+                initializer, initargs = _attach_shard, (*snapshot, i)
+            elif screeners:
+                initializer, initargs = _adopt_shard, (screeners[i],)
+            else:
+                initializer, initargs = _init_shard, (records[start:end], start)
+            self.pools.append(ProcessPoolExecutor(max_workers=1, initializer=initializer, initargs=initargs,
+                                                  mp_context=POOL_CONTEXT))
+        # Build every shard now rather than on the first request
+        loaded = [pool.submit(_ping_shard) for pool in self.pools]
+        logger.info(f"Started {len(self.pools)} scoring shards: {[f.result() for f in loaded]} records")
+
+    def screen(self, query, person: bool, top_n: int) -> Tuple[List[Match], int, int]:
+        """
+        Ranked top-N (dataset position, score) matches of a compiled query, the
+        number of matches and the number of records scored.
+        """
+        return self.screen_many([query], [person], top_n)[0]
+
+    def screen_many(self, queries: Sequence, persons: Sequence[bool], top_n: int) -> List[Tuple[List[Match], int, int]]:
+        """
+        screen() for a list of compiled queries. The whole list goes to each
+        shard in a single call, so a batch costs one round trip per shard.
+        """
+        shard_results = self._scatter("screen_many", queries, persons, top_n)
+        merged = []
+        for results in zip(*shard_results):
+            # Shard lists are already ranked; same slice as the full scan, including top_n <= 0
+            matches = list(heapq.merge(*(shard_matches for shard_matches, _, _ in results), key=rank_key))
+            merged.append((matches[:top_n], sum(r[1] for r in results), sum(r[2] for r in results)))
+        return merged
+
+    def lookup(self, identifier: str, query, person: bool) -> List[Match]:
+        """
+        Ranked (dataset position, score) matches of the records carrying a
+        passport, ID or registration number, from the identifier index of each
+        shard; see ShardScreener.lookup. `query` is the compiled query (with
+        the filters to apply), or None.
+        """
+        identifier = normalize_identifier(identifier)
+        if not identifier:
+            return []
+        return list(heapq.merge(*self._scatter("lookup", identifier, query, person), key=rank_key))
+
+    def facet_counts(self, positions: Sequence[int], query=None, person: bool = True) -> Dict[str, Dict[str, int]]:
+        """
+        Records per dataset, topic and country among the dataset `positions`
+        and, with a compiled `query`, every record of the selected type that
+        matches it, added up over the shards; see ShardScreener.facet_counts.
+        """
+        totals: Dict[str, Dict[str, int]] = {facet: {} for facet in FACETS}
+        for counts in self._scatter("facet_counts", list(positions), query, person):
+            for facet, values in counts.items():
+                for value, found in values.items():
+                    totals[facet][value] = totals[facet].get(value, 0) + found
+        return totals
+
+    def token_cache_stats(self) -> Dict[str, Any]:
+        """Token score cache counters added up over the shards (see token_cache.TokenScoreCache)."""
+        return token_cache_stats(self._scatter("token_cache_stats"))
+
+    def _scatter(self, method: str, *args) -> List:
+        """
+        Result of the ShardScreener `method` on every shard, in the worker
+        processes, or in-process with a single shard or once the workers failed.
+        """
+        if self.local is None:
+            try:
+                futures = [pool.submit(_call_shard, self.key, method, *args) for pool in self.pools]
+                if not futures:
+                    raise RuntimeError("scoring shards are stopped")
+                return [f.result() for f in futures]
+            except Exception as e:
+                with self.fallback_lock:
+                    # Another request may have built it while this one waited
+                    if self.local is None:
+                        logger.error(f"Scoring shards failed, falling back to in-process scoring: {e}")
+                        local = ShardScreener(self.records)
+                        local.live = live_mask(len(self.records), self.removed)
+                        self.local = local
+                        self.close()
+        return [getattr(self.local, method)(*args)]
+
+    def updated(self, records: Sequence, removed: Sequence[Tuple[object, int]],
+                added: Sequence[Tuple[object, int]]) -> "ShardedScreener":
+        """
+        Screener over `records`, the dataset after a delta: without the
+        `removed` and with the `added` (record, dataset position) pairs, which
+        extend the last shard. Each shard only rewrites the postings of its own
+        changed records, in its worker; this screener keeps serving the old data.
+        """
+        other = copy.copy(self)
+        other.records = records
+        other.removed = self.removed | {position for _, position in removed}
+        start, end = self.ranges[-1]
+        other.ranges = self.ranges[:-1] + [(start, end + len(added))]
+
+        if self.local is not None:
+            other.local = self.local.updated(removed, added)
+            return other
+
+        other.key = next(self.keys)
+        self.live_keys.add(other.key)
+        futures = []
+        for i, (start, end) in enumerate(self.ranges):
+            shard_removed = [(record, position) for record, position in removed if start <= position < end]
+            shard_added = added if i == len(self.ranges) - 1 else []
+            futures.append(self.pools[i].submit(_update_shard, self.key, other.key, shard_removed, shard_added))
+        try:
+            sizes = [f.result() for f in futures]
+        except Exception:
+            other.close()
+            raise
+        logger.info(f"Updated scoring shards: {sizes} records")
+        return other
+
+    def close(self) -> None:
+        """Stop the worker processes, or only drop this screener's shards while derived ones still use them."""
+        self.live_keys.discard(self.key)
+        if self.live_keys:
+            for pool in self.pools:
+                try:
+                    pool.submit(_drop_shard, self.key)
+                except RuntimeError:  # pool already broken or stopped
+                    pass
+            return
+        for pool in self.pools:
+            pool.shutdown(wait=False, cancel_futures=True)
+        self.pools = []
@@ -0,0 +1,234 @@
+
+
+
+# snapshot.py
+# Compile the sanctions dataset into a binary snapshot that the service maps at
+# startup instead of parsing the JSONL file:
+#   python snapshot.py [dataset] [-o output] [--shards N]
+# The index and scoring columns are stored as raw arrays and memory-mapped, so
+# every worker process attached to the same snapshot shares a single copy.
+
+import os
+import logging
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Mapping, Optional, Sequence, Tuple
+
+import numpy as np
+
+from data_ingestion import POOL_CONTEXT, TRANSLITERATION, load_dataset, dataset_version
+from mapped_pickle import dump_mapped, load_mapped, read_header
+from phonetic_cache import PHONETIC_ALGORITHM
+from record_store import PackedLines, RecordStore, StoredRecords, PositionIndex
+from search_index import NGRAM_SIZE, SYMSPELL_MAX_EDITS, SYMSPELL_MAX_LENGTH
+from sharded_scoring import ShardScreener, SANCTIONS_SHARDS, shard_ranges
+
+try:
+    import fcntl
+except ImportError:  # not available on Windows
+    fcntl = None
+
+logger = logging.getLogger("ComplianceService")
+
+# Bump whenever the layout of the pickled structures changes
+SNAPSHOT_FORMAT = 14
+
+# Snapshot file read at startup (default: the dataset file name + ".snapshot")
+SANCTIONS_SNAPSHOT = os.getenv("SANCTIONS_SNAPSHOT", "")
+
+# Build a missing or stale snapshot at startup, so that the worker processes
+# map it instead of each loading its own copy of the dataset
+SNAPSHOT_ON_START = os.getenv("SNAPSHOT_ON_START", "1") == "1"
+
+# Same default dataset as routes.DATASET_FILE
+DEFAULT_DATASET_FILE = "Open_sanctions_target_nested_json_dataset"
+
+class LoadedDataset:
+    """
+    A dataset ready to serve: records, record store and id positions. From a
+    snapshot, also its version, the prebuilt shard screeners and the snapshot
+    (path, version) that scoring workers map their shard from.
+    """
+
+    def __init__(self, records: Sequence, store: RecordStore, positions: Optional[Mapping[str, int]] = None,
+                 version: Optional[str] = None, screeners: Optional[List[ShardScreener]] = None,
+                 snapshot: Optional[Tuple[str, str]] = None):
+        self.records = records
+        self.store = store
+        self.positions = positions
+        self.version = version
+        self.screeners = screeners
+        self.snapshot = snapshot
+
+def snapshot_path(dataset_file: str) -> str:
+    """Snapshot file belonging to a dataset file."""
+    return SANCTIONS_SNAPSHOT or f"{dataset_file}.snapshot"
+
+def source_signature(dataset_file: str) -> Dict[str, int]:
+    """Size and modification time of the dataset file, to detect a stale snapshot."""
+    stat = os.stat(dataset_file)
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+def build_snapshot(dataset_file: str, output: Optional[str] = None, shards: int = SANCTIONS_SHARDS) -> Dict[str, Any]:
+    """
+    Parse the dataset and write its record ids, record offsets and the
+    prebuilt indexes and scoring columns of every shard to a snapshot file.
+    The file starts with a small header, so staleness is checked without
+    reading the rest. Returns the header.
+    """
+    output = output or snapshot_path(dataset_file)
+    source = source_signature(dataset_file)
+
+    store = RecordStore(dataset_file)
+    records = load_dataset(dataset_file, store)
+    store.close()
+    if source_signature(dataset_file) != source:
+        raise RuntimeError(f"{dataset_file} changed while the snapshot was being built")
+
+    ranges = shard_ranges(len(records), shards)
+    screeners = [ShardScreener(records[start:end], start, workers=1) for start, end in ranges]
+    for screener in screeners:
+        screener.freeze()
+    positions = PositionIndex.build([record.id for record in records])
+
+    header = {
+        "format": SNAPSHOT_FORMAT,
+        "phonetic_algorithm": PHONETIC_ALGORITHM,
+        "ngram_size": NGRAM_SIZE,
+        "deletion_index": [SYMSPELL_MAX_EDITS, SYMSPELL_MAX_LENGTH],
+        "transliteration": TRANSLITERATION,
+        "source": source,
+        "records": len(records),
+        "dataset_version": dataset_version(records),
+        "shard_ranges": ranges,
+        "built_at": datetime.now(timezone.utc).isoformat(),
+    }
+    payload = {
+        "ids": np.array([record.id for record in records], dtype=str),
+        "last_changes": np.array([record.last_change for record in records], dtype=str),
+        "id_index": (positions.ids, positions.positions),
+        "offsets": np.array(store.offsets, dtype=np.uint64),
+        "lengths": np.array(store.lengths, dtype=np.uint32),
+        "blobs": PackedLines.pack(store.blobs) if store.blobs is not None else None,
+        "screeners": screeners,
+    }
+
+    # Written aside and renamed, so a running service never sees a partial file
+    temp_path = f"{output}.tmp"
+    dump_mapped(temp_path, header, payload)
+    os.replace(temp_path, output)
+
+    logger.info(f"Wrote snapshot {output}: {len(records)} records, {len(ranges)} shards, "
+                f"version {header['dataset_version']}, {os.path.getsize(output)} bytes")
+    return header
+
+def stale_reason(header: Dict[str, Any], dataset_file: str) -> Optional[str]:
+    """Why a snapshot header does not match the dataset file and settings, or None when it is current."""
+    if header.get("format") != SNAPSHOT_FORMAT:
+        return f"snapshot format {header.get('format')}, expected {SNAPSHOT_FORMAT}"
+    if header.get("phonetic_algorithm") != PHONETIC_ALGORITHM:
+        return f"built with PHONETIC_ALGORITHM={header.get('phonetic_algorithm')}"
+    if header.get("ngram_size") != NGRAM_SIZE:
+        return f"built with n-gram size {header.get('ngram_size')}"
+    if header.get("deletion_index") != [SYMSPELL_MAX_EDITS, SYMSPELL_MAX_LENGTH]:
+        return f"built with SYMSPELL_MAX_EDITS, SYMSPELL_MAX_LENGTH = {header.get('deletion_index')}"
+    if header.get("transliteration") != TRANSLITERATION:
+        return f"names romanized with {header.get('transliteration')}, now {TRANSLITERATION}"
+    if header.get("source") != source_signature(dataset_file):
+        return f"{dataset_file} changed since the snapshot was built"
+    if header.get("shard_ranges") != shard_ranges(header.get("records", 0), SANCTIONS_SHARDS):
+        return f"built for {len(header.get('shard_ranges', []))} shards, SANCTIONS_SHARDS={SANCTIONS_SHARDS}"
+    return None
+
+def attach_snapshot(path: str, dataset_file: str) -> Optional[LoadedDataset]:
+    """
+    Map a snapshot of `dataset_file`. Records are served through the record
+    store; ids, offsets, indexes and scoring columns stay in the mapped file.
+    None when the snapshot is missing, stale, unreadable or untrusted (see
+    mapped_pickle.check_trusted); the caller then rebuilds it or falls back.
+    """
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, "rb") as f:
+            reason = stale_reason(read_header(f), dataset_file)
+        if reason is not None:
+            logger.warning(f"Snapshot {path} is stale ({reason})")
+            return None
+
+        header, payload = load_mapped(path)
+        if stale_reason(header, dataset_file) is not None:
+            return None  # replaced between the two reads; the caller rebuilds or falls back
+        store = RecordStore(dataset_file)
+        store.offsets, store.lengths = payload["offsets"], payload["lengths"]
+        store.blobs = payload["blobs"]
+        store.ids = payload["ids"]
+        records = StoredRecords(store, payload["ids"], payload["last_changes"])
+        version = header["dataset_version"]
+        logger.info(f"Mapped snapshot {path} built {header['built_at']}: {len(records)} records")
+        return LoadedDataset(records, store, PositionIndex(*payload["id_index"]), version,
+                             payload["screeners"], (path, version))
+    except PermissionError as e:
+        logger.error(f"Refusing to load snapshot {path}: {e}")
+        return None
+    except Exception as e:
+        logger.warning(f"Could not read snapshot {path}: {e}")
+        return None
+
+@contextmanager
+def build_lock(path: str):
+    """Exclusive lock next to the snapshot, so concurrent workers build it once and the others wait."""
+    if fcntl is None:
+        yield
+        return
+    with open(f"{path}.lock", "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+def open_dataset(dataset_file: str) -> LoadedDataset:
+    """
+    Load the dataset for serving: by mapping its snapshot when one exists and is
+    current, otherwise (with SNAPSHOT_ON_START) by building the snapshot first,
+    and as a last resort by parsing the JSONL file into memory.
+    """
+    path = snapshot_path(dataset_file)
+    loaded = attach_snapshot(path, dataset_file)
+
+    if loaded is None and SNAPSHOT_ON_START and os.path.exists(dataset_file):
+        try:
+            with build_lock(path):
+                # Another worker may have built it while this one waited
+                loaded = attach_snapshot(path, dataset_file)
+                if loaded is None:
+                    # Built in a child process, so this one never holds the parsed dataset
+                    with ProcessPoolExecutor(max_workers=1, mp_context=POOL_CONTEXT) as pool:
+                        pool.submit(build_snapshot, dataset_file, path).result()
+                    loaded = attach_snapshot(path, dataset_file)
+        except Exception as e:
+            logger.warning(f"Could not build snapshot {path}: {e}")
+
+    if loaded is not None:
+        return loaded
+    logger.info(f"Loading {dataset_file} into memory")
+    store = RecordStore(dataset_file)
+    return LoadedDataset(load_dataset(dataset_file, store), store)
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Compile the sanctions dataset into a binary snapshot loaded at startup.")
+    parser.add_argument("dataset", nargs="?", default=DEFAULT_DATASET_FILE, help="JSONL dataset file")
+    parser.add_argument("-o", "--output", help="snapshot file (default: SANCTIONS_SNAPSHOT or <dataset>.snapshot)")
+    parser.add_argument("--shards", type=int, default=SANCTIONS_SHARDS,
+                        help="shard layout to prebuild; must match SANCTIONS_SHARDS of the service, "
+                             "or the snapshot counts as stale")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    build_snapshot(args.dataset, args.output, args.shards)
+
+if __name__ == "__main__":
+    main()
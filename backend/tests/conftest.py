@@ -0,0 +1,131 @@
+# conftest.py
+# Shared fixtures of the tests: a synthetic dataset written as OpenSanctions
+# JSON lines and an in-memory audit database, so the tests need neither the
+# real export nor PostgreSQL.
+
+import os
+import sys
+import json
+import random
+import shutil
+from typing import Any, Dict, List
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+FIRST_NAMES = ["John", "Jon", "Johan", "Wei", "Li", "Kim", "Olga", "Ivan", "Sergei", "Mohamed", "Muhammad",
+               "Ahmed", "Maria", "Mariya", "Anna", "Hassan", "Omar", "Yuri", "Elena", "Jean"]
+LAST_NAMES = ["Smith", "Smyth", "Kadyrov", "Kadirov", "Ivanov", "Petrova", "Khan", "Al Assad", "Lee", "Wang",
+              "Kim", "Nguyen", "Hussein", "Morales", "Novak", "Sokolov", "Abdullah", "Park"]
+NATIVE_NAMES = ["Иван Иванов", "Ольга Петрова", "Алексей Навальный", "Γιώργος Παπαδόπουλος", "Ευάγγελος Χριστοδούλου"]
+COMPANY_WORDS = ["Neva", "Steel", "Trading", "Global", "Oil", "Atlas", "Orient", "Delta", "Polar", "Marine"]
+LEGAL_FORMS = ["LLC", "AO", "OOO", "Ltd", "SA", "GmbH", ""]
+DATASETS = ["us_ofac_sdn", "eu_fsf", "gb_hmt_sanctions", "ru_rupep"]
+TOPICS = ["sanction", "role.pep", "crime", "poi"]
+COUNTRIES = ["ru", "by", "sy", "ir", "kp", "ua", "gr"]
+
+def person_entity(rng: random.Random, index: int) -> Dict[str, Any]:
+    first, last = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+    properties: Dict[str, List[str]] = {"firstName": [first], "lastName": [last], "name": [f"{first} {last}"]}
+    aliases = []
+    if rng.random() < 0.3:
+        aliases.append(f"{last} {first}")
+    if rng.random() < 0.2:
+        aliases.append(rng.choice(NATIVE_NAMES))
+    if rng.random() < 0.1:
+        aliases.append(rng.choice(FIRST_NAMES))
+    if aliases:
+        properties["alias"] = aliases
+    if rng.random() < 0.6:
+        properties["birthDate"] = [f"{rng.randint(1950, 1995)}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}"]
+    if rng.random() < 0.2:
+        properties["passportNumber"] = [f"P{rng.randint(10000, 99999)}"]
+    return entity(rng, f"T-{index}", f"{first} {last}", "Person", properties)
+
+def company_entity(rng: random.Random, index: int) -> Dict[str, Any]:
+    name = " ".join(rng.sample(COMPANY_WORDS, rng.randint(1, 2)) + [rng.choice(LEGAL_FORMS)]).strip()
+    properties = {"name": [name]}
+    if rng.random() < 0.3:
+        properties["alias"] = [f"{rng.choice(COMPANY_WORDS)} {rng.choice(COMPANY_WORDS)}"]
+    return entity(rng, f"T-{index}", name, rng.choice(["Organization", "Company"]), properties)
+
+def entity(rng: random.Random, entity_id: str, caption: str, schema: str, properties: Dict[str, List[str]]) -> Dict[str, Any]:
+    properties["country"] = rng.sample(COUNTRIES, rng.randint(0, 2))
+    properties["topics"] = rng.sample(TOPICS, rng.randint(0, 2))
+    return {
+        "id": entity_id,
+        "caption": caption,
+        "schema": schema,
+        "properties": properties,
+        "referents": [],
+        "datasets": rng.sample(DATASETS, rng.randint(1, 2)),
+        "first_seen": "2023-01-01T00:00:00",
+        "last_seen": "2024-01-01T00:00:00",
+        "last_change": "2023-06-01T00:00:00",
+        "target": True,
+    }
+
+def synthetic_entities(count: int, seed: int = 7) -> List[Dict[str, Any]]:
+    """`count` people and companies (about three people to one company) with shared and repeated names."""
+    rng = random.Random(seed)
+    return [person_entity(rng, i) if rng.random() < 0.75 else company_entity(rng, i) for i in range(count)]
+
+@pytest.fixture(scope="session")
+def dataset_file(tmp_path_factory) -> str:
+    """A JSONL dataset of 600 synthetic entities."""
+    path = tmp_path_factory.mktemp("dataset") / "dataset.jsonl"
+    with open(path, "w", encoding="utf-8") as f:
+        for item in synthetic_entities(600):
+            f.write(json.dumps(item, ensure_ascii=False) + "\n")
+    return str(path)
+
+@pytest.fixture(scope="session")
+def audit_sessions():
+    """Session factory of an in-memory SQLite database with the audit log tables."""
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import sessionmaker
+    from sqlalchemy.pool import StaticPool
+    from db_models import Base
+
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    Base.metadata.create_all(engine)
+    return sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+@pytest.fixture(scope="session")
+def api(tmp_path_factory, dataset_file, audit_sessions):
+    """
+    Test client of the API routes serving the synthetic dataset, auditing to
+    `audit_sessions`. Needs the full requirements.txt: the routes module
+    imports the OCR, PDF and PostgreSQL packages.
+    """
+    for package in ("psycopg2", "reportlab", "easyocr", "cv2", "PIL"):
+        pytest.importorskip(package)
+    from fastapi import FastAPI
+    from fastapi.testclient import TestClient
+
+    # routes loads the dataset from the working directory at import
+    directory = tmp_path_factory.mktemp("service")
+    shutil.copy(dataset_file, directory / "Open_sanctions_target_nested_json_dataset")
+    previous = os.getcwd()
+    os.chdir(directory)
+    os.environ.setdefault("POSTGRES_PASSWORD", "test")
+    import routes
+    from database import get_db
+
+    def test_db():
+        db = audit_sessions()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    app = FastAPI()
+    app.include_router(routes.router)
+    app.dependency_overrides[get_db] = test_db
+    with pytest.MonkeyPatch.context() as patch:
+        patch.setattr(routes, "SessionLocal", audit_sessions)
+        with TestClient(app) as client:
+            yield client
+    routes.sanction_datasets.generation.close()
+    os.chdir(previous)
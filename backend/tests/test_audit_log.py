@@ -0,0 +1,39 @@
+# test_audit_log.py
+
+import pytest
+
+from audit_log import log_search_bulk
+from db_models import LogEntry
+
+def search(name: str, matches=()) -> dict:
+    return {
+        "timestamp": "2024-01-01T00:00:00+00:00",
+        "query": {"name": name, "surname": "", "entity_type": "person", "threshold": 80.0, "phonetic": False},
+        "result": {"matches": list(matches), "status": "success" if matches else "no matches found"},
+        "dataset": {"version": "0123456789abcdef", "built_at": "2024-01-01T00:00:00+00:00"},
+    }
+
+def test_bulk_entries_are_committed_together(audit_sessions):
+    db = audit_sessions()
+    try:
+        before = db.query(LogEntry).count()
+        entries = log_search_bulk(db, [search("Ольга"), search("John", [{"name": "John", "score": 100.0}])])
+        assert db.query(LogEntry).count() == before + 2
+        assert [entry.query_name for entry in entries] == ["Ольга", "John"]
+        assert entries[1].matches == '[{"name": "John", "score": 100.0}]'
+        assert entries[0].status == "no matches found"
+        assert entries[0].dataset_version == "0123456789abcdef"
+    finally:
+        db.close()
+
+def test_a_failed_bulk_commit_logs_nothing(audit_sessions):
+    db = audit_sessions()
+    try:
+        before = db.query(LogEntry).count()
+        broken = search("Broken")
+        del broken["result"]["status"]
+        with pytest.raises(KeyError):
+            log_search_bulk(db, [search("First"), broken])
+        assert db.query(LogEntry).count() == before
+    finally:
+        db.close()
@@ -0,0 +1,81 @@
+# test_batch_screening.py
+
+import json
+
+import pytest
+
+from db_models import LogEntry
+
+CSV_BATCH = "﻿Name , Surname,ENTITY_TYPE,birth_date\nJohn,Smith,person,1970\nNeva Steel,,company,\n,Nobody,person,\nOlga,Petrova,person,\n"
+
+def ndjson(response):
+    return [json.loads(line) for line in response.text.splitlines()]
+
+def logged(audit_sessions) -> int:
+    db = audit_sessions()
+    try:
+        return db.query(LogEntry).count()
+    finally:
+        db.close()
+
+def test_csv_rows_stream_in_input_order(api, audit_sessions):
+    before = logged(audit_sessions)
+    response = api.post("/verify_identity_batch?threshold=60", content=CSV_BATCH.encode("utf-8"),
+                        headers={"content-type": "text/csv"})
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    lines = ndjson(response)
+    assert [line["row"] for line in lines] == [1, 2, 3, 4]
+    assert lines[0]["query"] == {"name": "John", "surname": "Smith", "entity_type": "person", "birth_date": "1970",
+                                 "threshold": 60.0, "phonetic": False, "retrieval": "index"}
+    assert lines[0]["result"]["matches"][0]["score"] == 100.0
+    assert lines[1]["query"]["entity_type"] == "company"
+    assert lines[2] == {"row": 3, "status": "error", "detail": "Name is required"}
+    # Every screened row is audited, the rows in error are not
+    assert logged(audit_sessions) == before + 3
+
+def test_birth_date_agreement_is_flagged(api):
+    response = api.post("/verify_identity_batch?threshold=100", json=[{"name": "John", "surname": "Smith", "birth_date": "1800"}])
+    matches = ndjson(response)[0]["result"]["matches"]
+    assert matches
+    assert all(match["birth_date_match"] in (False, None) for match in matches)
+
+@pytest.mark.parametrize("payload", [
+    [{"name": "John", "surname": "Smith"}, "not a row", {"name": "Kim", "entity_type": ["person"]}],
+    {"rows": [{"name": "John", "surname": "Smith"}, "not a row", {"name": "Kim", "entity_type": ["person"]}]},
+], ids=["array", "object"])
+def test_json_rows(api, payload):
+    lines = ndjson(api.post("/verify_identity_batch", json=payload))
+    assert lines[0]["row"] == 1 and "result" in lines[0]
+    assert lines[1] == {"row": 2, "status": "error", "detail": "Row must be an object"}
+    assert lines[2]["status"] == "error" and lines[2]["detail"].startswith("Invalid row")
+
+def test_uploaded_file(api):
+    response = api.post("/verify_identity_batch", files={"file": ("batch.csv", CSV_BATCH.encode("utf-8"), "text/csv")})
+    assert [line["row"] for line in ndjson(response)] == [1, 2, 3, 4]
+
+@pytest.mark.parametrize("body,content_type", [
+    (b"", "text/csv"),
+    (b"[]", "application/json"),
+    (b"{\"rows\": 3}", "application/json"),
+    (b"[{", "application/json"),
+    (b"\xff\xfe", "text/csv"),
+], ids=["empty", "no-rows", "rows-not-a-list", "bad-json", "not-utf8"])
+def test_invalid_batches_are_rejected(api, body, content_type):
+    response = api.post("/verify_identity_batch", content=body, headers={"content-type": content_type})
+    assert response.status_code == 400
+
+def test_each_chunk_is_screened_and_audited_together(api, monkeypatch):
+    import routes
+    audits, screens = [], []
+    log_search_bulk, screen_many = routes.log_search_bulk, routes.sanction_datasets.generation.screener.screen_many
+    monkeypatch.setattr(routes, "BATCH_CHUNK_SIZE", 2)
+    monkeypatch.setattr(routes, "log_search_bulk", lambda db, searches: audits.append(len(searches)) or log_search_bulk(db, searches))
+    monkeypatch.setattr(routes.sanction_datasets.generation.screener, "screen_many",
+                        lambda queries, *args: screens.append(len(queries)) or screen_many(queries, *args))
+
+    rows = [{"name": name} for name in ["John Smith", "Olga Petrova", "", "Wei Khan", "Kim Lee"]]
+    lines = ndjson(api.post("/verify_identity_batch", json=rows))
+    assert [line["row"] for line in lines] == [1, 2, 3, 4, 5]
+    assert screens == [2, 1, 1]
+    assert audits == [2, 1, 1]
@@ -0,0 +1,23 @@
+# test_birth_dates.py
+
+import pytest
+
+from matching import valid_birth_date
+
+@pytest.mark.parametrize("value", ["1970", "1970-02", "1970-12", "1972-02-29", "2000-12-31"])
+def test_real_dates_are_valid(value):
+    assert valid_birth_date(value)
+
+@pytest.mark.parametrize("value", ["", "197", "70-01-01", "1970-13", "1970-00", "1970-99-99", "1971-02-29",
+                                   "1970-04-31", "1970-1-1", "1970/01/01", "1970-01-01T00:00", "١٩٧٠"])
+def test_impossible_or_malformed_dates_are_refused(value):
+    assert not valid_birth_date(value)
+
+@pytest.mark.parametrize("value", ["1970-99-99", "1970-13", "1970-02-30"])
+def test_route_refuses_impossible_birth_dates(api, value):
+    response = api.get(f"/verify_identity?name=John&surname=Smith&birth_date={value}")
+    assert response.status_code == 400
+
+def test_route_screens_with_a_real_birth_date(api):
+    response = api.get("/verify_identity?name=John&surname=Smith&birth_date=1972-02-29")
+    assert response.status_code == 200
@@ -0,0 +1,82 @@
+# test_dataset_reload.py
+
+import os
+import json
+import threading
+
+import pytest
+
+from dataset_manager import DatasetManager
+from matching import compile_query
+from conftest import synthetic_entities
+
+def write_export(path, entities) -> None:
+    """Replace the dataset file by rename, as new exports should be."""
+    with open(f"{path}.tmp", "w", encoding="utf-8") as f:
+        for item in entities:
+            f.write(json.dumps(item, ensure_ascii=False) + "\n")
+    os.replace(f"{path}.tmp", path)
+
+@pytest.fixture
+def manager(tmp_path, monkeypatch):
+    """A DatasetManager of the first 300 synthetic entities, recording the generations it closes."""
+    path = str(tmp_path / "dataset.jsonl")
+    write_export(path, synthetic_entities(300))
+    manager = DatasetManager(path)
+    manager.closed = []
+    close = manager._close
+    monkeypatch.setattr(manager, "_close", lambda generation: (manager.closed.append(generation), close(generation)))
+    manager.load()
+    yield manager
+    manager.generation.close()
+
+def screen(generation, text: str):
+    matches, _, _ = generation.screener.screen(compile_query(text, 70), True, 5)
+    return [generation.store.hydrate(position).id for position, _ in matches]
+
+def test_reload_swaps_in_the_new_export(manager):
+    first = manager.generation
+    write_export(manager.dataset_file, synthetic_entities(600))
+    assert manager.reload()
+    assert manager.generation is not first and manager.generation.version != first.version
+    assert len(manager.generation.records) == 600
+    assert manager.closed == [first]
+    assert manager.status()["reloads"] == 1 and manager.status()["last_error"] is None
+
+def test_generation_in_use_is_closed_once_drained(manager):
+    entities = synthetic_entities(600)
+    with manager.use() as first:
+        before = screen(first, "John Smith")
+        write_export(manager.dataset_file, entities[300:])
+        assert manager.request_reload()
+        # Background reload; the lock is released when it is done
+        with manager.reload_lock:
+            pass
+        assert manager.generation is not first
+        # Still open for the request that holds it, and still the old dataset
+        assert first.retired and manager.closed == []
+        assert screen(first, "John Smith") == before
+        assert first.store.hydrate(0).id == entities[0]["id"]
+    assert manager.closed == [first]
+    with manager.use() as second:
+        assert second is manager.generation and second.store.hydrate(0).id == entities[300]["id"]
+
+def test_one_reload_runs_at_a_time(manager):
+    release = threading.Event()
+    with manager.reload_lock:
+        assert not manager.request_reload()
+    build = manager._build
+    manager._build = lambda: (release.wait(5), build())[1]
+    assert manager.request_reload()
+    assert not manager.request_reload()
+    release.set()
+    with manager.reload_lock:
+        assert manager.reloads == 1
+
+def test_failed_reload_keeps_the_current_generation(manager):
+    first = manager.generation
+    os.remove(manager.dataset_file)
+    assert not manager.reload()
+    assert manager.generation is first and not first.retired
+    assert manager.status()["last_error"]
+    assert screen(first, "John Smith") == screen(manager.generation, "John Smith")
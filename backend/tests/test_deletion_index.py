@@ -0,0 +1,51 @@
+# test_deletion_index.py
+
+import random
+
+import numpy as np
+
+from search_index import DeletionIndex, deletions
+
+def common_subsequence(a: str, b: str) -> int:
+    """Length of the longest common subsequence of two strings."""
+    row = [0] * (len(b) + 1)
+    for x in a:
+        previous = 0
+        for j, y in enumerate(b, 1):
+            previous, row[j] = row[j], previous + 1 if x == y else max(row[j], row[j - 1])
+    return row[-1]
+
+def random_words(rng: random.Random, count: int):
+    return ["".join(rng.choice("abcde") for _ in range(rng.randint(1, 8))) for _ in range(count)]
+
+def test_deletions_by_level():
+    assert deletions("abc", 2) == [{"abc"}, {"bc", "ac", "ab"}, {"a", "b", "c"}]
+    assert deletions("ab", 5) == [{"ab"}, {"a", "b"}, {""}]
+
+def test_lookup_finds_exactly_the_variants_with_a_long_enough_subsequence():
+    rng = random.Random(3)
+    words = random_words(rng, 400)
+    index = DeletionIndex(max_edits=2, max_length=8)
+    for variant_id, word in enumerate(words):
+        index.add(word, variant_id)
+    index.seal()
+    for text in random_words(rng, 60):
+        for edits in range(min(2, len(text)) + 1):
+            # Lengths whose variants are indexed with enough deletions
+            lengths = [length for length in range(1, 9) if 0 <= length - len(text) + edits <= 2]
+            expected = {i for i, word in enumerate(words)
+                        if len(word) in lengths and common_subsequence(text, word) >= len(text) - edits}
+            assert set(index.lookup(text, edits, lengths).tolist()) == expected, (text, edits)
+
+def test_updated_index_leaves_the_original_unchanged():
+    index = DeletionIndex(max_edits=1, max_length=8)
+    for variant_id, word in enumerate(["olga", "olag", "ivan"]):
+        index.add(word, variant_id)
+    index.seal()
+    other = index.updated(np.array([1], dtype=np.uint32))
+    other.add("oxgz", 3)
+    other.add("olga", 4)
+    other.seal()
+    assert sorted(index.lookup("olga", 1, [4]).tolist()) == [0, 1]
+    assert sorted(other.lookup("olga", 1, [4]).tolist()) == [0, 4]
+    assert index.covers(4, 1) and not index.covers(9, 1) and not index.covers(4, 2)
@@ -0,0 +1,112 @@
+# test_delta_journal.py
+# Deltas recorded in the journal reach every DatasetManager of the same
+# dataset file (as in other worker processes), survive reloads and restarts,
+# and are dropped with the export they were applied to.
+
+import os
+import json
+import time
+from typing import Dict, List
+
+import pytest
+
+from dataset_manager import DatasetManager
+from conftest import synthetic_entities
+
+def delta(*operations: Dict) -> List[bytes]:
+    return [json.dumps(operation, ensure_ascii=False).encode("utf-8") for operation in operations]
+
+def write_export(path: str, entities: List[Dict]) -> None:
+    with open(f"{path}.tmp", "w", encoding="utf-8") as f:
+        for item in entities:
+            f.write(json.dumps(item, ensure_ascii=False) + "\n")
+    os.replace(f"{path}.tmp", path)
+
+def loaded(path: str) -> DatasetManager:
+    manager = DatasetManager(path)
+    manager.load()
+    return manager
+
+@pytest.fixture
+def export(tmp_path):
+    """Path of a dataset file of 200 synthetic entities, and the entities."""
+    entities = synthetic_entities(200)
+    path = str(tmp_path / "dataset.jsonl")
+    write_export(path, entities)
+    return path, entities
+
+@pytest.fixture
+def managers():
+    """Collects the managers a test starts and closes their generations afterwards."""
+    started = []
+    yield started
+    for manager in started:
+        manager.generation.close()
+
+def test_workers_apply_each_others_deltas_in_order(export, managers):
+    path, entities = export
+    first, second = loaded(path), loaded(path)
+    managers += [first, second]
+    first.apply_delta(delta({"op": "DEL", "entity": {"id": entities[0]["id"]}}))
+    renamed = dict(entities[1], caption="Zzyzx Qwerty")
+    # Recorded after the delta of the first manager, which is applied first
+    second.apply_delta(delta({"op": "MOD", "entity": renamed}) + [b"{not json"])
+    assert second.deltas == 2 and entities[0]["id"] not in second.generation.positions
+
+    assert first.sync_deltas()
+    assert first.generation.version == second.generation.version
+    position = first.generation.positions[entities[1]["id"]]
+    assert first.generation.store.hydrate(position).caption == "Zzyzx Qwerty"
+    # Nothing new: same generation
+    active = first.generation
+    assert first.sync_deltas() and first.generation is active
+
+def test_deltas_survive_reload_and_restart(export, managers):
+    path, entities = export
+    first = loaded(path)
+    managers.append(first)
+    first.apply_delta(delta({"op": "DEL", "entity": {"id": entities[3]["id"]}},
+                            {"op": "ADD", "entity": dict(entities[4], id="D-1")}))
+    version = first.generation.version
+    assert first.reload() and first.generation.version == version
+    restarted = loaded(path)
+    managers.append(restarted)
+    assert restarted.generation.version == version and "D-1" in restarted.generation.positions
+
+def test_delta_cut_short_is_ignored(export, managers):
+    path, entities = export
+    first = loaded(path)
+    managers.append(first)
+    first.apply_delta(delta({"op": "DEL", "entity": {"id": entities[3]["id"]}}))
+    version = first.generation.version
+    # A crash in the middle of an append
+    with open(first.journal.path, "ab") as f:
+        f.write(b'{"delta": {"lines": 3}}\n{"op"')
+    restarted = loaded(path)
+    managers.append(restarted)
+    assert restarted.generation.version == version
+    # ...and overwritten by the next one
+    restarted.apply_delta(delta({"op": "DEL", "entity": {"id": entities[5]["id"]}}))
+    assert first.sync_deltas() and first.generation.version == restarted.generation.version
+    again = loaded(path)
+    managers.append(again)
+    assert again.generation.version == restarted.generation.version
+
+def test_new_export_discards_the_journal(export, managers):
+    path, entities = export
+    first, second = loaded(path), loaded(path)
+    managers += [first, second]
+    first.apply_delta(delta({"op": "DEL", "entity": {"id": entities[3]["id"]}}))
+    assert second.sync_deltas()
+
+    time.sleep(0.01)
+    write_export(path, entities + [dict(synthetic_entities(1, seed=3)[0], id="N-1")])
+    # Rebuilt from the new export before the delta is recorded on top of it
+    second.apply_delta(delta({"op": "DEL", "entity": {"id": entities[5]["id"]}}))
+    assert entities[3]["id"] in second.generation.positions
+    assert entities[5]["id"] not in second.generation.positions
+
+    fresh = loaded(path)
+    managers.append(fresh)
+    assert fresh.generation.version == second.generation.version
+    assert first.sync_deltas() and first.generation.version == second.generation.version
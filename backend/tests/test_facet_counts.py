@@ -0,0 +1,21 @@
+# test_facet_counts.py
+
+def facets(api, **params):
+    response = api.get("/verify_identity", params={"name": "John", "surname": "Smith", "threshold": 60, **params})
+    assert response.status_code == 200
+    return response.json()
+
+def test_counts_cover_matches_beyond_top_n(api):
+    everything = facets(api, top_n=1000)
+    assert len(everything["matches"]) > 3
+    first = facets(api, top_n=3)
+    assert len(first["matches"]) == 3
+    assert first["facets"] == everything["facets"]
+    # Every match is in at least one dataset
+    assert sum(everything["facets"]["datasets"].values()) >= len(everything["matches"])
+
+def test_counts_follow_the_facet_filters(api):
+    only = facets(api, top_n=1, datasets="us_ofac_sdn")
+    assert only["facets"]["datasets"]["us_ofac_sdn"] == len(facets(api, top_n=1000, datasets="us_ofac_sdn")["matches"])
+    without = facets(api, top_n=1, datasets="-us_ofac_sdn")
+    assert "us_ofac_sdn" not in without["facets"]["datasets"]
@@ -0,0 +1,83 @@
+# test_identifiers.py
+
+import json
+
+import pytest
+
+from data_ingestion import entry_identifiers, load_dataset, normalize_identifier
+from matching import compile_query
+from search_index import KeyIndex
+from sharded_scoring import ShardedScreener
+
+@pytest.fixture(scope="module")
+def screened(dataset_file):
+    """Records of the synthetic dataset, their raw entries and an in-process screener."""
+    records = load_dataset(dataset_file)
+    with open(dataset_file, encoding="utf-8") as f:
+        entries = [json.loads(line) for line in f]
+    screener = ShardedScreener(records, shards=1)
+    yield records, entries, screener
+    screener.close()
+
+def passport_holder(entries):
+    """Position and entry of the first person with a passport number."""
+    return next((i, e) for i, e in enumerate(entries) if e["properties"].get("passportNumber"))
+
+def test_identifiers_are_normalized():
+    assert normalize_identifier("P 230-15") == "p23015"
+    assert normalize_identifier("ÄB.12/3") == "ab123"
+    assert normalize_identifier(None) == ""
+
+def test_nested_identification_numbers_are_indexed():
+    entry = {"properties": {"passportNumber": ["AB 123"], "idNumber": ["ab-123"],
+                            "identification": [{"schema": "Passport", "properties": {"number": ["X9 99"]}},
+                                               {"schema": "Address", "properties": {"number": ["12"]}}]}}
+    assert entry_identifiers(entry) == ("ab123", "x999")
+
+def test_key_index_needs_record_keys():
+    with pytest.raises(TypeError):
+        KeyIndex()
+
+def test_lookup_finds_the_holder_whatever_the_spelling(screened):
+    records, entries, screener = screened
+    position, entry = passport_holder(entries)
+    number = entry["properties"]["passportNumber"][0]
+    spelled = f" {number[0].lower()}-{number[1:]} "
+    assert screener.lookup(spelled, None, True) == [(position, 100.0)]
+    assert screener.lookup(spelled, compile_query(""), True) == [(position, 100.0)]
+    # Only records of the selected type
+    assert screener.lookup(number, None, False) == []
+    assert screener.lookup("-", None, True) == []
+
+def test_lookup_scores_the_name(screened):
+    records, entries, screener = screened
+    position, entry = passport_holder(entries)
+    number = entry["properties"]["passportNumber"][0]
+    [(found, score)] = screener.lookup(number, compile_query(entry["caption"]), True)
+    assert found == position and score == 100.0
+    [(found, score)] = screener.lookup(number, compile_query("Zzyzx Qwerty", 90), True)
+    # Returned whatever the threshold
+    assert found == position and score < 90
+
+def test_lookup_applies_the_query_filters(screened):
+    records, entries, screener = screened
+    position, entry = passport_holder(entries)
+    number = entry["properties"]["passportNumber"][0]
+    excluded = {"datasets": [f"-{entry['datasets'][0]}"]}
+    assert screener.lookup(number, compile_query("", facets=excluded), True) == []
+    selected = {"datasets": [entry["datasets"][0]]}
+    assert screener.lookup(number, compile_query("", facets=selected), True) == [(position, 100.0)]
+    birth_date = entry["properties"].get("birthDate")
+    if birth_date:
+        other_year = int(birth_date[0][:4]) + 20
+        assert screener.lookup(number, compile_query("", birth_date=str(other_year)), True) == []
+        assert screener.lookup(number, compile_query("", birth_date=birth_date[0]), True) == [(position, 100.0)]
+
+def test_identifier_route_applies_the_filters(api, screened):
+    records, entries, screener = screened
+    position, entry = passport_holder(entries)
+    number = entry["properties"]["passportNumber"][0]
+    response = api.get(f"/verify_identity?identifier={number}")
+    assert [(m["details"]["id"], m["identifier_match"]) for m in response.json()["matches"][:1]] == [(entry["id"], True)]
+    response = api.get(f"/verify_identity?identifier={number}&datasets=-{entry['datasets'][0]}")
+    assert response.status_code == 200 and response.json()["matches"] == []
@@ -0,0 +1,70 @@
+# test_ingestion.py
+
+import gzip
+import json
+
+import pytest
+
+import data_ingestion
+from data_ingestion import byte_ranges, load_dataset
+from record_store import RecordStore
+
+def summary(record) -> tuple:
+    return (record.id, record.caption, record.schema, record.name, record.surname, record.datasets,
+            record.countries, record.topics, record.identifiers, record.birth_dates)
+
+@pytest.fixture
+def dataset_with_errors(tmp_path, dataset_file):
+    """The synthetic dataset with malformed and blank lines mixed in."""
+    lines = open(dataset_file, "rb").read().splitlines()
+    lines[10:10] = [b"{not json", b"", b'{"id": 5}']
+    path = tmp_path / "errors.jsonl"
+    path.write_bytes(b"\n".join(lines) + b"\n")
+    return str(path)
+
+def test_byte_ranges_cut_at_line_starts(dataset_file):
+    data = open(dataset_file, "rb").read()
+    ranges = byte_ranges(dataset_file, 5000)
+    assert len(ranges) > 10
+    assert ranges[0][0] == 0 and ranges[-1][1] == len(data)
+    assert all(end == next_start for (_, end), (next_start, _) in zip(ranges, ranges[1:]))
+    assert all(data[start - 1:start] == b"\n" for start, _ in ranges[1:])
+
+def test_parallel_load_matches_serial(dataset_with_errors, monkeypatch):
+    monkeypatch.setattr(data_ingestion, "INGEST_WORKERS", 1)
+    serial_store = RecordStore(dataset_with_errors)
+    serial = load_dataset(dataset_with_errors, serial_store)
+
+    split = data_ingestion.byte_ranges
+    monkeypatch.setattr(data_ingestion, "byte_ranges", lambda path: split(path, 3000))
+    monkeypatch.setattr(data_ingestion, "INGEST_WORKERS", 3)
+    parallel_store = RecordStore(dataset_with_errors)
+    parallel = load_dataset(dataset_with_errors, parallel_store)
+
+    assert len(serial) == 600
+    assert [summary(r) for r in parallel] == [summary(r) for r in serial]
+    assert list(parallel_store.offsets) == list(serial_store.offsets)
+    assert [parallel_store.raw_bytes(p) for p in range(600)] == [serial_store.raw_bytes(p) for p in range(600)]
+
+def test_gzip_dataset_loads_like_the_plain_file(dataset_with_errors, tmp_path, monkeypatch):
+    monkeypatch.setattr(data_ingestion, "INGEST_BATCH_LINES", 64)
+    plain = load_dataset(dataset_with_errors)
+    path = tmp_path / "dataset.jsonl.gz"
+    path.write_bytes(gzip.compress(open(dataset_with_errors, "rb").read()))
+    store = RecordStore(str(path))
+    compressed = load_dataset(str(path), store)
+    assert [summary(r) for r in compressed] == [summary(r) for r in plain]
+    assert json.loads(store.raw_bytes(599))["id"] == plain[599].id
+
+def test_zstd_dataset_loads_like_the_plain_file(dataset_file, tmp_path):
+    zstandard = pytest.importorskip("zstandard")
+    path = tmp_path / "dataset.jsonl.zst"
+    path.write_bytes(zstandard.ZstdCompressor().compress(open(dataset_file, "rb").read()))
+    assert [summary(r) for r in load_dataset(str(path))] == [summary(r) for r in load_dataset(dataset_file)]
+
+def test_zstd_without_the_package_is_reported(tmp_path, monkeypatch):
+    monkeypatch.setattr(data_ingestion, "zstandard", None)
+    path = tmp_path / "dataset.jsonl.zst"
+    path.write_bytes(b"\x28\xb5\x2f\xfd" + b"\0" * 16)
+    with pytest.raises(RuntimeError, match="zstandard"):
+        load_dataset(str(path))
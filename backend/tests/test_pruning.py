@@ -0,0 +1,41 @@
+# test_pruning.py
+
+import random
+
+import numpy as np
+from rapidfuzz import fuzz
+
+import sharded_scoring
+from data_ingestion import load_dataset
+from matching import compile_query, match_record
+from search_index import ratio_length_bounds
+from sharded_scoring import ShardScreener
+
+def test_length_bounds_never_exclude_a_reachable_ratio():
+    rng = random.Random(3)
+    for _ in range(2000):
+        a = "".join(rng.choice("abc") for _ in range(rng.randint(1, 12)))
+        b = "".join(rng.choice("abc") for _ in range(rng.randint(1, 12)))
+        score = fuzz.ratio(a, b)
+        low, high = ratio_length_bounds(len(a), score)
+        assert low <= len(b) <= high, (a, b, score)
+
+def test_upper_bounds_are_never_below_the_real_score(dataset_file):
+    records = load_dataset(dataset_file)
+    shard = ShardScreener(records)
+    positions = np.arange(len(records))
+    for text in ["John Smith", "Kim", "Neva Steel AO", "Mohamed Al Assad"]:
+        for use_phonetic in (False, True):
+            query = compile_query(text, 0, use_phonetic)
+            bounds = shard.engine.upper_bounds(query, positions)
+            scores = [match_record(query, record, use_phonetic) for record in records]
+            assert all(bound >= score - 1e-9 for bound, score in zip(bounds.tolist(), scores)), text
+
+def test_top_n_search_stops_early(dataset_file, monkeypatch):
+    monkeypatch.setattr(sharded_scoring, "SCREEN_CHUNK", 16)
+    shard = ShardScreener(load_dataset(dataset_file))
+    query = compile_query("Jon Smyth", 0)
+    top, _, scored_top = shard.screen(query, True, 3)
+    full, _, scored_full = shard.screen(query, True, 1000)
+    assert scored_top < scored_full
+    assert top == full[:3]
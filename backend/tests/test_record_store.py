@@ -0,0 +1,95 @@
+# test_record_store.py
+
+import os
+import gzip
+import json
+
+import pytest
+
+from data_ingestion import load_dataset
+from record_store import DatasetChangedError, PackedLines, PositionIndex, RecordStore
+from conftest import synthetic_entities
+
+@pytest.fixture
+def small_dataset(tmp_path):
+    """Five entities with a malformed line in between, and their lines."""
+    lines = [json.dumps(item, ensure_ascii=False).encode("utf-8") for item in synthetic_entities(5)]
+    path = tmp_path / "small.jsonl"
+    path.write_bytes(b"\n".join(lines[:2] + [b"{not json"] + lines[2:]) + b"\n")
+    return str(path), lines
+
+def test_records_are_read_back_from_the_mapped_file(small_dataset):
+    path, lines = small_dataset
+    store = RecordStore(path)
+    records = load_dataset(path, store)
+    assert len(store) == len(records) == 5
+    assert [store.raw_bytes(p) for p in range(5)] == lines
+    assert store.raw(3) == json.loads(lines[3])
+    hydrated = store.hydrate(1)
+    assert hydrated.id == records[1].id and hydrated.properties == json.loads(lines[1])["properties"]
+    store.close()
+
+def test_extended_copy_leaves_the_original_unchanged(small_dataset, tmp_path):
+    path, lines = small_dataset
+    store = RecordStore(path)
+    load_dataset(path, store)
+    added = json.dumps({"id": "D-1", "caption": "Added"}).encode("utf-8")
+    other = store.extended([added])
+    assert len(other) == 6 and len(store) == 5
+    assert other.raw_bytes(5) == added
+
+    # The copy keeps its own mapping of the file, even once it is replaced by rename
+    replacement = tmp_path / "replacement.jsonl"
+    replacement.write_bytes(b"{}\n")
+    os.replace(replacement, path)
+    store.close()
+    assert other.raw_bytes(0) == lines[0]
+    other.close()
+
+def test_file_overwritten_in_place_raises(small_dataset):
+    path, lines = small_dataset
+    store = RecordStore(path)
+    load_dataset(path, store)
+    data = open(path, "rb").read()
+    first, second = json.loads(lines[0])["id"], json.loads(lines[1])["id"]
+    # Same size, other entity ids: the mapping sees the new bytes
+    with open(path, "r+b") as f:
+        f.write(data.replace(first.encode(), b"X" * len(first)).replace(second.encode(), b"Y" * len(second)))
+    with pytest.raises(DatasetChangedError):
+        store.raw_bytes(0)
+    with pytest.raises(DatasetChangedError):
+        store.hydrate(1)
+    store.close()
+
+def test_truncated_file_raises_instead_of_faulting(small_dataset):
+    path, _ = small_dataset
+    store = RecordStore(path)
+    load_dataset(path, store)
+    with open(path, "r+b") as f:
+        f.truncate(10)
+    with pytest.raises(DatasetChangedError):
+        store.raw_bytes(4)
+    store.close()
+
+def test_compressed_dataset_keeps_its_lines_in_memory(small_dataset, tmp_path):
+    _, lines = small_dataset
+    path = tmp_path / "small.jsonl.gz"
+    path.write_bytes(gzip.compress(b"\n".join(lines) + b"\n"))
+    store = RecordStore(str(path))
+    load_dataset(str(path), store)
+    assert store.blobs is not None
+    assert [store.raw_bytes(p) for p in range(5)] == lines
+
+def test_packed_lines():
+    packed = PackedLines.pack([b"a", b"", b"ccc"])
+    assert list(packed) == [b"a", b"", b"ccc"]
+    copy = packed.copy()
+    copy.append(b"dd")
+    assert len(packed) == 3 and list(copy) == [b"a", b"", b"ccc", b"dd"]
+    with pytest.raises(IndexError):
+        packed[3]
+
+def test_position_index_keeps_the_last_position_of_a_repeated_id():
+    index = PositionIndex.build(["b", "a", "b", "c"])
+    assert dict(index) == {"a": 1, "b": 2, "c": 3}
+    assert "d" not in index
@@ -0,0 +1,50 @@
+# test_screening_cache.py
+
+import screening_cache
+from screening_cache import ScreeningCache
+
+def test_least_recently_used_entry_is_evicted():
+    cache = ScreeningCache(maxsize=2, ttl=60)
+    cache.put("v1", "a", 1)
+    cache.put("v1", "b", 2)
+    assert cache.get("v1", "a") == 1
+    cache.put("v1", "c", 3)
+    assert cache.get("v1", "b") is None
+    assert cache.get("v1", "a") == 1
+    assert cache.get("v1", "c") == 3
+    assert cache.stats()["evictions"] == 1
+
+def test_entries_expire_after_the_ttl(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(screening_cache.time, "monotonic", lambda: now[0])
+    cache = ScreeningCache(maxsize=10, ttl=30)
+    cache.put("v1", "a", 1)
+    now[0] += 29
+    assert cache.get("v1", "a") == 1
+    now[0] += 2
+    assert cache.get("v1", "a") is None
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["expired"], stats["size"]) == (1, 1, 1, 0)
+
+def test_versions_never_share_or_clear_entries():
+    cache = ScreeningCache(maxsize=10, ttl=60)
+    cache.put("new", "query", "new result")
+    # A request still running on the replaced generation
+    assert cache.get("old", "query") is None
+    cache.put("old", "query", "old result")
+    assert cache.get("new", "query") == "new result"
+    assert cache.get("old", "query") == "old result"
+    assert cache.stats()["dataset_versions"] == 2
+
+def test_size_zero_disables_the_cache():
+    cache = ScreeningCache(maxsize=0, ttl=60)
+    cache.put("v1", "a", 1)
+    assert cache.get("v1", "a") is None
+    assert cache.stats()["size"] == 0
+
+def test_clear_drops_every_version():
+    cache = ScreeningCache(maxsize=10, ttl=60)
+    cache.put("v1", "a", 1)
+    cache.put("v2", "a", 2)
+    cache.clear()
+    assert cache.get("v1", "a") is None and cache.get("v2", "a") is None
@@ -0,0 +1,195 @@
+# test_screening_equivalence.py
+# The indexed and sharded screening must rank exactly like scoring every
+# record with match_record: the n-gram, deletion and phonetic candidate
+# indexes, the length bounds and the top-N heap cutoff only ever skip records that cannot
+# make the ranking, and merging the shard lists gives that of a single scan;
+# also for shards mapped from a snapshot and after a delta updated the shards.
+
+import json
+from typing import Dict, Iterator, List, Tuple
+
+import pytest
+
+import sharded_scoring
+from data_ingestion import load_dataset, parse_delta
+from dataset_manager import DatasetGeneration, derive_generation
+from matching import compile_query, match_record
+from record_store import RecordStore
+from search_index import FACETS
+from sharded_scoring import SANCTIONS_SHARDS, ShardedScreener, rank_key
+from snapshot import attach_snapshot, build_snapshot
+from conftest import synthetic_entities
+
+QUERIES = [
+    "John Smith", "Smith John", "Jon Smyth", "Mohamed Al Assad", "Muhammad Hussein", "Olga Petrova",
+    "Kim Kim", "Kim", "Wei", "Wie", "Olag", "Ivnov", "Sergei Kadirov", "Kadyrov",
+    "Иван Иванов", "Γιώργος Παπαδόπουλος", "Пападопулос", "Neva Steel", "Atlas Trading LLC", "Polar Marine Ltd",
+]
+THRESHOLDS = [0, 50, 70, 85, 100]
+TOP_N = [1, 3, 10, 1000, 0]
+
+# (dataset position, record, match_record score) of every live record
+Scored = List[Tuple[int, object, float]]
+
+def reference_matches(query, person: bool, top_n: int, scored: Scored,
+                      allowed=lambda record: True) -> List[Tuple[int, float]]:
+    """Brute-force ranking: every live record of the type that passes `allowed`, scored by match_record."""
+    matches = [(position, score) for position, record, score in scored
+               if score >= query.threshold and (record.schema.lower() == "person") == person and allowed(record)]
+    matches.sort(key=rank_key)
+    # Same slice as verify_identity's full scan, including top_n <= 0
+    return matches[:top_n]
+
+def brute_force_scores(generation: DatasetGeneration, text: str, use_phonetic: bool) -> Scored:
+    """Every live record scored against `text` by match_record."""
+    query = compile_query(text, use_phonetic=use_phonetic)
+    records = [(position, generation.records[position]) for position in generation.positions.values()]
+    return [(position, record, match_record(query, record, use_phonetic)) for position, record in records]
+
+def assert_same_ranking(generation: DatasetGeneration, actual, expected, label: str) -> None:
+    assert [generation.records[p].id for p, _ in actual] == [generation.records[p].id for p, _ in expected], label
+    assert [s for _, s in actual] == pytest.approx([s for _, s in expected], abs=1e-6), label
+
+def in_memory(dataset_file: str, shards: int) -> DatasetGeneration:
+    store = RecordStore(dataset_file)
+    records = load_dataset(dataset_file, store)
+    return DatasetGeneration(records, store, ShardedScreener(records, shards=shards))
+
+def from_snapshot(dataset_file: str) -> DatasetGeneration:
+    path = f"{dataset_file}.test.snapshot"
+    build_snapshot(dataset_file, path, SANCTIONS_SHARDS)
+    loaded = attach_snapshot(path, dataset_file)
+    assert loaded is not None
+    screener = ShardedScreener(loaded.records, screeners=loaded.screeners, snapshot=loaded.snapshot)
+    return DatasetGeneration(loaded.records, loaded.store, screener, positions=loaded.positions, version=loaded.version)
+
+def delta_lines(generation: DatasetGeneration) -> List[bytes]:
+    """Deletes, renames and additions spread over every shard, plus a line that is not JSON."""
+    ids = list(generation.positions)
+    lines = [{"op": "DEL", "entity": {"id": entity_id}} for entity_id in ids[::23]]
+    for entity_id in ids[5::31]:
+        item = json.loads(generation.store.raw_bytes(generation.positions[entity_id]))
+        if item["schema"] == "Person":
+            item["caption"], item["properties"]["name"] = "John Smith", ["John Smith"]
+            item["properties"]["firstName"], item["properties"]["lastName"] = ["John"], ["Smith"]
+        else:
+            item["caption"], item["properties"]["name"] = "Neva Steel AO", ["Neva Steel AO"]
+        lines.append({"op": "MOD", "entity": item})
+    for i, item in enumerate(synthetic_entities(40, seed=11)):
+        item["id"] = f"D-{i}"
+        lines.append({"op": "ADD", "entity": item})
+    return [json.dumps(line, ensure_ascii=False).encode("utf-8") for line in lines] + [b"{not json"]
+
+@pytest.fixture(scope="module", params=[1, 3, "snapshot"], ids=["1-shard", "3-shards", "snapshot"])
+def generations(request, dataset_file) -> Iterator[Tuple[DatasetGeneration, DatasetGeneration]]:
+    """
+    The synthetic dataset loaded into memory, screened in-process or by 3
+    worker processes, or mapped from a snapshot, and the generation after a
+    delta. Top-N searches of
+    in-process shards go in chunks of 16 records, so that the heap cutoff
+    ends them early.
+    """
+    with pytest.MonkeyPatch.context() as patch:
+        patch.setattr(sharded_scoring, "SCREEN_CHUNK", 16)
+        if request.param == "snapshot":
+            generation = from_snapshot(dataset_file)
+        else:
+            generation = in_memory(dataset_file, request.param)
+        operations, malformed = parse_delta(delta_lines(generation))
+        assert malformed == 1
+        derived, changes = derive_generation(generation, operations)
+        assert changes.deleted and changes.modified and changes.added
+        yield generation, derived
+        derived.screener.close()
+        generation.screener.close()
+
+@pytest.mark.parametrize("delta", [False, True], ids=["loaded", "after-delta"])
+@pytest.mark.parametrize("use_phonetic", [False, True], ids=["text", "phonetic"])
+def test_screen_matches_brute_force(generations, delta, use_phonetic):
+    generation = generations[1] if delta else generations[0]
+    for text in QUERIES:
+        scored = brute_force_scores(generation, text, use_phonetic)
+        for threshold in THRESHOLDS:
+            query = compile_query(text, threshold, use_phonetic)
+            for person in (True, False):
+                for top_n in TOP_N:
+                    matches, found, _ = generation.screener.screen(query, person, top_n)
+                    expected = reference_matches(query, person, top_n, scored)
+                    label = f"{text!r} threshold={threshold} person={person} top_n={top_n}"
+                    assert_same_ranking(generation, matches, expected, label)
+                    if top_n <= 0:
+                        assert found == len(reference_matches(query, person, len(scored), scored)), label
+
+def test_old_generation_unchanged_by_delta(generations):
+    generation, derived = generations
+    deleted = [entity_id for entity_id in generation.positions if entity_id not in derived.positions]
+    record = generation.records[generation.positions[deleted[0]]]
+    query = compile_query(record.caption, 100)
+    person = record.schema.lower() == "person"
+    old_ids = {generation.records[p].id for p, _ in generation.screener.screen(query, person, 1000)[0]}
+    new_ids = {derived.records[p].id for p, _ in derived.screener.screen(query, person, 1000)[0]}
+    assert deleted[0] in old_ids
+    assert deleted[0] not in new_ids
+
+def born_in(years: List[int]):
+    return lambda record: not record.birth_dates or any(date[:4] in {str(y) for y in years} for date in record.birth_dates)
+
+def agreeing_with(birth_date: str):
+    """Records without a birth date or with one that is a prefix of `birth_date` or has it as a prefix."""
+    return lambda record: not record.birth_dates or any(
+        date.startswith(birth_date) or birth_date.startswith(date) for date in record.birth_dates)
+
+def linked_to(country: str):
+    return lambda record: not record.countries or country in [c.lower() for c in record.countries]
+
+def with_facets(facets: Dict[str, List[str]]):
+    def allowed(record) -> bool:
+        for facet, values in facets.items():
+            carried = {value.lower() for value in getattr(record, facet)}
+            included = [v for v in values if not v.startswith("-")]
+            if included and not carried.intersection(included):
+                return False
+            if carried.intersection(v[1:] for v in values if v.startswith("-")):
+                return False
+        return True
+    return allowed
+
+FILTERS = [
+    ({"birth_year": 1970}, born_in([1969, 1970, 1971])),
+    ({"birth_date": "1975"}, agreeing_with("1975")),
+    ({"birth_date": "1980-03"}, agreeing_with("1980-03")),
+    ({"country": "RU"}, linked_to("ru")),
+    ({"facets": {"datasets": ["us_ofac_sdn"]}}, with_facets({"datasets": ["us_ofac_sdn"]})),
+    ({"facets": {"topics": ["-sanction"], "countries": ["sy", "ir"]}},
+     with_facets({"topics": ["-sanction"], "countries": ["sy", "ir"]})),
+    ({"birth_year": 1980, "country": "by"}, lambda record: born_in([1979, 1980, 1981])(record) and linked_to("by")(record)),
+]
+
+@pytest.mark.parametrize("filters,allowed", FILTERS, ids=[json.dumps(f) for f, _ in FILTERS])
+def test_filtered_screen_matches_brute_force(generations, filters, allowed):
+    for generation in generations:
+        for text in QUERIES[::2]:
+            scored = brute_force_scores(generation, text, False)
+            for threshold in (0, 70):
+                query = compile_query(text, threshold, **filters)
+                for person in (True, False):
+                    for top_n in (3, 1000):
+                        matches, _, _ = generation.screener.screen(query, person, top_n)
+                        expected = reference_matches(query, person, top_n, scored, allowed)
+                        assert_same_ranking(generation, matches, expected, f"{text!r} threshold={threshold} {filters}")
+
+def test_facet_counts_cover_every_match(generations):
+    for generation in generations:
+        extra = sorted(generation.positions.values())[::97]
+        for text in QUERIES[::3]:
+            scored = brute_force_scores(generation, text, False)
+            for threshold in (50, 85):
+                query = compile_query(text, threshold)
+                for person in (True, False):
+                    matched = {p for p, _ in reference_matches(query, person, len(scored), scored)} | set(extra)
+                    expected: Dict[str, Dict[str, int]] = {facet: {} for facet in FACETS}
+                    for position in matched:
+                        for facet in FACETS:
+                            for value in {v.lower() for v in getattr(generation.records[position], facet)}:
+                                expected[facet][value] = expected[facet].get(value, 0) + 1
+                    assert generation.screener.facet_counts(extra, query, person) == expected, f"{text!r} {threshold}"
@@ -0,0 +1,55 @@
+# test_sharded_scoring.py
+
+import threading
+
+import pytest
+
+import sharded_scoring
+from data_ingestion import load_dataset
+from matching import compile_query
+from sharded_scoring import ShardedScreener, shard_ranges
+
+def test_shard_ranges_cover_every_record():
+    assert shard_ranges(10, 3) == [(0, 4), (4, 8), (8, 10)]
+    assert shard_ranges(2, 5) == [(0, 1), (1, 2)]
+    assert shard_ranges(0, 3) == [(0, 0)]
+
+def test_broken_workers_fall_back_to_one_in_process_shard(dataset_file, monkeypatch):
+    records = load_dataset(dataset_file)
+    screener = ShardedScreener(records, shards=2)
+    query = compile_query("John Smith", 70)
+    expected = screener.screen(query, True, 5)
+
+    builds = []
+    original = sharded_scoring.ShardScreener
+    def counting_shard(*args, **kwargs):
+        builds.append(args)
+        return original(*args, **kwargs)
+    monkeypatch.setattr(sharded_scoring, "ShardScreener", counting_shard)
+
+    # Requests hitting the stopped pools at once must build the fallback only once
+    for pool in screener.pools:
+        pool.shutdown()
+    start = threading.Barrier(6)
+    results = []
+    def screen():
+        start.wait()
+        results.append(screener.screen(query, True, 5))
+    threads = [threading.Thread(target=screen) for _ in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(builds) == 1
+    assert results == [expected] * 6
+    screener.close()
+
+@pytest.mark.parametrize("shards", [1, 3])
+def test_screen_many_matches_screen(dataset_file, shards):
+    records = load_dataset(dataset_file)
+    screener = ShardedScreener(records, shards=shards)
+    queries = [compile_query(text, 60) for text in ["John Smith", "Neva Steel", "Olga", "Kadyrov", "Atlas Trading LLC"]]
+    persons = [True, False, True, True, False]
+    assert screener.screen_many(queries, persons, 5) == [screener.screen(q, p, 5) for q, p in zip(queries, persons)]
+    screener.close()
@@ -0,0 +1,45 @@
+# test_snapshot.py
+
+import os
+import shutil
+
+import pytest
+
+import snapshot
+from mapped_pickle import load_mapped
+from snapshot import attach_snapshot, build_snapshot, open_dataset
+
+@pytest.fixture
+def dataset(tmp_path, dataset_file):
+    """A copy of the synthetic dataset with its snapshot built next to it."""
+    path = str(tmp_path / "dataset.jsonl")
+    shutil.copy(dataset_file, path)
+    build_snapshot(path, f"{path}.snapshot")
+    return path
+
+def test_snapshot_is_written_without_group_or_other_write_access(dataset):
+    assert os.stat(f"{dataset}.snapshot").st_mode & 0o022 == 0
+    loaded = attach_snapshot(f"{dataset}.snapshot", dataset)
+    assert loaded is not None and len(loaded.records) == 600
+    loaded.store.close()
+
+def test_writable_snapshot_is_refused_and_rebuilt(dataset, monkeypatch):
+    path = f"{dataset}.snapshot"
+    os.chmod(path, 0o666)
+    with pytest.raises(PermissionError):
+        load_mapped(path)
+    assert attach_snapshot(path, dataset) is None
+
+    monkeypatch.setattr(snapshot, "SNAPSHOT_ON_START", True)
+    loaded = open_dataset(dataset)
+    assert loaded.snapshot is not None and len(loaded.records) == 600
+    assert os.stat(path).st_mode & 0o022 == 0
+    loaded.store.close()
+
+@pytest.mark.skipif(not hasattr(os, "geteuid") or os.geteuid() != 0, reason="changing the owner needs root")
+def test_snapshot_of_another_user_is_refused(dataset):
+    path = f"{dataset}.snapshot"
+    os.chown(path, 12345, -1)
+    with pytest.raises(PermissionError):
+        load_mapped(path)
+    assert attach_snapshot(path, dataset) is None
@@ -0,0 +1,90 @@
+# test_tfidf.py
+
+import json
+import math
+
+import pytest
+
+from data_ingestion import load_dataset
+from matching import compile_query, match_record
+from search_index import TfidfIndex, tfidf_grams, tfidf_texts
+from sharded_scoring import ShardScreener
+
+COMPANIES = ["Atlas Trading LLC", "Neva Trading", "Global Trading Ltd", "Atlas Marine", "Orient Trading",
+             "Polar Trading", "Delta Trading", "Atlas Trading International"]
+
+def company(index: int, name: str):
+    return {"id": f"C-{index}", "caption": name, "schema": "Company", "properties": {"name": [name]},
+            "datasets": ["us_ofac_sdn"], "target": True}
+
+def indexed(records) -> TfidfIndex:
+    index = TfidfIndex()
+    index.fit(records)
+    for position, record in enumerate(records):
+        index.add_record(record, position)
+    return index
+
+def nearest(index: TfidfIndex, text: str, limit: int):
+    return index.nearest(compile_query(text), limit, lambda positions: positions).tolist()
+
+@pytest.fixture(scope="module")
+def companies(tmp_path_factory):
+    path = tmp_path_factory.mktemp("tfidf") / "companies.jsonl"
+    path.write_text("".join(json.dumps(company(i, name)) + "\n" for i, name in enumerate(COMPANIES)))
+    return load_dataset(str(path))
+
+@pytest.fixture(scope="module")
+def synthetic(dataset_file):
+    return load_dataset(dataset_file)
+
+def test_grams_ignore_word_order():
+    assert sorted(tfidf_grams("neva steel")) == sorted(tfidf_grams("steel neva"))
+    assert tfidf_grams("ab") == [" ab", "ab "]
+
+def test_common_grams_weigh_less(companies):
+    index = indexed(companies)
+    weights = index.weights("atlas trading")
+    assert max(weights[g] for g in tfidf_grams("trading")) < min(weights[g] for g in tfidf_grams("atlas"))
+
+def test_distinctive_words_rank_first(companies):
+    index = indexed(companies)
+    # Sharing "trading" with six names counts less than sharing "atlas" with three
+    assert set(nearest(index, "Atlas Holding", 3)) == {0, 3, 7}
+    assert nearest(index, "Neva Trading", 1) == [1]
+
+def test_nearest_ranks_by_cosine_of_the_closest_name(synthetic):
+    index = indexed(synthetic)
+    for text in ["John Smith", "Neva Steel", "Atlas Trading", "Olga Petrova", "Kadyrov"]:
+        weights = index.weights(compile_query(text).text)
+        norm = math.sqrt(sum(w * w for w in weights.values()))
+        similarity = {}
+        for position, record in enumerate(synthetic):
+            for name in tfidf_texts(record):
+                other = index.weights(name)
+                dot = sum(w * other[g] for g, w in weights.items() if g in other)
+                other_norm = math.sqrt(sum(w * w for w in other.values()))
+                if dot:
+                    similarity[position] = max(similarity.get(position, 0), dot / norm / other_norm)
+        found = nearest(index, text, 10)
+        # The closest records, up to float32 rounding between near-equal ones
+        cutoff = sorted(similarity.values(), reverse=True)[len(found) - 1]
+        assert all(similarity[p] >= cutoff - 1e-5 for p in found), text
+        assert [similarity[p] for p in found] == pytest.approx(sorted((similarity[p] for p in found), reverse=True),
+                                                                abs=1e-5), text
+
+def test_added_names_are_found_and_removed_ones_are_not(companies):
+    index = indexed(companies[:6])
+    other = index.updated([(companies[0], 0)], [(companies[6], 6), (companies[7], 7)])
+    assert 0 in nearest(index, "Atlas Trading", 8) and 6 not in nearest(index, "Delta Trading", 8)
+    assert 0 not in nearest(other, "Atlas Trading", 8)
+    assert nearest(other, "Delta Trading", 1) == [6]
+
+def test_tfidf_retrieval_keeps_the_match_record_scores(synthetic):
+    shard = ShardScreener(synthetic)
+    for text in ["John Smith", "Atlas Trading LLC", "Olga Petrova"]:
+        for person in (True, False):
+            query = compile_query(text, 50, retrieval="tfidf")
+            matches, _, scored = shard.screen(query, person, 10)
+            assert scored <= query.tfidf_candidates
+            for position, score in matches:
+                assert score == pytest.approx(match_record(query, synthetic[position]), abs=1e-6)
@@ -0,0 +1,71 @@
+# test_token_cache.py
+
+import pickle
+
+import numpy as np
+import pytest
+
+from data_ingestion import load_dataset
+from matching import compile_query
+from sharded_scoring import ShardScreener
+from token_cache import TokenScoreCache, token_cache_stats
+
+def scores(value: float) -> np.ndarray:
+    """80 bytes of scores."""
+    return np.full(10, value)
+
+def test_least_recently_used_entries_go_first():
+    cache = TokenScoreCache(max_bytes=240)
+    for token in "abc":
+        cache.put(token, scores(1))
+    assert cache.get("a") is not None
+    cache.put("d", scores(2))
+    assert cache.get("b") is None
+    assert [cache.get(token) is not None for token in "acd"] == [True, True, True]
+    stats = cache.stats()
+    assert stats["entries"] == 3 and stats["bytes"] == 240 and stats["evictions"] == 1
+
+def test_replaced_and_oversized_entries_keep_the_size_right():
+    cache = TokenScoreCache(max_bytes=240)
+    cache.put("a", scores(1))
+    cache.put("a", scores(2))
+    cache.put("big", np.zeros(100))
+    assert cache.stats()["bytes"] == 80 and cache.get("big") is None
+    assert cache.get("a")[0] == 2
+    with pytest.raises(ValueError):
+        cache.get("a")[0] = 3
+
+def test_lookups_not_stored_are_not_misses():
+    cache = TokenScoreCache(max_bytes=240)
+    cache.get("a", miss=False)
+    cache.get("b")
+    cache.put("b", scores(1))
+    cache.get("b")
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["hit_rate"]) == (1, 1, 0.5)
+
+def test_copies_start_empty():
+    cache = TokenScoreCache(max_bytes=240)
+    cache.put("a", scores(1))
+    cache.get("a")
+    copy = pickle.loads(pickle.dumps(cache))
+    assert copy.max_bytes == 240 and copy.stats()["entries"] == 0 and copy.stats()["hits"] == 0
+
+def test_shard_counters_add_up():
+    shards = [{"entries": 2, "bytes": 160, "max_bytes": 240, "hits": 3, "misses": 1, "evictions": 0},
+              {"entries": 1, "bytes": 80, "max_bytes": 240, "hits": 0, "misses": 4, "evictions": 2}]
+    totals = token_cache_stats(shards)
+    assert totals["entries"] == 3 and totals["hits"] == 3 and totals["misses"] == 5 and totals["evictions"] == 2
+    assert totals["hit_rate"] == 0.375 and totals["shards"] == 2
+
+def test_memoized_scores_rank_like_fresh_ones(dataset_file):
+    records = load_dataset(dataset_file)
+    cached, fresh = ShardScreener(records), ShardScreener(records)
+    fresh.engine.token_cache = TokenScoreCache(max_bytes=0)
+    queries = [compile_query(text, 50, use_phonetic) for text in ("John Smith", "Smith Jon", "Olga Petrova")
+               for use_phonetic in (False, True)]
+    for _ in range(2):
+        for query in queries:
+            assert cached.screen(query, True, 0) == fresh.screen(query, True, 0)
+    assert cached.engine.token_cache.stats()["hits"] > 0
+    assert fresh.engine.token_cache.stats()["entries"] == 0
@@ -0,0 +1,47 @@
+# test_transliteration.py
+# The built-in romanization of Cyrillic (BGN/PCGN, plus the ICAO and scholarly
+# variants) and Greek (ELOT 743, plus the letter-by-letter and χ-as-h
+# variants); with PyICU installed, ICU's rules apply instead.
+
+import pytest
+
+import data_ingestion
+from data_ingestion import latin_variants, normalize_text, parse_record
+from matching import compile_query, match_record
+
+pytestmark = pytest.mark.skipif(data_ingestion.icu is not None, reason="PyICU romanizes instead of the built-in tables")
+
+@pytest.mark.parametrize("text,expected", [
+    ("Алексей Навальный", "aleksey navalnyy"),
+    ("Юлия Тимошенко", "yuliya timoshenko"),
+    ("Щукин Ёжиков", "shchukin ezhikov"),
+])
+def test_cyrillic_follows_bgn_pcgn(text, expected):
+    assert normalize_text(text) == expected
+
+@pytest.mark.parametrize("text,expected", [
+    ("Παπαδόπουλος", "papadopoulos"),
+    ("Ευάγγελος", "evangelos"),
+    ("Μπακογιάννης", "bakogiannis"),
+    ("Ντόρα", "dora"),
+    ("Αύγουστος", "avgoustos"),
+    ("Ευθύμιος", "efthymios"),
+    ("Χριστοδούλου", "christodoulou"),
+])
+def test_greek_follows_elot_743(text, expected):
+    assert normalize_text(text) == expected
+
+def test_other_romanizations_are_variants():
+    assert latin_variants("Алексей Навальный") == ["aleksei navalnyi", "aleksej navalnyj"]
+    assert latin_variants("Παπαδόπουλος") == ["papadopoylos"]
+    assert "hristodoulou" in latin_variants("Χριστοδούλου")
+    assert latin_variants("John Smith") == [] and latin_variants("Müller") == []
+
+def test_latin_letters_are_folded():
+    assert normalize_text("Müller Łukasz Straße") == "muller lukasz strasse"
+
+@pytest.mark.parametrize("query", ["Aleksey Navalnyy", "Aleksei Navalnyi", "Aleksej Navalnyj"])
+def test_any_romanization_matches_the_native_name(query):
+    record = parse_record({"id": "N-1", "caption": "Alexei Navalny", "schema": "Person",
+                           "properties": {"name": ["Alexei Navalny"], "alias": ["Алексей Навальный"]}})
+    assert match_record(compile_query(query), record) == 100
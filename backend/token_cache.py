@@ -0,0 +1,101 @@
+
+
+
+# token_cache.py
+
+import os
+import sys
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, List, Optional
+
+import numpy as np
+
+logger = logging.getLogger("ComplianceService")
+
+# Memory for memoized token scores, per scoring engine (MB; 0 disables the cache)
+TOKEN_CACHE_MB = float(os.getenv("TOKEN_CACHE_MB", "64"))
+
+class TokenScoreCache:
+    """
+    Bounded LRU memo of token-level similarity scores, shared by the request
+    threads scoring against one engine.
+
+    An entry holds the combined scores (fuzz.ratio, with the phonetic key when
+    enabled) of one query token against every distinct name of a name column,
+    keyed by (interned token, column, phonetic flag): all token pairs that
+    token can form, computed once. Entries are evicted least recently used
+    first once their arrays exceed the memory budget. Never pickled: a copy
+    sent to a worker process or written to a snapshot starts empty.
+    """
+
+    def __init__(self, max_bytes: int = int(TOKEN_CACHE_MB * 1024 * 1024)):
+        self.max_bytes = max_bytes
+        self.entries: "OrderedDict[Hashable, np.ndarray]" = OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __reduce__(self):
+        return (self.__class__, (self.max_bytes,))
+
+    @staticmethod
+    def key(token: str, column: str, use_phonetic: bool) -> Hashable:
+        """Cache key of a query token's scores against a name column."""
+        return (sys.intern(token), column, use_phonetic)
+
+    def get(self, key: Hashable, miss: bool = True) -> Optional[np.ndarray]:
+        """
+        Memoized scores for `key`, or None. Pass `miss` False when the caller
+        would not store the scores either, so that the lookup is not counted
+        as a miss.
+        """
+        with self.lock:
+            scores = self.entries.get(key)
+            if scores is None:
+                if miss:
+                    self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return scores
+
+    def put(self, key: Hashable, scores: np.ndarray) -> None:
+        """Store the scores for `key`, evicting the least recently used entries beyond the budget."""
+        if scores.nbytes > self.max_bytes:
+            return
+        scores.flags.writeable = False
+        with self.lock:
+            previous = self.entries.pop(key, None)
+            if previous is not None:
+                self.size -= previous.nbytes
+            self.entries[key] = scores
+            self.size += scores.nbytes
+            while self.size > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= evicted.nbytes
+                self.evictions += 1
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit and miss counters and current size."""
+        with self.lock:
+            return token_cache_stats([{
+                "entries": len(self.entries),
+                "bytes": self.size,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }])
+
+def token_cache_stats(shards: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Counters of several caches (one per shard) added up, with the overall hit rate."""
+    totals = {name: sum(shard[name] for shard in shards)
+              for name in ("entries", "bytes", "max_bytes", "hits", "misses", "evictions")}
+    lookups = totals["hits"] + totals["misses"]
+    totals["hit_rate"] = round(totals["hits"] / lookups, 4) if lookups else 0.0
+    totals["shards"] = len(shards)
+    return totals